@@ -3,3 +3,11 @@ from django.apps import AppConfig
 
 class NetworkConfig(AppConfig):
     name = 'network'
+
+    def ready(self):
+        # Connect the signal handlers keeping the full-text index up to date.
+        from . import signals  # noqa: F401
+        # Register the checks of the hot lookups and the transaction mode.
+        from . import checks  # noqa: F401
+        # Connect the hook tuning new SQLite connections.
+        from . import db  # noqa: F401
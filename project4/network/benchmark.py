@@ -0,0 +1,391 @@
+"""
+Seeded data and stand-in foreign servers for the benchmark command.
+
+generate() fills the database with users, posts, likes, comments, follows and
+blocks at a given scale. The same seed always gives the same rows, ids and
+timestamps included, so runs on different versions measure the same data.
+Local rows are bulk created, which skips the signal handlers, so the local
+posts are added to the full-text index, the hashtags and the home timelines of
+the followers of their authors explicitly, like the handlers would.
+
+FakePeer answers the federation endpoints of a foreign server from a thread of
+this process, with a fixed latency and a fixed number of posts of a fixed size,
+so the pages that call foreign servers do not depend on the network.
+"""
+
+import contextlib
+import datetime
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from . import fulltext, hashtags, servers, sync, timeline
+from .models import (
+    Follower,
+    ForeignComment,
+    ForeignLike,
+    ForeignServer,
+    ForeignUserBlocklist,
+    HomeTimelineEntry,
+    Post,
+    User,
+)
+
+# Number of rows inserted per query.
+BATCH_SIZE = 1000
+
+# Timestamp of the first generated post, the others follow a minute apart on average.
+EPOCH = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+WORDS = (
+    "federation server post timeline like comment follow block user profile "
+    "page cache query index feed peer remote local mirror batch stream merge "
+    "#django #python #fediverse #sqlite"
+).split()
+
+
+def _uuid(rng):
+    # A random UUID drawn from the seeded generator instead of the system.
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _text(rng, size):
+    # Words of the vocabulary, about size characters long.
+    words = []
+    length = 0
+    while length < size:
+        words.append(rng.choice(WORDS))
+        length += len(words[-1]) + 1
+    return " ".join(words)
+
+
+@contextlib.contextmanager
+def _generated_timestamps(*fields):
+    # Keeps the generated values of auto_now and auto_now_add fields in bulk_create.
+    saved = [(i, i.auto_now, i.auto_now_add) for i in fields]
+    for i in fields:
+        i.auto_now = i.auto_now_add = False
+    try:
+        yield
+    finally:
+        for i, auto_now, auto_now_add in saved:
+            i.auto_now = auto_now
+            i.auto_now_add = auto_now_add
+
+
+def peer_posts(index, count, size, seed=0):
+    """
+    Builds the posts of a stand-in foreign server, in the format of its federation/posts endpoint.
+
+    Parameters:
+    index (int): The number of the server, which names its users.
+    count (int): The number of posts.
+    size (int): The length of the content of each post in characters.
+    seed (int, optional): The seed of the posts. Defaults to 0.
+
+    Returns:
+    list: The posts, newest first.
+    """
+    rng = random.Random(f"{seed}-peer-{index}")
+    posts = []
+    for i in range(count):
+        timestamp = EPOCH + datetime.timedelta(minutes=i, seconds=rng.randrange(60))
+        post_id = str(_uuid(rng))
+        comments = [
+            {
+                "id": str(_uuid(rng)),
+                "server_id": None,
+                "user": f"peer{index}-user{rng.randrange(10)}",
+                "post_id": post_id,
+                "content": _text(rng, 40),
+                "timestamp": timeline.format_timestamp(timestamp),
+            }
+            for _ in range(rng.randrange(3))
+        ]
+        likes = rng.randrange(10)
+        posts.append(
+            {
+                "id": post_id,
+                "content": _text(rng, size),
+                "timestamp": timestamp.isoformat(),
+                "timestamp_user": timeline.format_timestamp(timestamp),
+                "user_id": i % 10 + 1,
+                "username": f"peer{index}-user{i % 10}",
+                "like_count": likes,
+                "comment_count": len(comments),
+                "likes": likes,
+                "comments": comments,
+                "liked": False,
+            }
+        )
+    posts.reverse()
+    return posts
+
+
+class _PeerHandler(BaseHTTPRequestHandler):
+    # Answers every request with the JSON built by the FakePeer of the server.
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        peer = self.server.peer
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            data = {}
+        time.sleep(peer.latency)
+        body = json.dumps(peer.answer(self.path.lstrip("/"), data)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST
+
+
+class FakePeer:
+    """
+    A foreign server answering the federation endpoints from a thread of this process.
+
+    Attributes:
+    ip (str): The address the server listens on.
+    port (int): The port the server listens on, picked by the system.
+    latency (float): The seconds every request waits before it is answered.
+    posts (list): The posts of the server, newest first.
+    requests (int): The number of requests answered so far.
+    """
+
+    def __init__(self, index, posts=50, post_size=280, latency=0.0, seed=0):
+        """
+        Parameters:
+        index (int): The number of the server, which names its users.
+        posts (int, optional): The number of posts of the server. Defaults to 50.
+        post_size (int, optional): The length of the content of each post. Defaults to 280.
+        latency (float, optional): The seconds every request waits. Defaults to 0.
+        seed (int, optional): The seed of the posts. Defaults to 0.
+        """
+        self.latency = latency
+        self.posts = peer_posts(index, posts, post_size, seed)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _PeerHandler)
+        self._server.daemon_threads = True
+        self._server.peer = self
+        self.ip, self.port = self._server.server_address[:2]
+
+    def start(self):
+        """
+        Starts answering requests in a background thread.
+
+        Returns:
+        FakePeer: The server itself.
+        """
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stops answering requests and closes the socket."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def answer(self, path, data):
+        """
+        Builds the answer of the server to a request.
+
+        Parameters:
+        path (str): The path of the endpoint, without a leading slash.
+        data (dict): The JSON body of the request.
+
+        Returns:
+        dict: The body of the answer, empty for the endpoints the server does not implement.
+        """
+        with self._lock:
+            self.requests += 1
+        if path == "federation/posts":
+            start = int(data.get("cursor") or 0)
+            end = start + int(data.get("limit") or 50)
+            return {
+                "posts": self.posts[start:end],
+                "next_cursor": str(end) if end < len(self.posts) else None,
+            }
+        if path.startswith("federation/user/"):
+            username = path.rsplit("/", 1)[-1]
+            return {
+                "username": username,
+                "posts": [i for i in self.posts if i["username"] == username],
+                "followers": 0,
+                "following_users": 0,
+            }
+        return {}
+
+
+def _batches(rows):
+    # Splits rows, which may be a generator, into lists of BATCH_SIZE.
+    batch = []
+    for i in rows:
+        batch.append(i)
+        if len(batch) == BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _index_local_posts(rng, post_list, follow_list, local):
+    # Does what the signal handlers of Post and Follower do for saved rows, in batches.
+    for batch in _batches(post_list):
+        fulltext.index_posts(fulltext.LOCAL, batch)
+        hashtags.tag_posts(batch)
+    by_author = {}
+    for post in post_list:
+        by_author.setdefault(post.user.username, []).append(post)
+    entries = (
+        HomeTimelineEntry(
+            id=_uuid(rng),
+            user_id=follow.following_user_id,
+            post=post,
+            timestamp=post.timestamp,
+        )
+        for follow in follow_list
+        if follow.server == local
+        for post in by_author.get(follow.followee_user, [])
+    )
+    for batch in _batches(entries):
+        HomeTimelineEntry.objects.bulk_create(batch)
+
+
+def _harmonic(count):
+    # Cumulative weights 1, 1 + 1/2, 1 + 1/2 + 1/3... giving the first users the most posts.
+    total = 0
+    for i in range(count):
+        total += 1 / (i + 1)
+        yield total
+
+
+def generate(
+    posts, seed=0, users=None, likes=2, comments=1, follows=10, blocks=1, peers=()
+):
+    """
+    Fills an empty database with seeded users, posts, likes, comments, follows and blocks.
+
+    Posts are spread over the users with a long tail, so the first user writes the most. Likes and
+    comments come from local users. Users follow and block users of this server and of the peers,
+    whose posts are mirrored like sync_remote_posts does.
+
+    Parameters:
+    posts (int): The number of local posts.
+    seed (int, optional): The seed of the data. Defaults to 0.
+    users (int, optional): The number of users. Defaults to one per 100 posts, at least 10.
+    likes (int, optional): The average number of likes of a post. Defaults to 2.
+    comments (int, optional): The average number of comments of a post. Defaults to 1.
+    follows (int, optional): The number of users each user follows. Defaults to 10.
+    blocks (int, optional): The number of users each user blocks. Defaults to 1.
+    peers (list, optional): The FakePeer servers to register and mirror. Defaults to none.
+
+    Returns:
+    dict: The 'user' writing the most posts, the ForeignServer of every peer as 'peers', and the
+    number of rows created per model as 'rows'.
+    """
+    rng = random.Random(seed)
+    if users is None:
+        users = max(10, posts // 100)
+    local, _ = ForeignServer.objects.get_or_create(ip="local")
+    peer_servers = [ForeignServer.objects.create(ip=i.ip, port=i.port) for i in peers]
+    servers.invalidate()
+
+    # Passwords are unusable, the benchmark logs users in without one.
+    User.objects.bulk_create(
+        [User(username=f"user{i}", password="!") for i in range(users)],
+        batch_size=BATCH_SIZE,
+    )
+    user_list = list(User.objects.order_by("id"))
+    usernames = [i.username for i in user_list]
+    authors = rng.choices(
+        user_list, cum_weights=list(_harmonic(len(user_list))), k=posts
+    )
+
+    post_list = []
+    like_list = []
+    comment_list = []
+    for i in range(posts):
+        timestamp = EPOCH + datetime.timedelta(minutes=i, seconds=rng.randrange(60))
+        post = Post(
+            id=_uuid(rng),
+            content=_text(rng, rng.randrange(20, 280)),
+            timestamp=timestamp,
+            updated=timestamp,
+            user=authors[i],
+        )
+        for username in rng.sample(
+            usernames, min(rng.randint(0, 2 * likes), len(usernames))
+        ):
+            like_list.append(
+                ForeignLike(id=_uuid(rng), post=post, user=username, server=local)
+            )
+            post.like_count += 1
+        for j in range(rng.randint(0, 2 * comments)):
+            comment_list.append(
+                ForeignComment(
+                    id=_uuid(rng),
+                    post=post,
+                    user=rng.choice(usernames),
+                    server=local,
+                    content=_text(rng, 40),
+                    timestamp=timestamp + datetime.timedelta(seconds=j + 1),
+                )
+            )
+            post.comment_count += 1
+        post_list.append(post)
+    with _generated_timestamps(
+        Post._meta.get_field("timestamp"),
+        Post._meta.get_field("updated"),
+        ForeignComment._meta.get_field("timestamp"),
+    ):
+        Post.objects.bulk_create(post_list, batch_size=BATCH_SIZE)
+        ForeignComment.objects.bulk_create(comment_list, batch_size=BATCH_SIZE)
+    ForeignLike.objects.bulk_create(like_list, batch_size=BATCH_SIZE)
+
+    # Every user follows and blocks distinct users, never themselves.
+    candidates = [(local, i) for i in usernames]
+    for peer, server in zip(peers, peer_servers):
+        candidates += [(server, i) for i in sorted({j["username"] for j in peer.posts})]
+    follow_list = []
+    block_list = []
+    for user in user_list:
+        chosen = rng.sample(candidates, min(follows + blocks + 1, len(candidates)))
+        chosen = [i for i in chosen if i != (local, user.username)]
+        follow_list += [
+            Follower(id=_uuid(rng), following_user=user, server=i, followee_user=j)
+            for i, j in chosen[:follows]
+        ]
+        block_list += [
+            ForeignUserBlocklist(id=_uuid(rng), user=user, server=i, blocked_user=j)
+            for i, j in chosen[follows : follows + blocks]
+        ]
+    Follower.objects.bulk_create(follow_list, batch_size=BATCH_SIZE)
+    ForeignUserBlocklist.objects.bulk_create(block_list, batch_size=BATCH_SIZE)
+    _index_local_posts(rng, post_list, follow_list, local)
+
+    for peer, server in zip(peers, peer_servers):
+        sync.save_posts(server, peer.posts)
+
+    return {
+        "user": user_list[0].username,
+        "peers": peer_servers,
+        "rows": {
+            "users": len(user_list),
+            "posts": len(post_list),
+            "likes": len(like_list),
+            "comments": len(comment_list),
+            "follows": len(follow_list),
+            "blocks": len(block_list),
+            "remote_posts": sum(len(i.posts) for i in peers),
+            "home_timeline_entries": HomeTimelineEntry.objects.count(),
+        },
+    }
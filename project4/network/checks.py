@@ -0,0 +1,127 @@
+"""
+System checks of the database setup.
+
+A database check makes sure the hot lookups of the federation endpoints use an
+index. Run it with 'python manage.py check --database default'. Every query of
+HOT_LOOKUPS is explained on each migrated SQLite database, and a plan that
+scans a whole table instead of searching an index is reported as an error.
+Databases with unapplied migrations are skipped, so migrate can still add the
+missing indexes.
+
+Another check makes sure SQLITE_TRANSACTION_MODE can be applied by network.db
+on the installed version of Django.
+"""
+
+import uuid
+
+import django
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from . import db
+from .models import Follower, ForeignLike, ForeignServer, ForeignUserBlocklist
+
+# The lookups made on every like, follow, block and federation request, by name.
+HOT_LOOKUPS = {
+    "ForeignLike (post, user, server)": lambda: ForeignLike.objects.filter(
+        post_id=uuid.UUID(int=0), user="", server_id=uuid.UUID(int=0)
+    ),
+    "Follower (following_user, server, followee_user)": lambda: Follower.objects.filter(
+        following_user_id=0, server_id=uuid.UUID(int=0), followee_user=""
+    ),
+    "ForeignUserBlocklist (user, server, blocked_user)": lambda: ForeignUserBlocklist.objects.filter(
+        user_id=0, server_id=uuid.UUID(int=0), blocked_user=""
+    ),
+    "ForeignServer (ip, port)": lambda: ForeignServer.objects.filter(ip="", port=0),
+}
+
+
+def full_scans(plan):
+    """
+    Finds the steps of an SQLite query plan that scan a whole table.
+
+    Parameters:
+    plan (str): The plan returned by QuerySet.explain() on SQLite.
+
+    Returns:
+    list: The details of the scanning steps, such as 'SCAN network_foreignlike'.
+    """
+    scans = []
+    for line in plan.splitlines():
+        detail = line.split(maxsplit=3)[-1]
+        # Covering index scans still read every row, only SEARCH steps use the index to seek.
+        if detail.startswith("SCAN "):
+            scans.append(detail)
+    return scans
+
+
+@checks.register(checks.Tags.database)
+def check_hot_lookups(app_configs, databases=None, **kwargs):
+    """
+    Explains the hot lookups on every migrated SQLite database and reports the ones scanning a whole table.
+
+    Parameters:
+    app_configs (list): The apps to check, unused since the lookups belong to this app.
+    databases (list, optional): The aliases of the databases to check. Defaults to none.
+
+    Returns:
+    list: The errors of the lookups that scan a table, and warnings for the databases that could
+    not be checked.
+    """
+    errors = []
+    for alias in databases or []:
+        if connections[alias].vendor != "sqlite":
+            continue
+        executor = MigrationExecutor(connections[alias])
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            continue
+        for name, lookup in HOT_LOOKUPS.items():
+            try:
+                plan = lookup().using(alias).explain()
+            except DatabaseError as e:
+                errors.append(
+                    checks.Warning(
+                        f"Could not explain the {name} lookup on '{alias}': {e}",
+                        hint="Check that the database can be reached.",
+                        id="network.W001",
+                    )
+                )
+                continue
+            for scan in full_scans(plan):
+                errors.append(
+                    checks.Error(
+                        f"The {name} lookup on '{alias}' does a full scan: {scan}",
+                        hint="Add an index or unique constraint covering the lookup.",
+                        id="network.E001",
+                    )
+                )
+    return errors
+
+
+@checks.register()
+def check_transaction_mode(app_configs, **kwargs):
+    """
+    Reports a SQLITE_TRANSACTION_MODE that network.db can not apply on the installed version of Django.
+
+    Parameters:
+    app_configs (list): The apps to check, unused since the setting belongs to this app.
+
+    Returns:
+    list: An error if the method network.db replaces is gone from the SQLite backend.
+    """
+    if (
+        not settings.SQLITE_TRANSACTION_MODE
+        or django.VERSION >= (5, 1)
+        or db.transaction_patch_supported()
+    ):
+        return []
+    return [
+        checks.Error(
+            f"SQLITE_TRANSACTION_MODE is set, but Django {django.get_version()} no longer "
+            f"begins SQLite transactions with {db.PATCHED_METHOD}.",
+            hint="Check how the SQLite backend begins transactions and update network.db.",
+            id="network.E002",
+        )
+    ]
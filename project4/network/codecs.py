@@ -0,0 +1,198 @@
+"""
+Content negotiation and compression for the federation endpoints.
+
+Servers that send 'application/msgpack' in their Accept header get MessagePack
+bodies, which are smaller and faster to decode than JSON, when msgpack is
+installed. Everyone else gets the same JSON as JsonResponse, encoded with orjson
+when it is installed. Responses are compressed with gzip or deflate when the
+caller accepts it, which requests and httpx both do by default. Large lists can
+be streamed as JSON while they are generated instead of being built in memory.
+"""
+
+import functools
+import json
+import zlib
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Bodies smaller than this gain nothing from compression.
+MIN_COMPRESS_SIZE = 200
+
+# Encodes datetimes, UUIDs and other values the codecs do not know the way JsonResponse does.
+_encode_default = DjangoJSONEncoder().default
+
+
+def accept_header():
+    """
+    Builds the Accept header sent to foreign servers.
+
+    Returns:
+    str: The accepted content types, MessagePack first if it can be decoded.
+    """
+    if msgpack is None:
+        return JSON
+    return f"{MSGPACK}, {JSON};q=0.9"
+
+
+def encode(data, accept=""):
+    """
+    Encodes data in the best format accepted by the caller.
+
+    Parameters:
+    data (dict): The data to encode.
+    accept (str, optional): The Accept header of the caller. Defaults to JSON.
+
+    Returns:
+    tuple: The encoded body and its content type.
+    """
+    if msgpack is not None and MSGPACK in accept:
+        return msgpack.packb(data, default=_encode_default), MSGPACK
+    if orjson is not None:
+        # Datetimes are passed through to keep the format of DjangoJSONEncoder.
+        return (
+            orjson.dumps(
+                data,
+                default=_encode_default,
+                option=orjson.OPT_PASSTHROUGH_DATETIME,
+            ),
+            JSON,
+        )
+    return json.dumps(data, cls=DjangoJSONEncoder).encode(), JSON
+
+
+def decode(response):
+    """
+    Decodes the body of a response from a foreign server.
+
+    Parameters:
+    response (Response): A requests or httpx response, already decompressed by the client.
+
+    Returns:
+    The decoded data.
+    """
+    if response.headers.get("Content-Type", "").startswith(MSGPACK):
+        return msgpack.unpackb(response.content)
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return json.loads(response.content)
+
+
+def negotiated_response(request, data):
+    """
+    Builds a response holding data in the format the caller accepts.
+
+    Parameters:
+    request (WSGIRequest): The request of the caller.
+    data (dict): The data to send.
+
+    Returns:
+    HttpResponse: The response.
+    """
+    body, content_type = encode(data, request.headers.get("Accept", ""))
+    response = HttpResponse(body, content_type=content_type)
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def streamed_response(items, list_key, last_key):
+    """
+    Builds a JSON response written while its items are generated, so they are never all in memory.
+
+    The body is an object holding the items in a list and the last value of the generator, such as
+    the cursor of the next page. Streamed responses are always JSON, which is written incrementally.
+
+    Parameters:
+    items (iterator): Yields the items of the list, then the value stored under last_key.
+    list_key (str): The key of the list of items.
+    last_key (str): The key of the last value.
+
+    Returns:
+    StreamingHttpResponse: The response.
+    """
+
+    def body():
+        yield b'{"' + list_key.encode() + b'": ['
+        previous = None
+        for i, item in enumerate(items):
+            if i > 1:
+                yield b", "
+            if i:
+                yield encode(previous)[0]
+            previous = item
+        yield b'], "' + last_key.encode() + b'": ' + encode(previous)[0] + b"}"
+
+    response = StreamingHttpResponse(body(), content_type=JSON)
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def compress(response, accept_encoding):
+    """
+    Compresses a response with gzip or deflate if the caller accepts it.
+
+    Parameters:
+    response (HttpResponse): The response to compress in place.
+    accept_encoding (str): The Accept-Encoding header of the caller.
+
+    Returns:
+    HttpResponse: The response.
+    """
+    patch_vary_headers(response, ("Accept-Encoding",))
+    encodings = [i.split(";")[0].strip() for i in accept_encoding.split(",")]
+    if response.streaming:
+        # Streamed bodies are compressed as they are written, which only gzip supports here.
+        if "gzip" in encodings and not response.has_header("Content-Encoding"):
+            response.streaming_content = compress_sequence(response.streaming_content)
+            response["Content-Encoding"] = "gzip"
+        return response
+    if (
+        response.has_header("Content-Encoding")
+        or len(response.content) < MIN_COMPRESS_SIZE
+    ):
+        return response
+    if "gzip" in encodings:
+        response.content = compress_string(response.content)
+        response["Content-Encoding"] = "gzip"
+    elif "deflate" in encodings:
+        response.content = zlib.compress(response.content)
+        response["Content-Encoding"] = "deflate"
+    else:
+        return response
+    response["Content-Length"] = str(len(response.content))
+    return response
+
+
+def compressed(view):
+    """
+    Decorates a view to compress its responses with gzip or deflate.
+
+    Parameters:
+    view (callable): The view to decorate.
+
+    Returns:
+    callable: The decorated view.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        return compress(
+            view(request, *args, **kwargs), request.headers.get("Accept-Encoding", "")
+        )
+
+    return wrapper
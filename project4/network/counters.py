@@ -0,0 +1,337 @@
+"""
+Writes likes and comments together with the counters stored on their post.
+
+Post.like_count and Post.comment_count are updated with F() expressions in the
+same transaction as the ForeignLike or ForeignComment row, so reading the counts
+never has to scan those tables. Post.updated is bumped along with them. The
+repair_counters command fixes any drift. apply_batch applies many likes, unlikes
+and comments of a server with a few bulk queries, and post_counts reads the
+counters of a page of posts at once.
+"""
+
+import uuid
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Now
+
+from .models import ForeignComment, ForeignLike, Post
+
+
+def get_like_count(post):
+    """
+    Reads the stored like count of a post.
+
+    Parameters:
+    post (Post): The post to read the like count of.
+
+    Returns:
+    int: The number of likes of the post.
+    """
+    return Post.objects.values_list("like_count", flat=True).get(pk=post.pk)
+
+
+def add_like(post, username, server):
+    """
+    Likes a post unless the user already liked it.
+
+    Parameters:
+    post (Post): The post to like.
+    username (str): The username of the user liking the post.
+    server (ForeignServer): The server of the user liking the post.
+
+    Returns:
+    tuple: Whether the like was added, and the new like count of the post.
+    """
+    with transaction.atomic():
+        _, created = ForeignLike.objects.get_or_create(
+            post=post, user=username, server=server
+        )
+        if created:
+            Post.objects.filter(pk=post.pk).update(
+                like_count=F("like_count") + 1, updated=Now()
+            )
+        return created, get_like_count(post)
+
+
+def remove_like(post, username, server):
+    """
+    Removes the like of a user from a post if there is one.
+
+    Parameters:
+    post (Post): The post to unlike.
+    username (str): The username of the user unliking the post.
+    server (ForeignServer): The server of the user unliking the post.
+
+    Returns:
+    tuple: Whether a like was removed, and the new like count of the post.
+    """
+    with transaction.atomic():
+        deleted, _ = ForeignLike.objects.filter(
+            post=post, user=username, server=server
+        ).delete()
+        if deleted:
+            Post.objects.filter(pk=post.pk).update(
+                like_count=F("like_count") - deleted, updated=Now()
+            )
+        return deleted > 0, get_like_count(post)
+
+
+def add_comment(post, username, server, content):
+    """
+    Adds a comment to a post.
+
+    Parameters:
+    post (Post): The post to comment on.
+    username (str): The username of the user commenting.
+    server (ForeignServer): The server of the user commenting.
+    content (str): The content of the comment.
+
+    Returns:
+    ForeignComment: The new comment.
+    """
+    with transaction.atomic():
+        created_comment = ForeignComment.objects.create(
+            post=post, user=username, server=server, content=content
+        )
+        Post.objects.filter(pk=post.pk).update(
+            comment_count=F("comment_count") + 1, updated=Now()
+        )
+        return created_comment
+
+
+BATCH_ACTIONS = ("like", "unlike", "comment")
+
+
+def valid_ids(ids):
+    """
+    Keeps the ids that are valid UUIDs, the others can not match a row.
+
+    Parameters:
+    ids (iterable): The ids to check.
+
+    Returns:
+    set: The valid ids as UUIDs.
+    """
+    valid = set()
+    for i in ids:
+        try:
+            valid.add(uuid.UUID(str(i)))
+        except ValueError:
+            continue
+    return valid
+
+
+def apply_batch(server, operations):
+    """
+    Applies the likes, unlikes and comments of the users of a server, in order, in one transaction.
+
+    Each operation is a dict with an 'action' of 'like', 'unlike' or 'comment', the 'post_id' and
+    the 'username' of the user, the 'content' of a comment and optionally the 'id' of the operation.
+    The operations are replayed against the likes loaded up front, so liking and unliking a post in
+    the same batch writes nothing, and sending them again leaves the likes as they are. A comment
+    whose id was already applied is answered with the comment it added instead of adding another.
+
+    Parameters:
+    server (ForeignServer): The server of the users.
+    operations (list): The operations to apply.
+
+    Returns:
+    tuple: The result of every operation, a dict with 'success' and the 'error' or the id of the
+    new 'comment', and a mapping of the id of every post touched to its 'likeCount' and 'commentCount'.
+    """
+    with transaction.atomic():
+        posts = Post.objects.select_for_update().in_bulk(
+            valid_ids(i.get("post_id") for i in operations)
+        )
+        liked = set(
+            ForeignLike.objects.filter(server=server, post__in=posts.values())
+            .filter(user__in={str(i.get("username")) for i in operations})
+            .values_list("post_id", "user")
+        )
+        # Comments added by operations of this batch when it was sent before, by operation id.
+        applied = dict(
+            ForeignComment.objects.filter(
+                server=server,
+                operation__in=valid_ids(i.get("id") for i in operations),
+            ).values_list("operation", "pk")
+        )
+        added = set()
+        removed = set()
+        comments = []
+        like_deltas = dict.fromkeys(posts, 0)
+        comment_deltas = dict.fromkeys(posts, 0)
+        results = []
+        for i in operations:
+            try:
+                post = posts.get(uuid.UUID(str(i["post_id"])))
+                if post is None:
+                    raise ValueError(f"Unknown post: {i['post_id']}")
+                action = i["action"]
+                username = str(i["username"])
+                if action not in BATCH_ACTIONS:
+                    raise ValueError(f"Invalid action: {action}")
+                if action == "comment":
+                    content = i["content"]
+                operation = uuid.UUID(str(i["id"])) if i.get("id") else None
+            except (KeyError, TypeError, ValueError) as e:
+                results.append({"success": False, "error": f"Invalid operation: {e}"})
+                continue
+            key = (post.pk, username)
+            if action == "comment":
+                if operation in applied:
+                    results.append(
+                        {"success": True, "comment": str(applied[operation])}
+                    )
+                    continue
+                comments.append(
+                    ForeignComment(
+                        post=post,
+                        user=username,
+                        server=server,
+                        content=content,
+                        operation=operation,
+                    )
+                )
+                if operation is not None:
+                    applied[operation] = comments[-1].pk
+                comment_deltas[post.pk] += 1
+                results.append({"success": True, "comment": str(comments[-1].pk)})
+            elif action == "like":
+                results.append({"success": key not in liked})
+                if key not in liked:
+                    liked.add(key)
+                    # A like removed earlier in the batch does not have to be deleted after all.
+                    if key in removed:
+                        removed.discard(key)
+                    else:
+                        added.add(key)
+                    like_deltas[post.pk] += 1
+            else:
+                results.append({"success": key in liked})
+                if key in liked:
+                    liked.discard(key)
+                    if key in added:
+                        added.discard(key)
+                    else:
+                        removed.add(key)
+                    like_deltas[post.pk] -= 1
+
+        ForeignLike.objects.bulk_create(
+            [
+                ForeignLike(post_id=post_id, user=username, server=server)
+                for post_id, username in added
+            ],
+            # A like added by a concurrent request is already there.
+            ignore_conflicts=True,
+        )
+        if removed:
+            ForeignLike.objects.filter(server=server).filter(
+                reduce(
+                    or_,
+                    (
+                        Q(post_id=post_id, user=username)
+                        for post_id, username in removed
+                    ),
+                )
+            ).delete()
+        ForeignComment.objects.bulk_create(comments)
+        for pk in posts:
+            if like_deltas[pk] or comment_deltas[pk]:
+                Post.objects.filter(pk=pk).update(
+                    like_count=F("like_count") + like_deltas[pk],
+                    comment_count=F("comment_count") + comment_deltas[pk],
+                    updated=Now(),
+                )
+        counts = {
+            str(pk): {"likeCount": like_count, "commentCount": comment_count}
+            for pk, like_count, comment_count in Post.objects.filter(
+                pk__in=posts
+            ).values_list("pk", "like_count", "comment_count")
+        }
+        return results, counts
+
+
+def post_counts(post_ids, username, server):
+    """
+    Reads the counters of posts and whether a user liked them, in a single query.
+
+    Parameters:
+    post_ids (list): The ids of the posts, unknown ids are left out of the result.
+    username (str): The username of the user viewing the posts.
+    server (ForeignServer): The server of the user viewing the posts.
+
+    Returns:
+    dict: A mapping of post id to its 'likeCount', 'commentCount' and whether the user 'liked' it.
+    """
+    return {
+        str(pk): {
+            "likeCount": like_count,
+            "commentCount": comment_count,
+            "liked": liked,
+        }
+        for pk, like_count, comment_count, liked in Post.objects.filter(
+            pk__in=valid_ids(post_ids)
+        )
+        .annotate(
+            liked=Exists(
+                ForeignLike.objects.filter(
+                    server=server, user=username, post=OuterRef("pk")
+                )
+            )
+        )
+        .values_list("pk", "like_count", "comment_count", "liked")
+    }
+
+
+def _count_of(model):
+    # The number of rows of model pointing at the outer post.
+    return Coalesce(
+        Subquery(
+            model.objects.filter(post=OuterRef("pk"))
+            .values("post")
+            .annotate(count=Count("pk"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+def drifted_posts():
+    """
+    Finds the posts whose stored counters do not match their likes and comments.
+
+    Returns:
+    QuerySet: The drifted posts, annotated with actual_like_count and actual_comment_count.
+    """
+    return (
+        Post.objects.annotate(
+            actual_like_count=_count_of(ForeignLike),
+            actual_comment_count=_count_of(ForeignComment),
+        )
+        .exclude(
+            like_count=F("actual_like_count"),
+            comment_count=F("actual_comment_count"),
+        )
+        .order_by()
+    )
+
+
+def repair_counters(posts):
+    """
+    Recounts the likes and comments of posts and stores the counts.
+
+    Parameters:
+    posts (QuerySet): The posts to repair.
+
+    Returns:
+    int: The number of posts updated.
+    """
+    with transaction.atomic():
+        return Post.objects.filter(pk__in=posts.values("pk")).update(
+            like_count=_count_of(ForeignLike),
+            comment_count=_count_of(ForeignComment),
+            updated=Now(),
+        )
@@ -0,0 +1,109 @@
+"""
+Tuning and routing of the SQLite connections used in DATABASE_MODE=production.
+
+Every new SQLite connection runs the PRAGMA statements of SQLITE_PRAGMAS, such
+as WAL journaling and a busy timeout. The connection named by
+DATABASE_READ_ALIAS is also made read-only. ReadRouter sends the reads of the
+timeline models to that connection, so they never queue behind a writer on the
+default connection. Reads made inside a transaction of the default connection
+stay on it, so they see the writes of the transaction.
+
+With SQLITE_TRANSACTION_MODE set to 'IMMEDIATE', transactions of the writing
+connections take the write lock when they begin. A deferred transaction that
+reads before writing fails at once with 'database is locked' when another
+connection wrote in between, the busy timeout cannot help it. Django 5.1 and
+later begin transactions in the mode of the transaction_mode option set in
+settings.py. Older versions have no such option, so the private method of the
+SQLite backend beginning transactions, PATCHED_METHOD, is replaced on every new
+connection. transaction_patch_supported checks that the backend still begins
+transactions through it, and connections refuse to open when it does not.
+"""
+
+import django
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.dispatch import receiver
+
+# The method of the SQLite backend of Django 4.2 to 5.0 that runs BEGIN when an atomic block starts.
+PATCHED_METHOD = "_start_transaction_under_autocommit"
+
+# Models read by the timeline, search, tag and profile pages.
+TIMELINE_MODELS = {
+    "foreigncomment",
+    "foreignlike",
+    "hashtag",
+    "hometimelineentry",
+    "post",
+    "posthashtag",
+    "remotelike",
+    "remotepost",
+}
+
+
+def transaction_patch_supported():
+    """
+    Checks that the SQLite backend begins the transactions of atomic blocks through PATCHED_METHOD.
+
+    Returns:
+    bool: True if the backend defines the method and BaseDatabaseWrapper.set_autocommit calls it, False otherwise.
+    """
+    return (
+        PATCHED_METHOD in vars(DatabaseWrapper)
+        and PATCHED_METHOD in BaseDatabaseWrapper.set_autocommit.__code__.co_names
+    )
+
+
+@receiver(connection_created)
+def apply_pragmas(sender, connection, **kwargs):
+    """Runs SQLITE_PRAGMAS on a new SQLite connection, and sets how it begins transactions or makes it read-only."""
+    if connection.vendor != "sqlite":
+        return
+    pragmas = dict(settings.SQLITE_PRAGMAS)
+    if connection.alias == settings.DATABASE_READ_ALIAS:
+        pragmas["query_only"] = "ON"
+    elif settings.SQLITE_TRANSACTION_MODE and django.VERSION < (5, 1):
+        if not transaction_patch_supported():
+            raise ImproperlyConfigured(
+                f"SQLITE_TRANSACTION_MODE can not be applied, Django {django.get_version()} "
+                f"no longer begins SQLite transactions with {PATCHED_METHOD}."
+            )
+        begin = f"BEGIN {settings.SQLITE_TRANSACTION_MODE}"
+
+        def start_transaction():
+            with connection.cursor() as cursor:
+                cursor.execute(begin)
+
+        # Replaces the plain BEGIN the backend runs when an atomic block starts.
+        connection._start_transaction_under_autocommit = start_transaction
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+class ReadRouter:
+    """Routes the reads of the timeline models to the read connection."""
+
+    def db_for_read(self, model, **hints):
+        if (
+            model._meta.app_label != "network"
+            or model._meta.model_name not in TIMELINE_MODELS
+        ):
+            return None
+        # Reads inside a transaction have to see its uncommitted writes.
+        if connections["default"].in_atomic_block:
+            return "default"
+        return settings.DATABASE_READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both connections open the same database file.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != settings.DATABASE_READ_ALIAS
@@ -0,0 +1,69 @@
+"""
+ETags of the federation endpoints, so polling servers get 304 Not Modified.
+
+The validators are built from the newest Post.updated, which changes on every
+edit, like and comment and is read from the end of an index, and from the
+change stamps of deletions and follows (stamps.py), which are primary key
+lookups. No rows are counted, so a poll costs the same at any number of posts.
+They also cover the request body and the calling server, which select the
+posts and liked flags, and the Accept headers, which select the encoding of the
+response.
+"""
+
+import hashlib
+
+from django.db.models import Max
+
+from . import stamps
+from .models import Post
+
+
+def _etag(request, *values):
+    # Hashes the state of the data together with everything else that shapes the response.
+    return hashlib.md5(
+        repr(
+            (
+                values,
+                request.body,
+                request.META.get("REMOTE_ADDR"),
+                request.headers.get("Accept", ""),
+                request.headers.get("Accept-Encoding", ""),
+            )
+        ).encode()
+    ).hexdigest()
+
+
+def posts_etag(request):
+    """
+    Computes the ETag of a federation/posts response.
+
+    Parameters:
+    request (WSGIRequest): The request of the foreign server.
+
+    Returns:
+    str: The ETag.
+    """
+    updated = Post.objects.aggregate(updated=Max("updated"))["updated"]
+    return _etag(request, updated, stamps.get(stamps.POSTS))
+
+
+def user_etag(request, username):
+    """
+    Computes the ETag of a federation/user response.
+
+    Parameters:
+    request (WSGIRequest): The request of the foreign server.
+    username (str): The username of the requested user.
+
+    Returns:
+    str: The ETag.
+    """
+    updated = Post.objects.filter(user__username=username).aggregate(
+        updated=Max("updated")
+    )["updated"]
+    return _etag(
+        request,
+        username,
+        updated,
+        stamps.get(stamps.POSTS, stamps.FOLLOWERS),
+    )
@@ -0,0 +1,664 @@
+"""
+Outbound client for talking to other Federation servers.
+
+The views use these helpers instead of calling requests directly so that every
+outbound call shares the same timeouts, the same bounded worker pool and a
+pooled keep-alive session per server, so repeated calls to a server reuse open
+connections instead of paying a new handshake each time.
+
+The async views use the a-prefixed counterparts, which wait on the event loop
+through httpx when it is installed, so a slow server does not hold a thread.
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+
+import requests
+from asgiref.sync import sync_to_async
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections, connection
+
+from . import codecs, health
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Shared by every request so a page load never spawns more than
+# FEDERATION_MAX_WORKERS outbound connections at once.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.FEDERATION_MAX_WORKERS, thread_name_prefix="federation"
+)
+
+
+# Sessions by ForeignServer id, with the (ip, port) they were created for.
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(server):
+    """
+    Returns the pooled session of a foreign server, creating it on first use.
+
+    The session is shared by every thread. It is replaced when the ip or port of the server changes.
+
+    Parameters:
+    server (ForeignServer): The server to get the session of.
+
+    Returns:
+    requests.Session: The session of the server.
+    """
+    address = (server.ip, server.port)
+    with _sessions_lock:
+        if server.id in _sessions and _sessions[server.id][0] == address:
+            return _sessions[server.id][1]
+        if server.id in _sessions:
+            _sessions[server.id][1].close()
+        session = requests.Session()
+        # Calls are made on behalf of many users, so no cookie may carry over between them.
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.headers["Accept"] = codecs.accept_header()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=settings.FEDERATION_POOL_SIZE
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _sessions[server.id] = (address, session)
+        return session
+
+
+def close_session(server):
+    """
+    Closes the pooled session of a foreign server if it has one.
+
+    Parameters:
+    server (ForeignServer): The server to close the session of.
+    """
+    with _sessions_lock:
+        if server.id in _sessions:
+            _sessions.pop(server.id)[1].close()
+
+
+def request(server, method, path, timeout=None, **kwargs):
+    """
+    Calls an endpoint of a foreign server through its pooled session, recording its health.
+
+    The timeout is lowered to fit the latency observed for the server, see health.adaptive_timeout.
+
+    Parameters:
+    server (ForeignServer): The server to call.
+    method (str): The HTTP method, such as 'GET' or 'POST'.
+    path (str): The path of the endpoint, without a leading slash.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+    **kwargs: Further arguments passed to requests, such as data.
+
+    Returns:
+    requests.Response: The response of the server.
+
+    Raises:
+    health.PeerUnavailable: If the server failed too often and is skipped until its cooldown passes.
+    """
+    if health.stale(server):
+        health.load(server)
+    timeout = health.before_request(server, timeout or settings.FEDERATION_TIMEOUT)
+    started = time.monotonic()
+    try:
+        response = get_session(server).request(
+            method, server_url(server, path), timeout=timeout, **kwargs
+        )
+    except requests.RequestException as e:
+        health.record(server, error=str(e) or type(e).__name__)
+        raise
+    if response.status_code >= 500:
+        health.record(server, error=f"HTTP {response.status_code} from {path}")
+    else:
+        health.record(server, latency=time.monotonic() - started)
+    return response
+
+
+def server_url(server, path):
+    """
+    Builds the URL of an endpoint on a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server to build the URL for.
+    path (str): The path of the endpoint, without a leading slash.
+
+    Returns:
+    str: The full URL of the endpoint.
+    """
+    return f"http://{server.ip}:{server.port}/{path}"
+
+
+def _validator_key(server, path, data):
+    # The cache key of the last response of a server to a request.
+    return "federation-validator:{}:{}".format(
+        server.id, hashlib.md5(f"{path}\n{data}".encode()).hexdigest()
+    )
+
+
+def fetch_json(server, path, data, timeout=None):
+    """
+    Fetches a federation endpoint, revalidating the last response instead of downloading it again.
+
+    The ETag of the last response is sent in If-None-Match, and a 304 Not Modified answer reuses its body.
+
+    Parameters:
+    server (ForeignServer): The server to call.
+    path (str): The path of the endpoint, without a leading slash.
+    data (str): The JSON body of the request.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    The decoded body of the response, None if the server did not answer with 200 or 304.
+    """
+    key = _validator_key(server, path, data)
+    stored = caches[settings.FEDERATION_VALIDATOR_CACHE_ALIAS].get(key)
+    result = request(
+        server,
+        "GET",
+        path,
+        timeout=timeout,
+        data=data,
+        headers={"If-None-Match": stored[0]} if stored else {},
+    )
+    if result.status_code == 304 and stored:
+        return stored[1]
+    if result.status_code != 200:
+        return None
+    json_data = codecs.decode(result)
+    # Keep the decoded body to revalidate it with its ETag next time.
+    if result.headers.get("ETag"):
+        caches[settings.FEDERATION_VALIDATOR_CACHE_ALIAS].set(
+            key, (result.headers["ETag"], json_data), settings.FEDERATION_VALIDATOR_TTL
+        )
+    return json_data
+
+
+def fetch_page(server, username, port, limit, cursor=None, timeout=None):
+    """
+    Fetches one page of posts from the federation/posts endpoint of a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts from.
+    username (str): The username of the user viewing the posts, used by the server to mark liked posts.
+    port (str): The port this server is listening on, used by the server to identify us.
+    limit (int): The maximum number of posts to fetch.
+    cursor (str, optional): The next_cursor of the previous page. Defaults to the newest posts.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    dict: The posts of the page and the next_cursor to fetch the page after it, which is None on the last page.
+    """
+    return _page_result(
+        fetch_json(
+            server,
+            "federation/posts",
+            _page_body(username, port, limit, cursor),
+            timeout,
+        )
+    )
+
+
+def _page_body(username, port, limit, cursor):
+    # The JSON body of a federation/posts request.
+    data = {"username": username, "port": port, "limit": limit}
+    if cursor is not None:
+        data["cursor"] = cursor
+    return json.dumps(data)
+
+
+def _page_result(json_data):
+    # The posts and next_cursor of a federation/posts response.
+    if json_data is None:
+        return {"posts": [], "next_cursor": None}
+    # Servers that do not paginate send every post and no cursor.
+    return {"posts": json_data["posts"], "next_cursor": json_data.get("next_cursor")}
+
+
+def fetch_posts(server, username, port, limit, timeout=None):
+    """
+    Fetches the newest posts of a foreign server, following its cursors until enough posts are fetched.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts from.
+    username (str): The username of the user viewing the posts.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts to fetch.
+    timeout (float, optional): The timeout of each request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    dict: The posts and the next_cursor after the last of them, which is None if the server has no more posts.
+    """
+    page = fetch_page(server, username, port, limit, timeout=timeout)
+    posts = page["posts"]
+    while page["next_cursor"] is not None and len(posts) < limit:
+        page = fetch_page(
+            server, username, port, limit - len(posts), page["next_cursor"], timeout
+        )
+        posts += page["posts"]
+    return {"posts": posts, "next_cursor": page["next_cursor"]}
+
+
+def deliver_posts(server, posts, timeout=None):
+    """
+    Pushes posts to the federation/inbox endpoint of a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server to deliver the posts to.
+    posts (list): The posts, in the format returned by the federation/posts endpoint.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Raises:
+    requests.RequestException: If the server can not be reached or does not accept the posts.
+    """
+    result = request(
+        server,
+        "POST",
+        "federation/inbox",
+        timeout=timeout,
+        data=json.dumps(
+            {"port": settings.FEDERATION_PORT, "posts": posts}, cls=DjangoJSONEncoder
+        ),
+    )
+    result.raise_for_status()
+
+
+def fetch_counts(server, username, port, post_ids, timeout=None):
+    """
+    Fetches the like and comment counts of posts of a foreign server and whether a user liked them.
+
+    Parameters:
+    server (ForeignServer): The server the posts come from.
+    username (str): The username of the user viewing the posts.
+    port (str): The port this server is listening on, used by the server to identify us.
+    post_ids (list): The ids of the posts on the server.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    dict: A mapping of post id to its 'likeCount', 'commentCount' and 'liked' flag.
+
+    Raises:
+    requests.RequestException: If the server can not be reached or does not answer the request.
+    """
+    result = request(
+        server,
+        "POST",
+        "federation/get_likes",
+        timeout=timeout,
+        data=json.dumps({"username": username, "port": port, "post_ids": post_ids}),
+    )
+    result.raise_for_status()
+    return codecs.decode(result)["posts"]
+
+
+def send_batch(server, operations, timeout=None):
+    """
+    Sends likes, unlikes and comments of local users to the federation/batch endpoint of a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server of the posts.
+    operations (list): The operations, in the format accepted by federation/batch.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Servers without the endpoint, which answer it with 404 Not Found, are sent the operations one
+    at a time to federation/like, federation/unlike and federation/comment instead. Those endpoints
+    take no operation id, so a comment whose answer was lost is added twice when it is sent again.
+
+    Returns:
+    dict: The 'results' of the operations and the new counts of the touched 'posts'. If the
+    operations were sent one at a time and one of them failed, the results stop before it and
+    its 'error' is added.
+
+    Raises:
+    requests.RequestException: If the server can not be reached or does not accept the operations.
+    """
+    result = request(
+        server,
+        "POST",
+        "federation/batch",
+        timeout=timeout,
+        data=json.dumps({"port": settings.FEDERATION_PORT, "operations": operations}),
+    )
+    if result.status_code == 404:
+        return _send_operations(server, operations, timeout)
+    result.raise_for_status()
+    return codecs.decode(result)
+
+
+def _send_operations(server, operations, timeout):
+    # Sends operations to the endpoints of single likes, unlikes and comments, answering like
+    # federation/batch. Stops at the first failure, so the operations after it are sent again later.
+    results = []
+    posts = {}
+    for i in operations:
+        path = f"federation/{i['action']}/{i['post_id']}"
+        try:
+            result = request(
+                server,
+                "POST",
+                path,
+                timeout=timeout,
+                data=json.dumps(
+                    {
+                        "username": i["username"],
+                        "content": i["content"],
+                        "port": settings.FEDERATION_PORT,
+                    }
+                ),
+            )
+        except requests.RequestException as e:
+            return {
+                "results": results,
+                "posts": posts,
+                "error": str(e) or type(e).__name__,
+            }
+        if result.status_code == 404:
+            results.append({"success": False, "error": f"Unknown post: {i['post_id']}"})
+            continue
+        if result.status_code != 200:
+            return {
+                "results": results,
+                "posts": posts,
+                "error": f"HTTP {result.status_code} from {path}",
+            }
+        if i["action"] == "comment":
+            results.append({"success": True})
+            continue
+        json_data = result.json()
+        results.append({"success": bool(json_data.get("success"))})
+        if "likeCount" in json_data:
+            posts.setdefault(i["post_id"], {})["likeCount"] = json_data["likeCount"]
+    return {"results": results, "posts": posts}
+
+
+def _run_in_worker(fn, *args):
+    # Runs on a thread of the worker pool, which closes the database connection the call opened,
+    # as Django only closes the connections of request threads.
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        connection.close()
+
+
+def submit(fn, *args):
+    """
+    Runs a function on the shared federation worker pool without waiting for it.
+
+    Parameters:
+    fn (callable): The function to run.
+    *args: The arguments to call the function with.
+
+    Returns:
+    Future: The future of the call.
+    """
+    return _executor.submit(_run_in_worker, fn, *args)
+
+
+def fan_out(servers, fetch, deadline=None):
+    """
+    Calls fetch for every server concurrently and waits for them up to a shared deadline.
+
+    Servers that fail or do not answer before the deadline are left out of the result,
+    so a single slow server can not hold up the others.
+
+    Parameters:
+    servers (iterable): The ForeignServer objects to call fetch for.
+    fetch (callable): A function taking a ForeignServer and a timeout in seconds.
+    deadline (float, optional): The number of seconds to wait for all servers. Defaults to FEDERATION_PAGE_DEADLINE.
+
+    Returns:
+    dict: A mapping of ForeignServer to the value returned by fetch, for every server that answered in time.
+    """
+    if deadline is None:
+        deadline = settings.FEDERATION_PAGE_DEADLINE
+    timeout = min(deadline, settings.FEDERATION_TIMEOUT)
+    futures = {
+        _executor.submit(_run_in_worker, fetch, server, timeout): server
+        for server in servers
+    }
+    done, not_done = wait(futures, timeout=deadline)
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            print(f"Error contacting {futures[future].ip}: {e}")
+    for future in not_done:
+        # Requests that have not started yet are dropped, the others finish in the background.
+        future.cancel()
+        print(f"Skipped {futures[future].ip}: no answer within {deadline}s")
+    return results
+
+
+# Async clients by event loop, then by ForeignServer id with the (ip, port) they were created for,
+# with the generator closing them once the loop shuts down.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_async_clients(clients):
+    # Stays suspended while its event loop runs. Loops shutting down finalize their async
+    # generators, like asyncio.run and so async_to_sync under WSGI do for every request, which
+    # closes the clients of the loop instead of leaking their connections.
+    try:
+        yield
+    finally:
+        # The generator holds on to its loop, so the entry of the loop has to go explicitly.
+        _async_clients.pop(asyncio.get_running_loop(), None)
+        for address, client in clients.values():
+            await client.aclose()
+
+
+def get_async_client(server):
+    """
+    Returns the pooled httpx client of a foreign server for the running event loop.
+
+    Parameters:
+    server (ForeignServer): The server to get the client of.
+
+    Returns:
+    httpx.AsyncClient: The client of the server.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        clients = {}
+        closer = _close_async_clients(clients)
+        # Started right away, so the loop tracks the generator and finalizes it on shutdown.
+        asyncio.ensure_future(closer.__anext__())
+        _async_clients[loop] = (clients, closer)
+    clients = _async_clients[loop][0]
+    address = (server.ip, server.port)
+    if server.id in clients and clients[server.id][0] == address:
+        return clients[server.id][1]
+    if server.id in clients:
+        loop.create_task(clients[server.id][1].aclose())
+    client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.FEDERATION_POOL_SIZE,
+            max_keepalive_connections=settings.FEDERATION_POOL_SIZE,
+        ),
+        # Calls are made on behalf of many users, so no cookie may carry over between them.
+        cookies=httpx.Cookies(CookieJar(DefaultCookiePolicy(allowed_domains=[]))),
+        headers={"Accept": codecs.accept_header()},
+    )
+    clients[server.id] = (address, client)
+    return client
+
+
+async def arequest(server, method, path, timeout=None, data=None, headers=None):
+    """
+    Calls an endpoint of a foreign server without blocking the event loop, recording its health.
+
+    Without httpx the call is made by request on a worker thread.
+
+    Parameters:
+    server (ForeignServer): The server to call.
+    method (str): The HTTP method, such as 'GET' or 'POST'.
+    path (str): The path of the endpoint, without a leading slash.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+    data (str, optional): The body of the request.
+    headers (dict, optional): Further headers of the request.
+
+    Returns:
+    Response: The response of the server, with status_code, headers and content like a requests.Response.
+
+    Raises:
+    requests.RequestException: If the server can not be reached, like request.
+    """
+    if httpx is None:
+        return await sync_to_async(request, thread_sensitive=False)(
+            server, method, path, timeout, data=data, headers=headers
+        )
+    if health.stale(server):
+        await sync_to_async(health.load)(server)
+    timeout = health.before_request(server, timeout or settings.FEDERATION_TIMEOUT)
+    started = time.monotonic()
+    try:
+        response = await get_async_client(server).request(
+            method,
+            server_url(server, path),
+            timeout=timeout,
+            content=data,
+            headers=headers,
+        )
+    except httpx.HTTPError as e:
+        error = str(e) or type(e).__name__
+        health.record(server, error=error)
+        # Raise the errors of requests, so callers handle both clients the same way.
+        if isinstance(e, httpx.TimeoutException):
+            raise requests.exceptions.Timeout(error) from e
+        raise requests.exceptions.ConnectionError(error) from e
+    if response.status_code >= 500:
+        health.record(server, error=f"HTTP {response.status_code} from {path}")
+    else:
+        health.record(server, latency=time.monotonic() - started)
+    return response
+
+
+async def afetch_json(server, path, data, timeout=None):
+    """
+    Fetches a federation endpoint without blocking the event loop, revalidating the last response like fetch_json.
+
+    Parameters:
+    server (ForeignServer): The server to call.
+    path (str): The path of the endpoint, without a leading slash.
+    data (str): The JSON body of the request.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    The decoded body of the response, None if the server did not answer with 200 or 304.
+    """
+    key = _validator_key(server, path, data)
+    stored = await caches[settings.FEDERATION_VALIDATOR_CACHE_ALIAS].aget(key)
+    result = await arequest(
+        server,
+        "GET",
+        path,
+        timeout=timeout,
+        data=data,
+        headers={"If-None-Match": stored[0]} if stored else {},
+    )
+    if result.status_code == 304 and stored:
+        return stored[1]
+    if result.status_code != 200:
+        return None
+    json_data = codecs.decode(result)
+    if result.headers.get("ETag"):
+        await caches[settings.FEDERATION_VALIDATOR_CACHE_ALIAS].aset(
+            key, (result.headers["ETag"], json_data), settings.FEDERATION_VALIDATOR_TTL
+        )
+    return json_data
+
+
+async def afetch_page(server, username, port, limit, cursor=None, timeout=None):
+    """
+    Fetches one page of posts from a foreign server without blocking the event loop, like fetch_page.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts from.
+    username (str): The username of the user viewing the posts.
+    port (str): The port this server is listening on.
+    limit (int): The maximum number of posts to fetch.
+    cursor (str, optional): The next_cursor of the previous page. Defaults to the newest posts.
+    timeout (float, optional): The timeout of the request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    dict: The posts of the page and the next_cursor to fetch the page after it, which is None on the last page.
+    """
+    return _page_result(
+        await afetch_json(
+            server,
+            "federation/posts",
+            _page_body(username, port, limit, cursor),
+            timeout,
+        )
+    )
+
+
+async def afetch_posts(server, username, port, limit, timeout=None):
+    """
+    Fetches the newest posts of a foreign server without blocking the event loop, like fetch_posts.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts from.
+    username (str): The username of the user viewing the posts.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts to fetch.
+    timeout (float, optional): The timeout of each request in seconds. Defaults to FEDERATION_TIMEOUT.
+
+    Returns:
+    dict: The posts and the next_cursor after the last of them, which is None if the server has no more posts.
+    """
+    page = await afetch_page(server, username, port, limit, timeout=timeout)
+    posts = page["posts"]
+    while page["next_cursor"] is not None and len(posts) < limit:
+        page = await afetch_page(
+            server, username, port, limit - len(posts), page["next_cursor"], timeout
+        )
+        posts += page["posts"]
+    return {"posts": posts, "next_cursor": page["next_cursor"]}
+
+
+async def afan_out(servers, fetch, deadline=None):
+    """
+    Awaits fetch for every server concurrently up to a shared deadline, like fan_out.
+
+    Parameters:
+    servers (iterable): The ForeignServer objects to call fetch for.
+    fetch (callable): An async function taking a ForeignServer and a timeout in seconds.
+    deadline (float, optional): The number of seconds to wait for all servers. Defaults to FEDERATION_PAGE_DEADLINE.
+
+    Returns:
+    dict: A mapping of ForeignServer to the value returned by fetch, for every server that answered in time.
+    """
+    if deadline is None:
+        deadline = settings.FEDERATION_PAGE_DEADLINE
+    timeout = min(deadline, settings.FEDERATION_TIMEOUT)
+    tasks = {
+        asyncio.ensure_future(fetch(server, timeout)): server for server in servers
+    }
+    if not tasks:
+        return {}
+    done, not_done = await asyncio.wait(tasks, timeout=deadline)
+    results = {}
+    for task in done:
+        try:
+            results[tasks[task]] = task.result()
+        except Exception as e:
+            print(f"Error contacting {tasks[task].ip}: {e}")
+    for task in not_done:
+        # Unlike threads, waiting coroutines can be cancelled outright.
+        task.cancel()
+        print(f"Skipped {tasks[task].ip}: no answer within {deadline}s")
+    return results
@@ -0,0 +1,107 @@
+"""
+Full-text index of local and mirrored remote posts for the search view.
+
+On SQLite the posts are indexed in the network_post_fts FTS5 table, kept up to
+date by the signal handlers in signals.py and by sync.save_posts. Other
+databases have no index and search falls back to render_index.
+"""
+
+from django.db import connection
+from django.utils.html import strip_tags
+
+LOCAL = "local"
+REMOTE = "remote"
+
+
+def available():
+    """
+    Checks if the full-text index can be used with the current database.
+
+    Returns:
+    bool: True if the database is SQLite, False otherwise.
+    """
+    return connection.vendor == "sqlite"
+
+
+def index_posts(source, posts):
+    """
+    Adds posts to the index, replacing their previous entries.
+
+    Parameters:
+    source (str): LOCAL for Post objects, REMOTE for RemotePost objects.
+    posts (list): The posts to index.
+    """
+    if not available() or not posts:
+        return
+    remove_posts(source, [i.pk for i in posts])
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            "INSERT INTO network_post_fts (post_id, source, username, content) "
+            "VALUES (%s, %s, %s, %s)",
+            [
+                (
+                    str(i.pk),
+                    source,
+                    i.user.username if source == LOCAL else i.username,
+                    strip_tags(i.content),
+                )
+                for i in posts
+            ],
+        )
+
+
+def remove_posts(source, pks):
+    """
+    Removes posts from the index.
+
+    Parameters:
+    source (str): LOCAL for Post objects, REMOTE for RemotePost objects.
+    pks (list): The primary keys of the posts to remove.
+    """
+    if not available() or not pks:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM network_post_fts WHERE source = %s AND post_id IN ({})".format(
+                ", ".join(["%s"] * len(pks))
+            ),
+            [source] + [str(i) for i in pks],
+        )
+
+
+def match_expression(query):
+    """
+    Turns a search query into an FTS5 expression matching posts containing every word.
+
+    Parameters:
+    query (str): The search query typed by the user.
+
+    Returns:
+    str: The FTS5 expression, empty if the query has no words.
+    """
+    # Quoting every word keeps FTS5 operators and punctuation in the query from being interpreted.
+    return " ".join('"' + i.replace('"', '""') + '"' for i in strip_tags(query).split())
+
+
+def search(query, limit, offset=0):
+    """
+    Finds the posts matching a search query, best matches first.
+
+    Parameters:
+    query (str): The search query typed by the user.
+    limit (int): The maximum number of results to return.
+    offset (int, optional): The number of results to skip. Defaults to 0.
+
+    Returns:
+    list: The (source, post_id) pairs of the matching posts.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT source, post_id FROM network_post_fts "
+            "WHERE network_post_fts MATCH %s ORDER BY rank LIMIT %s OFFSET %s",
+            [expression, limit, offset],
+        )
+        return cursor.fetchall()
@@ -0,0 +1,86 @@
+"""
+Extracts the hashtags of posts into the Hashtag and PostHashtag tables.
+
+The tags of a post are stored when it is created or edited, by the signal
+handlers in signals.py, and when remote posts are mirrored, by sync.save_posts.
+Each PostHashtag row carries the timestamp of its post, so a tag timeline is
+read newest first straight from the (hashtag, -timestamp) index.
+"""
+
+import re
+
+from django.db import transaction
+from django.utils.html import strip_tags
+
+from .models import Hashtag, PostHashtag
+
+# A hashtag starts a word and is followed by letters, digits or underscores.
+HASHTAG = re.compile(r"(?:^|(?<=\s))#(\w+)")
+
+
+def extract_hashtags(content):
+    """
+    Finds the hashtags in the content of a post.
+
+    Parameters:
+    content (str): The content of the post, which may contain HTML.
+
+    Returns:
+    set: The lowercase names of the hashtags, without the leading '#'.
+    """
+    return {i.lower() for i in HASHTAG.findall(strip_tags(content))}
+
+
+def tag_posts(posts, remote=False):
+    """
+    Replaces the stored hashtags of posts with the ones found in their content.
+
+    Parameters:
+    posts (list): The posts to tag.
+    remote (bool, optional): True if the posts are RemotePost objects, False for Post objects. Defaults to False.
+    """
+    if not posts:
+        return
+    field = "remote_post" if remote else "post"
+    names = {i.pk: extract_hashtags(i.content) for i in posts}
+    all_names = set().union(*names.values())
+    with transaction.atomic():
+        PostHashtag.objects.filter(**{field + "__in": [i.pk for i in posts]}).delete()
+        if not all_names:
+            return
+        Hashtag.objects.bulk_create(
+            [Hashtag(name=i) for i in all_names], ignore_conflicts=True
+        )
+        hashtag_ids = dict(
+            Hashtag.objects.filter(name__in=all_names).values_list("name", "id")
+        )
+        PostHashtag.objects.bulk_create(
+            [
+                PostHashtag(
+                    hashtag_id=hashtag_ids[name],
+                    timestamp=post.timestamp,
+                    **{field: post},
+                )
+                for post in posts
+                for name in names[post.pk]
+            ]
+        )
+
+
+def tagged_posts(name, limit, offset=0):
+    """
+    Finds the newest posts with a hashtag.
+
+    Parameters:
+    name (str): The name of the hashtag, without the leading '#'.
+    limit (int): The maximum number of posts to return.
+    offset (int, optional): The number of posts to skip. Defaults to 0.
+
+    Returns:
+    list: The (post_id, remote_post_id) pairs of the posts, newest first, with one of the ids set.
+    """
+    return list(
+        PostHashtag.objects.filter(hashtag__name=name.lower())
+        .order_by("-timestamp")
+        .values_list("post_id", "remote_post_id")[offset : offset + limit]
+    )
@@ -0,0 +1,337 @@
+"""
+Tracks the health of foreign servers to skip failing ones and adapt timeouts.
+
+Every call made through federation.request records its latency or failure in
+the memory of the process, so checking and recording the health of a server
+only touches the database on the path of a call when it is read again, at most
+every FEDERATION_HEALTH_PERSIST_INTERVAL seconds per server. A server that keeps failing
+has its circuit breaker opened and is skipped until a cooldown passes, after
+which a single probe request decides if it is closed again. Once enough
+latencies are recorded, the timeout of a server follows its p99 latency
+instead of the fixed FEDERATION_TIMEOUT.
+
+The health of the servers called since the last write is saved to their
+PeerHealth rows in one batch every FEDERATION_HEALTH_PERSIST_INTERVAL seconds,
+from a thread of its own, so the server admin page of every process shows it.
+The health written by the other processes is read back once it is older than
+that interval, so a server that fails their calls is skipped by this process too.
+"""
+
+import copy
+import datetime
+import threading
+import time
+
+import requests
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import ForeignServer, PeerHealth
+
+# Upper bounds in seconds of the latency buckets, the last bucket holds every slower request.
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# The health of every server called by this process, by server id, guarded by _lock.
+_peers = {}
+# Ids of the servers whose health changed since it was last saved.
+_dirty = set()
+_lock = threading.Lock()
+# When the health was last written by time.monotonic, and whether a write is running.
+_persisted = time.monotonic()
+_persisting = False
+# When the health of every server was last read from the database by time.monotonic, by server id.
+_loaded = {}
+
+
+class PeerUnavailable(requests.exceptions.ConnectionError):
+    """Raised instead of calling a server whose circuit breaker is open."""
+
+
+def percentile(buckets, fraction):
+    """
+    Estimates a latency percentile from a latency histogram.
+
+    Parameters:
+    buckets (list): The request counts per bucket of LATENCY_BUCKETS.
+    fraction (float): The percentile as a fraction, such as 0.99.
+
+    Returns:
+    float: The upper bound of the bucket holding the percentile in seconds, None if there are no
+    requests or the percentile is slower than the last bound.
+    """
+    total = sum(buckets)
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS + [None], buckets):
+        seen += count
+        if total and seen >= fraction * total:
+            return bound
+    return None
+
+
+def adaptive_timeout(peer, timeout):
+    """
+    Computes the timeout of a request to a server from its p99 latency.
+
+    Parameters:
+    peer (PeerHealth): The health of the server.
+    timeout (float): The timeout asked for by the caller, which is never exceeded.
+
+    Returns:
+    float: The timeout in seconds.
+    """
+    if sum(peer.latency_buckets) < settings.FEDERATION_HEALTH_MIN_SAMPLES:
+        return timeout
+    p99 = percentile(peer.latency_buckets, 0.99)
+    if p99 is None:
+        return timeout
+    return min(
+        timeout,
+        max(
+            p99 * settings.FEDERATION_TIMEOUT_P99_FACTOR,
+            settings.FEDERATION_TIMEOUT_MIN,
+        ),
+    )
+
+
+def current(server):
+    """
+    Gets the health of a server as known to this process.
+
+    Parameters:
+    server (ForeignServer): The server.
+
+    Returns:
+    PeerHealth: A copy of the health of the server, None if it was never called.
+    """
+    with _lock:
+        peer = _peers.get(server.id)
+        if peer is None:
+            return None
+        peer = copy.copy(peer)
+        peer.latency_buckets = list(peer.latency_buckets)
+        return peer
+
+
+def stale(server):
+    """
+    Checks if the health of a server should be read again from the database.
+
+    Parameters:
+    server (ForeignServer): The server about to be called.
+
+    Returns:
+    bool: True if it was never read or not for FEDERATION_HEALTH_PERSIST_INTERVAL seconds, False otherwise.
+    """
+    with _lock:
+        loaded = _loaded.get(server.id)
+    return (
+        loaded is None
+        or time.monotonic() - loaded >= settings.FEDERATION_HEALTH_PERSIST_INTERVAL
+    )
+
+
+def load(server):
+    """
+    Reads the health of a server saved by every process into the memory of this process.
+
+    The health this process changed since its last write is kept until it is saved.
+
+    Parameters:
+    server (ForeignServer): The server about to be called.
+    """
+    with _lock:
+        # Marked first, so the other threads calling the server do not read it as well.
+        _loaded[server.id] = time.monotonic()
+    try:
+        peer = PeerHealth.objects.filter(server_id=server.id).first()
+    except DatabaseError as e:
+        # Calls go on with the health known to this process, it is read again after the interval.
+        print(f"Error loading the health of {server.ip}: {e}")
+        return
+    if peer is None:
+        return
+    with _lock:
+        if server.id in _dirty:
+            return
+        known = _peers.get(server.id)
+        # A probe this process is sending pushed open_until forward without saving it.
+        if (
+            known is not None
+            and known.open_until is not None
+            and (peer.open_until is None or known.open_until > peer.open_until)
+        ):
+            peer.open_until = known.open_until
+        _peers[server.id] = peer
+
+
+def before_request(server, timeout):
+    """
+    Checks the circuit breaker of a server before calling it and picks the timeout of the call.
+
+    Parameters:
+    server (ForeignServer): The server about to be called.
+    timeout (float): The timeout asked for by the caller in seconds.
+
+    Returns:
+    float: The timeout to use in seconds.
+
+    Raises:
+    PeerUnavailable: If the circuit breaker of the server is open.
+    """
+    with _lock:
+        peer = _peers.get(server.id)
+        if peer is None:
+            return timeout
+        if peer.open_until is not None:
+            now = timezone.now()
+            if peer.open_until > now:
+                raise PeerUnavailable(
+                    f"{server.ip}:{server.port} is skipped after {peer.consecutive_failures} failures"
+                )
+            # Only the caller that pushes open_until forward sends the probe, the others keep skipping.
+            peer.open_until = now + datetime.timedelta(
+                seconds=settings.FEDERATION_BREAKER_COOLDOWN
+            )
+        return adaptive_timeout(peer, timeout)
+
+
+def record(server, latency=None, error=None):
+    """
+    Records the outcome of a call to a server.
+
+    The health is saved with the other changes once FEDERATION_HEALTH_PERSIST_INTERVAL seconds
+    passed since the last write.
+
+    Parameters:
+    server (ForeignServer): The server that was called.
+    latency (float, optional): The latency of a successful call in seconds.
+    error (str, optional): The error of a failed call.
+    """
+    global _persisting
+    with _lock:
+        peer = _peers.get(server.id)
+        if peer is None:
+            peer = _peers[server.id] = PeerHealth(server_id=server.id)
+        if not peer.latency_buckets:
+            peer.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        # Halve every count once the window is full, so old requests fade out.
+        if peer.successes + peer.failures >= settings.FEDERATION_HEALTH_WINDOW:
+            peer.latency_buckets = [i // 2 for i in peer.latency_buckets]
+            peer.successes //= 2
+            peer.failures //= 2
+        now = timezone.now()
+        if error is None:
+            peer.latency_buckets[sum(1 for i in LATENCY_BUCKETS if latency > i)] += 1
+            peer.successes += 1
+            peer.consecutive_failures = 0
+            peer.last_success = now
+            peer.open_until = None
+        else:
+            peer.failures += 1
+            peer.consecutive_failures += 1
+            peer.last_failure = now
+            peer.last_error = error
+            if peer.consecutive_failures >= settings.FEDERATION_BREAKER_THRESHOLD:
+                peer.open_until = now + datetime.timedelta(
+                    seconds=settings.FEDERATION_BREAKER_COOLDOWN
+                )
+        _dirty.add(server.id)
+        if (
+            _persisting
+            or time.monotonic() - _persisted
+            < settings.FEDERATION_HEALTH_PERSIST_INTERVAL
+        ):
+            return
+        _persisting = True
+    threading.Thread(target=_persist_in_background, daemon=True).start()
+
+
+def persist():
+    """
+    Saves the health of the servers called since the last write to their PeerHealth rows.
+
+    Returns:
+    int: The number of rows written.
+    """
+    global _persisted
+    with _lock:
+        peers = []
+        for server_id in _dirty:
+            peer = copy.copy(_peers[server_id])
+            peer.latency_buckets = list(peer.latency_buckets)
+            peers.append(peer)
+        _dirty.clear()
+        _persisted = time.monotonic()
+    if not peers:
+        return 0
+    try:
+        # Servers deleted since their last call have no row to write.
+        existing = set(
+            ForeignServer.objects.filter(
+                id__in=[i.server_id for i in peers]
+            ).values_list("id", flat=True)
+        )
+        peers = [i for i in peers if i.server_id in existing]
+        PeerHealth.objects.bulk_create(
+            peers,
+            update_conflicts=True,
+            unique_fields=["server"],
+            update_fields=[
+                "latency_buckets",
+                "successes",
+                "failures",
+                "consecutive_failures",
+                "last_success",
+                "last_failure",
+                "last_error",
+                "open_until",
+            ],
+        )
+    except DatabaseError as e:
+        # Losing a write is better than failing the calls it describes, the next one catches up.
+        print(f"Error saving the health of foreign servers: {e}")
+        with _lock:
+            _dirty.update(i.server_id for i in peers)
+        return 0
+    return len(peers)
+
+
+def _persist_in_background():
+    # Runs on a thread of its own, whose connection is closed once the batch is written.
+    global _persisting
+    try:
+        persist()
+    finally:
+        connection.close()
+        with _lock:
+            _persisting = False
+
+
+def summary(peer):
+    """
+    Summarizes the health of a server for the server admin page.
+
+    Parameters:
+    peer (PeerHealth): The health of the server, None if it was never called.
+
+    Returns:
+    dict: The 'status', the 'p99_ms' latency, the 'error_rate' in percent, 'last_success' and 'last_error'.
+    """
+    if peer is None:
+        return {"status": "Unknown"}
+    if peer.open_until is not None:
+        status = "Skipped"
+    elif peer.consecutive_failures:
+        status = "Failing"
+    else:
+        status = "Healthy"
+    p99 = percentile(peer.latency_buckets, 0.99)
+    total = peer.successes + peer.failures
+    return {
+        "status": status,
+        "p99_ms": None if p99 is None else round(p99 * 1000),
+        "error_rate": round(100 * peer.failures / total) if total else 0,
+        "last_success": peer.last_success,
+        "last_error": peer.last_error,
+    }
@@ -0,0 +1,125 @@
+"""
+Keeps the precomputed home timeline of every user, read by the Following view.
+
+A HomeTimelineEntry row is written for each follower of an author when the
+author posts locally (signals.py) or when sync.save_posts mirrors posts of a
+followed remote author. Following a user backfills their existing posts and
+unfollowing or blocking them prunes them, so the Following view only has to
+read a range of the (user, -timestamp) index.
+"""
+
+from django.db.models import Q
+
+from .models import Follower, HomeTimelineEntry, Post, RemotePost
+
+
+def add_local_post(post):
+    """
+    Adds a new local post to the home timelines of the followers of its author.
+
+    Parameters:
+    post (Post): The new post.
+    """
+    followers = Follower.objects.filter(
+        server__ip="local", followee_user=post.user.username
+    ).values_list("following_user_id", flat=True)
+    HomeTimelineEntry.objects.bulk_create(
+        [
+            HomeTimelineEntry(user_id=i, post=post, timestamp=post.timestamp)
+            for i in followers
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def add_remote_posts(server, posts):
+    """
+    Adds mirrored posts of a foreign server to the home timelines of the followers of their authors.
+
+    Parameters:
+    server (ForeignServer): The server the posts come from.
+    posts (list): The RemotePost objects of the server.
+    """
+    followers = {}
+    for user_id, username in Follower.objects.filter(
+        server=server, followee_user__in={i.username for i in posts}
+    ).values_list("following_user_id", "followee_user"):
+        followers.setdefault(username, []).append(user_id)
+    # Posts that are already on a timeline are skipped by the unique constraint.
+    HomeTimelineEntry.objects.bulk_create(
+        [
+            HomeTimelineEntry(
+                user_id=user_id, remote_post=post, timestamp=post.timestamp
+            )
+            for post in posts
+            for user_id in followers.get(post.username, [])
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def backfill(follower):
+    """
+    Adds the existing posts of a followed user to the home timeline of the follower.
+
+    Parameters:
+    follower (Follower): The new follow.
+    """
+    if follower.server.ip == "local":
+        entries = [
+            HomeTimelineEntry(
+                user_id=follower.following_user_id, post_id=pk, timestamp=timestamp
+            )
+            for pk, timestamp in Post.objects.filter(
+                user__username=follower.followee_user
+            ).values_list("pk", "timestamp")
+        ]
+    else:
+        entries = [
+            HomeTimelineEntry(
+                user_id=follower.following_user_id,
+                remote_post_id=pk,
+                timestamp=timestamp,
+            )
+            for pk, timestamp in RemotePost.objects.filter(
+                server=follower.server, username=follower.followee_user
+            ).values_list("pk", "timestamp")
+        ]
+    HomeTimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def prune(follower):
+    """
+    Removes the posts of a user who is no longer followed from the home timeline of the follower.
+
+    Parameters:
+    follower (Follower): The removed follow.
+    """
+    if follower.server.ip == "local":
+        posts = Q(post__user__username=follower.followee_user)
+    else:
+        posts = Q(
+            remote_post__server=follower.server,
+            remote_post__username=follower.followee_user,
+        )
+    HomeTimelineEntry.objects.filter(posts, user_id=follower.following_user_id).delete()
+
+
+def entries(viewer, limit, offset=0):
+    """
+    Reads a page of the home timeline of a user.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the user.
+    limit (int): The maximum number of posts to return.
+    offset (int, optional): The number of posts to skip. Defaults to 0.
+
+    Returns:
+    list: The (post_id, remote_post_id) pairs of the posts, newest first, with one of the ids set.
+    """
+    return list(
+        HomeTimelineEntry.objects.filter(user=viewer.user)
+        .exclude(remote_post__server__in=viewer.blocked_servers)
+        .order_by("-timestamp")
+        .values_list("post_id", "remote_post_id")[offset : offset + limit]
+    )
@@ -0,0 +1,282 @@
+"""
+Records likes, unlikes and comments on posts of foreign servers and delivers them in the background.
+
+The like, unlike and comment views answer right away: the interaction is saved
+as a PendingInteraction and applied optimistically to the local mirror, the
+RemoteLike of the user and the counts of the RemotePost. A dispatcher started
+after the request, and the deliver_interactions command, send the pending
+interactions of every server in order to its federation/batch endpoint, retry
+the failed ones with the backoff of the outbox, and reconcile the mirrored
+counts with the ones the server answers. Every operation carries the id of its
+PendingInteraction, so a batch sent again after its answer was lost does not
+add its comments twice. Older servers without federation/batch are sent the
+operations one at a time without their ids, so they get no such guarantee and
+may show a comment twice. An interaction that still fails after
+FEDERATION_INTERACTION_MAX_ATTEMPTS is given up: it is kept as failed, no
+longer shown to its user, and its optimistic change is taken back.
+"""
+
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import federation, outbox
+from .models import PendingInteraction, RemoteLike, RemotePost
+
+
+def _like_count(server, post_id):
+    # The mirrored like count of a post, None if the post is not mirrored.
+    return (
+        RemotePost.objects.filter(server=server, remote_id=post_id)
+        .values_list("like_count", flat=True)
+        .first()
+    )
+
+
+def _cancel(user, server, post_id, action):
+    # Cancels a pending interaction that was not sent yet, returning whether there was one.
+    deleted, _ = PendingInteraction.objects.filter(
+        user=user, server=server, post=post_id, action=action, claim=None, failed=None
+    ).delete()
+    return deleted > 0
+
+
+def like(user, server, post_id):
+    """
+    Likes a post of a foreign server optimistically and queues the like for delivery.
+
+    Parameters:
+    user (User): The user liking the post.
+    server (ForeignServer): The server of the post.
+    post_id (str): The id of the post on the server.
+
+    Returns:
+    tuple: Whether the like was added, and the optimistic like count of the post, None if it is not mirrored.
+    """
+    with transaction.atomic():
+        _, created = RemoteLike.objects.get_or_create(
+            user=user, server=server, post=post_id
+        )
+        if created:
+            RemotePost.objects.filter(server=server, remote_id=post_id).update(
+                like_count=F("like_count") + 1
+            )
+            # Liking a post again before its unlike is sent leaves nothing to send.
+            if not _cancel(user, server, post_id, "unlike"):
+                PendingInteraction.objects.create(
+                    user=user, server=server, post=post_id, action="like"
+                )
+        return created, _like_count(server, post_id)
+
+
+def unlike(user, server, post_id):
+    """
+    Removes the like of a post of a foreign server optimistically and queues the unlike for delivery.
+
+    Parameters:
+    user (User): The user unliking the post.
+    server (ForeignServer): The server of the post.
+    post_id (str): The id of the post on the server.
+
+    Returns:
+    tuple: Whether a like was removed, and the optimistic like count of the post, None if it is not mirrored.
+    """
+    with transaction.atomic():
+        deleted, _ = RemoteLike.objects.filter(
+            user=user, server=server, post=post_id
+        ).delete()
+        if deleted:
+            RemotePost.objects.filter(server=server, remote_id=post_id).update(
+                like_count=Greatest(F("like_count") - 1, 0)
+            )
+            if not _cancel(user, server, post_id, "like"):
+                PendingInteraction.objects.create(
+                    user=user, server=server, post=post_id, action="unlike"
+                )
+        return deleted > 0, _like_count(server, post_id)
+
+
+def comment(user, server, post_id, content):
+    """
+    Queues a comment on a post of a foreign server for delivery.
+
+    Parameters:
+    user (User): The user commenting.
+    server (ForeignServer): The server of the post.
+    post_id (str): The id of the post on the server.
+    content (str): The content of the comment.
+    """
+    with transaction.atomic():
+        PendingInteraction.objects.create(
+            user=user, server=server, post=post_id, action="comment", content=content
+        )
+        RemotePost.objects.filter(server=server, remote_id=post_id).update(
+            comment_count=F("comment_count") + 1
+        )
+
+
+def dispatch(server):
+    """
+    Delivers the pending interactions of a server on the federation worker pool once the transaction commits.
+
+    Parameters:
+    server (ForeignServer): The server to deliver to.
+    """
+    transaction.on_commit(lambda: federation.submit(deliver_due, server))
+
+
+def _claim(started, server=None):
+    # Marks the due interactions as being sent by this dispatcher and returns them.
+    due = PendingInteraction.objects.filter(
+        next_attempt__lte=started, failed=None, server__block=False
+    )
+    if server is not None:
+        due = due.filter(server=server)
+    token = uuid.uuid4()
+    PendingInteraction.objects.filter(
+        pk__in=list(
+            due.order_by("created").values_list("pk", flat=True)[
+                : settings.FEDERATION_INTERACTION_BATCH_SIZE
+            ]
+        ),
+        next_attempt__lte=started,
+    ).update(
+        claim=token,
+        # Interactions of a dispatcher that died are sent again once this passes.
+        next_attempt=started + outbox.retry_delay(1),
+    )
+    return list(
+        PendingInteraction.objects.filter(claim=token)
+        .select_related("user", "server")
+        .order_by("created")
+    )
+
+
+def _send(server, pending, timeout):
+    # Returns the answer of the server, or the error of a failed delivery instead of raising it.
+    try:
+        return federation.send_batch(
+            server,
+            [
+                {
+                    # Lets the server skip a comment it applied before an answer was lost.
+                    "id": str(i.id),
+                    "action": i.action,
+                    "post_id": i.post,
+                    "username": i.user.username,
+                    "content": i.content,
+                }
+                for i in pending
+            ],
+            timeout,
+        )
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+
+def _reconcile(server, pending, answer):
+    # Applies the answer of a server to the local mirror and removes the delivered interactions,
+    # returning them. Interactions the answer has no result for stay pending.
+    results = answer.get("results")
+    delivered = pending[: len(results)] if isinstance(results, list) else []
+    for i, result in zip(delivered, results or []):
+        # A like the server refused is taken back, its post does not exist there.
+        if i.action == "like" and isinstance(result, dict) and result.get("error"):
+            RemoteLike.objects.filter(user=i.user, server=server, post=i.post).delete()
+    posts = answer.get("posts")
+    for post_id, counts in (posts if isinstance(posts, dict) else {}).items():
+        fields = {}
+        if isinstance(counts, dict) and "likeCount" in counts:
+            fields["like_count"] = counts["likeCount"]
+        if isinstance(counts, dict) and "commentCount" in counts:
+            fields["comment_count"] = counts["commentCount"]
+        if fields:
+            RemotePost.objects.filter(server=server, remote_id=post_id).update(**fields)
+    PendingInteraction.objects.filter(pk__in=[i.pk for i in delivered]).delete()
+    return delivered
+
+
+def _roll_back(interaction):
+    # Takes back the optimistic change of an interaction that was given up.
+    remote_post = RemotePost.objects.filter(
+        server=interaction.server, remote_id=interaction.post
+    )
+    if interaction.action == "like":
+        deleted, _ = RemoteLike.objects.filter(
+            user=interaction.user, server=interaction.server, post=interaction.post
+        ).delete()
+        if deleted:
+            remote_post.update(like_count=Greatest(F("like_count") - 1, 0))
+    elif interaction.action == "unlike":
+        _, created = RemoteLike.objects.get_or_create(
+            user=interaction.user, server=interaction.server, post=interaction.post
+        )
+        if created:
+            remote_post.update(like_count=F("like_count") + 1)
+    else:
+        remote_post.update(comment_count=Greatest(F("comment_count") - 1, 0))
+
+
+def _retry(pending, error):
+    # Schedules the next attempt of interactions that were not delivered, giving up the ones
+    # that failed too often.
+    now = timezone.now()
+    with transaction.atomic():
+        # Newest first, so a like and the unlike after it are taken back in reverse.
+        for i in reversed(pending):
+            i.attempts += 1
+            i.next_attempt = now + outbox.retry_delay(i.attempts)
+            i.last_error = error
+            i.claim = None
+            if i.attempts >= settings.FEDERATION_INTERACTION_MAX_ATTEMPTS:
+                i.failed = now
+                _roll_back(i)
+        PendingInteraction.objects.bulk_update(
+            pending, ["attempts", "next_attempt", "last_error", "claim", "failed"]
+        )
+
+
+def deliver_due(server=None):
+    """
+    Delivers one batch of due interactions to every server, all servers at once.
+
+    Parameters:
+    server (ForeignServer, optional): Only deliver the interactions of this server. Defaults to every server.
+
+    Returns:
+    dict: A mapping of ForeignServer to the number of interactions delivered, 0 for the servers that failed.
+    Interactions after the last one a server answered are retried.
+    """
+    started = timezone.now()
+    batches = {}
+    for i in _claim(started, server):
+        batches.setdefault(i.server, []).append(i)
+    if server is not None:
+        # A dispatcher already runs on the federation pool, so it sends its batch itself.
+        answers = {
+            i: _send(i, pending, settings.FEDERATION_TIMEOUT)
+            for i, pending in batches.items()
+        }
+    else:
+        answers = federation.fan_out(
+            batches,
+            lambda server, timeout: _send(server, batches[server], timeout),
+            settings.FEDERATION_TIMEOUT,
+        )
+    delivered = {}
+    for server, pending in batches.items():
+        answer = answers.get(server)
+        delivered[server] = 0
+        if isinstance(answer, dict):
+            with transaction.atomic():
+                delivered[server] = len(_reconcile(server, pending, answer))
+            pending = pending[delivered[server] :]
+            if not pending:
+                continue
+            answer = answer.get("error") or "Incomplete answer"
+        _retry(pending, answer or "No answer")
+    return delivered
@@ -0,0 +1,330 @@
+import contextlib
+import json
+import os
+import platform
+import statistics
+import time
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+from django.utils import timezone
+
+from network import benchmark, post_cache, servers
+from network.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Times the timeline, profile and federation views on seeded data in a test database "
+        "and saves the timings and query counts as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales",
+            default="1000,10000,100000",
+            help="Comma separated numbers of local posts to measure at.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Seed of the generated data."
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Number of timed requests per view, after one untimed request.",
+        )
+        parser.add_argument(
+            "--likes", type=int, default=2, help="Average number of likes per post."
+        )
+        parser.add_argument(
+            "--comments",
+            type=int,
+            default=1,
+            help="Average number of comments per post.",
+        )
+        parser.add_argument(
+            "--follows",
+            type=int,
+            default=10,
+            help="Number of users each user follows.",
+        )
+        parser.add_argument(
+            "--blocks", type=int, default=1, help="Number of users each user blocks."
+        )
+        parser.add_argument(
+            "--peers",
+            type=int,
+            default=2,
+            help="Number of stand-in foreign servers, at least 1.",
+        )
+        parser.add_argument(
+            "--peer-latency",
+            type=float,
+            default=0.05,
+            help="Seconds every stand-in foreign server waits before answering.",
+        )
+        parser.add_argument(
+            "--peer-posts",
+            type=int,
+            default=100,
+            help="Number of posts of every stand-in foreign server.",
+        )
+        parser.add_argument(
+            "--peer-post-size",
+            type=int,
+            default=280,
+            help="Length of the content of the posts of foreign servers in characters.",
+        )
+        parser.add_argument(
+            "--output",
+            default="benchmark.json",
+            help="File the results are saved to.",
+        )
+        parser.add_argument(
+            "--compare",
+            help="Results of an earlier run to print the changes against.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(i) for i in options["scales"].split(",")]
+        except ValueError:
+            raise CommandError(f"Invalid scales: {options['scales']}")
+        if options["repeat"] < 1:
+            raise CommandError("At least one timed request is needed per view.")
+        if options["peers"] < 1:
+            raise CommandError("At least one peer is needed to call federation views.")
+        previous = None
+        if options["compare"]:
+            with open(options["compare"]) as f:
+                previous = json.load(f)
+
+        # The data is generated in test databases, the configured ones are never touched.
+        old_config = setup_databases(verbosity=0, interactive=False)
+        peers = [
+            benchmark.FakePeer(
+                i,
+                posts=options["peer_posts"],
+                post_size=options["peer_post_size"],
+                latency=options["peer_latency"],
+                seed=options["seed"],
+            ).start()
+            for i in range(options["peers"])
+        ]
+        # The posts of foreign servers are cached in this process, so clearing them before every
+        # request never touches the configured caches.
+        caches = dict(settings.CACHES)
+        for alias in (
+            settings.FEDERATION_CACHE_ALIAS,
+            settings.FEDERATION_VALIDATOR_CACHE_ALIAS,
+        ):
+            caches[alias] = {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": f"benchmark-{alias}",
+            }
+        results = []
+        try:
+            with override_settings(CACHES=caches):
+                for scale in scales:
+                    results.append(self.run_scale(scale, peers, options))
+        finally:
+            for i in peers:
+                i.stop()
+            teardown_databases(old_config, verbosity=0)
+
+        report = {
+            "created": timezone.now().isoformat(),
+            "options": {
+                key: options[key]
+                for key in (
+                    "seed",
+                    "repeat",
+                    "likes",
+                    "comments",
+                    "follows",
+                    "blocks",
+                    "peers",
+                    "peer_latency",
+                    "peer_posts",
+                    "peer_post_size",
+                )
+            },
+            "environment": {
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "database_mode": os.environ.get("DATABASE_MODE", "default"),
+            },
+            "scales": results,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+        if previous is not None:
+            self.compare(previous, report)
+        self.stdout.write(
+            self.style.SUCCESS(f"Saved the results to {options['output']}.")
+        )
+
+    def run_scale(self, scale, peers, options):
+        """
+        Generates the data of one scale and measures every view on it.
+
+        Parameters:
+        scale (int): The number of local posts.
+        peers (list): The running FakePeer servers.
+        options (dict): The options of the command.
+
+        Returns:
+        dict: The number of 'posts', the 'generate_seconds', the 'rows' created and the
+        measurements of every view as 'views'.
+        """
+        call_command("flush", interactive=False, verbosity=0)
+        started = time.perf_counter()
+        data = benchmark.generate(
+            scale,
+            seed=options["seed"],
+            likes=options["likes"],
+            comments=options["comments"],
+            follows=options["follows"],
+            blocks=options["blocks"],
+            peers=peers,
+        )
+        generate_seconds = time.perf_counter() - started
+        self.stdout.write(
+            f"{scale} posts: generated {data['rows']} in {generate_seconds:.1f}s"
+        )
+
+        username = data["user"]
+        peer = data["peers"][0]
+        peer_user = peers[0].posts[0]["username"]
+        # Federation views identify the calling server by its address and port, the bodies are
+        # the ones sent by render_index and the user view.
+        posts_body = json.dumps({"port": peer.port, "username": peer_user})
+        user_body = json.dumps({"port": peer.port, "user": peer_user})
+        client = Client(HTTP_HOST="127.0.0.1")
+        client.force_login(User.objects.get(username=username))
+        views = {
+            "all (mirror)": ("get", "/all", {}, "mirror"),
+            "all (live)": ("get", "/all", {}, "live"),
+            "federated_posts": (
+                "post",
+                "/federation/posts",
+                {"data": posts_body, "content_type": "application/json"},
+                None,
+            ),
+            "federated_user": (
+                "post",
+                f"/federation/user/{username}",
+                {"data": user_body, "content_type": "application/json"},
+                None,
+            ),
+            "user": ("get", f"/user/local/{username}", {}, None),
+            "user (remote)": ("get", f"/user/{peer.id}/{peer_user}", {}, None),
+        }
+        measured = {}
+        for name, (method, path, extra, source) in views.items():
+            # Views run as in production, DEBUG would log every query and slow them down.
+            overrides = {"DEBUG": False, "ALLOWED_HOSTS": ["127.0.0.1"]}
+            if source is not None:
+                overrides["FEDERATION_TIMELINE_SOURCE"] = source
+            with override_settings(**overrides):
+                measured[name] = self.measure(
+                    client, method, path, extra, options["repeat"]
+                )
+            self.stdout.write(
+                f"{scale:>8} posts  {name:<16} {measured[name]['median_ms']:9.1f} ms "
+                f"{measured[name]['queries']:5d} queries"
+            )
+        servers.invalidate()
+        return {
+            "posts": scale,
+            "generate_seconds": round(generate_seconds, 3),
+            "rows": data["rows"],
+            "views": measured,
+        }
+
+    def measure(self, client, method, path, extra, repeat):
+        """
+        Times the requests to a view.
+
+        The posts of foreign servers are dropped from the cache before every request, so pages
+        calling them wait for the peers each time. The first request warms the process and is
+        not timed.
+
+        Parameters:
+        client (Client): The client making the requests.
+        method (str): The HTTP method, 'get' or 'post'.
+        path (str): The path of the view.
+        extra (dict): Further arguments of the request, such as its data.
+        repeat (int): The number of timed requests.
+
+        Returns:
+        dict: The 'min_ms', 'median_ms' and 'max_ms' of the requests, the 'queries' of the last one
+        on every database and the 'bytes' of its response.
+        """
+        timings = []
+        for i in range(repeat + 1):
+            post_cache.get_cache().clear()
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with contextlib.ExitStack() as stack:
+                # Counted on every database, without the cap of the query log of DEBUG.
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(count))
+                started = time.perf_counter()
+                response = getattr(client, method)(path, **extra)
+                if response.streaming:
+                    body = b"".join(response.streaming_content)
+                else:
+                    body = response.content
+                elapsed = time.perf_counter() - started
+            if response.status_code != 200:
+                raise CommandError(f"{path} answered {response.status_code}")
+            if i:
+                timings.append(elapsed * 1000)
+        return {
+            "min_ms": round(min(timings), 2),
+            "median_ms": round(statistics.median(timings), 2),
+            "max_ms": round(max(timings), 2),
+            "queries": len(queries),
+            "bytes": len(body),
+        }
+
+    def compare(self, previous, report):
+        """
+        Prints how the median time and queries of every view changed since an earlier run.
+
+        Parameters:
+        previous (dict): The results of the earlier run.
+        report (dict): The results of this run.
+        """
+        before = {
+            (scale["posts"], name): view
+            for scale in previous["scales"]
+            for name, view in scale["views"].items()
+        }
+        for scale in report["scales"]:
+            for name, view in scale["views"].items():
+                old = before.get((scale["posts"], name))
+                if old is None:
+                    continue
+                change = (view["median_ms"] / old["median_ms"] - 1) * 100
+                self.stdout.write(
+                    f"{scale['posts']:>8} posts  {name:<16} {old['median_ms']:9.1f} -> "
+                    f"{view['median_ms']:.1f} ms ({change:+.0f}%), "
+                    f"{old['queries']} -> {view['queries']} queries"
+                )
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from network import health, interactions
+
+
+class Command(BaseCommand):
+    help = "Sends the pending likes, unlikes and comments of local users to foreign servers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep delivering every FEDERATION_OUTBOX_INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            delivered = interactions.deliver_due()
+            for server, count in delivered.items():
+                self.stdout.write(
+                    f"{server.ip}:{server.port}: {count} interactions delivered"
+                )
+            if not options["loop"]:
+                # A single run exits before its calls are saved in the background.
+                health.persist()
+                return
+            # Long running workers should not hold on to a connection between runs.
+            close_old_connections()
+            # Keep going without a pause while interactions are still waiting.
+            if sum(delivered.values()) < settings.FEDERATION_INTERACTION_BATCH_SIZE:
+                time.sleep(settings.FEDERATION_OUTBOX_INTERVAL)
@@ -0,0 +1,54 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from network import health, outbox
+
+
+class Command(BaseCommand):
+    help = "Pushes the queued local posts to the federation/inbox of foreign servers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep delivering every FEDERATION_OUTBOX_INTERVAL seconds.",
+        )
+        parser.add_argument(
+            "--lag",
+            action="store_true",
+            help="Only show the queued and failed posts and delivery lag of every server.",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Queue the deliveries that were given up again before delivering.",
+        )
+
+    def handle(self, *args, **options):
+        if options["lag"]:
+            for server, metrics in outbox.lag().items():
+                self.stdout.write(
+                    f"{server.ip}:{server.port}: {metrics['queued']} queued, "
+                    f"{metrics['lag_seconds']:.0f}s behind, {metrics['failed']} failed"
+                )
+            return
+        if options["retry_failed"]:
+            self.stdout.write(f"{outbox.retry_failed()} failed posts queued again")
+        while True:
+            delivered = outbox.deliver_due()
+            for server, count in delivered.items():
+                self.stdout.write(f"{server.ip}:{server.port}: {count} posts delivered")
+            if not options["loop"]:
+                # A single run exits before its calls are saved in the background.
+                health.persist()
+                return
+            # Long running workers should not hold on to a connection between runs.
+            close_old_connections()
+            # Keep going without a pause while a server still has full batches waiting.
+            if not any(
+                i == settings.FEDERATION_OUTBOX_BATCH_SIZE for i in delivered.values()
+            ):
+                time.sleep(settings.FEDERATION_OUTBOX_INTERVAL)
@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+
+from network import post_cache
+from network.models import ForeignServer
+
+
+class Command(BaseCommand):
+    help = "Inspects or flushes the cache of posts fetched from foreign servers."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--flush",
+            action="store_true",
+            help="Delete the cached posts instead of listing them.",
+        )
+        parser.add_argument(
+            "--server",
+            help="Only inspect or flush the posts of the server with this id.",
+        )
+
+    def handle(self, *args, **options):
+        cache = post_cache.get_cache()
+        if isinstance(cache, LocMemCache):
+            # This process would only see its own empty cache, not the one of the server.
+            raise CommandError(
+                f"The '{settings.FEDERATION_CACHE_ALIAS}' cache is private to each process, "
+                "set FEDERATION_REDIS_URL to share it and inspect or flush it."
+            )
+        servers = ForeignServer.objects.exclude(ip="local")
+        if options["server"]:
+            servers = servers.filter(id=options["server"])
+            if not servers.exists():
+                raise CommandError(f"No foreign server with id {options['server']}")
+
+        if options["flush"] and not options["server"]:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS("Flushed all cached posts."))
+            return
+
+        for server in servers:
+            if options["flush"]:
+                cache.delete(post_cache.cache_key(server))
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"Flushed cached posts of {server.ip}:{server.port}."
+                    )
+                )
+                continue
+            entry = cache.get(post_cache.cache_key(server))
+            if entry is None:
+                self.stdout.write(f"{server.ip}:{server.port}: not cached")
+                continue
+            age = time.time() - entry["fetched"]
+            state = "fresh" if age < settings.FEDERATION_CACHE_TTL else "stale"
+            self.stdout.write(
+                f"{server.ip}:{server.port}: {len(entry['posts'])} posts, {age:.0f}s old, {state}"
+            )
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from network import counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the likes and comments of posts whose stored counters drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only list the drifted posts without fixing them.",
+        )
+
+    def handle(self, *args, **options):
+        drifted = counters.drifted_posts()
+        for post in drifted:
+            self.stdout.write(
+                f"{post.id}: {post.like_count} likes stored, {post.actual_like_count} actual, "
+                f"{post.comment_count} comments stored, {post.actual_comment_count} actual"
+            )
+        if options["dry_run"]:
+            return
+        repaired = counters.repair_counters(drifted)
+        self.stdout.write(self.style.SUCCESS(f"Repaired {repaired} posts."))
@@ -0,0 +1,40 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from network import health, sync
+from network.models import ForeignServer
+
+
+class Command(BaseCommand):
+    help = "Mirrors the new posts of foreign servers into the RemotePost table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--server",
+            help="Only sync the server with this id.",
+        )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep syncing every FEDERATION_SYNC_INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            servers = ForeignServer.objects.exclude(ip="local")
+            if options["server"]:
+                servers = servers.filter(id=options["server"])
+                if not servers.exists():
+                    raise CommandError(f"No foreign server with id {options['server']}")
+            for server, count in sync.sync_servers(servers).items():
+                self.stdout.write(f"{server.ip}:{server.port}: {count} posts synced")
+            if not options["loop"]:
+                # A single run exits before its calls are saved in the background.
+                health.persist()
+                return
+            # Long running workers should not hold on to a connection between runs.
+            close_old_connections()
+            time.sleep(settings.FEDERATION_SYNC_INTERVAL)
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0006_foreignuserblocklist"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RemoteLike",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("post", models.TextField()),
+                (
+                    "server",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.foreignserver",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="RemotePost",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("remote_id", models.TextField()),
+                ("username", models.TextField()),
+                ("content", models.TextField()),
+                ("timestamp", models.DateTimeField()),
+                ("like_count", models.PositiveIntegerField(default=0)),
+                ("comment_count", models.PositiveIntegerField(default=0)),
+                ("comments", models.JSONField(default=list)),
+                ("synced", models.DateTimeField(auto_now=True)),
+                (
+                    "server",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.foreignserver",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["-timestamp"], name="remote_post_timestamp"),
+                    models.Index(
+                        fields=["server", "username", "-timestamp"],
+                        name="remote_post_author",
+                    ),
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="remotepost",
+            constraint=models.UniqueConstraint(
+                fields=("server", "remote_id"), name="unique_remote_post"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="remotelike",
+            constraint=models.UniqueConstraint(
+                fields=("user", "server", "post"), name="unique_remote_like"
+            ),
+        ),
+    ]
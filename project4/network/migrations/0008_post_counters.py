@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_likes_and_comments(apps, schema_editor):
+    post_model = apps.get_model("network", "Post")
+    like_model = apps.get_model("network", "ForeignLike")
+    comment_model = apps.get_model("network", "ForeignComment")
+    post_model.objects.update(
+        like_count=Coalesce(
+            Subquery(
+                like_model.objects.filter(post=OuterRef("pk"))
+                .values("post")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        ),
+        comment_count=Coalesce(
+            Subquery(
+                comment_model.objects.filter(post=OuterRef("pk"))
+                .values("post")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0007_remotepost"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_likes_and_comments, migrations.RunPython.noop),
+    ]
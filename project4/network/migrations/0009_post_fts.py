@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:40
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+
+def create_index(apps, schema_editor):
+    # FTS5 is specific to SQLite, other databases search without an index.
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    post_model = apps.get_model("network", "Post")
+    remote_post_model = apps.get_model("network", "RemotePost")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE network_post_fts USING fts5("
+            "post_id UNINDEXED, source UNINDEXED, username, content)"
+        )
+        cursor.executemany(
+            "INSERT INTO network_post_fts (post_id, source, username, content) "
+            "VALUES (%s, %s, %s, %s)",
+            [
+                (str(i.pk), "local", i.user.username, strip_tags(i.content))
+                for i in post_model.objects.select_related("user").iterator()
+            ]
+            + [
+                (str(i.pk), "remote", i.username, strip_tags(i.content))
+                for i in remote_post_model.objects.iterator()
+            ],
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("DROP TABLE network_post_fts")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0008_post_counters"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.html import strip_tags
+import re
+import uuid
+
+
+def tag_existing_posts(apps, schema_editor):
+    hashtag_model = apps.get_model("network", "Hashtag")
+    post_hashtag_model = apps.get_model("network", "PostHashtag")
+    tags = []
+    for field, model_name in (("post", "Post"), ("remote_post", "RemotePost")):
+        for post in apps.get_model("network", model_name).objects.iterator():
+            for name in {
+                i.lower()
+                for i in re.findall(r"(?:^|(?<=\s))#(\w+)", strip_tags(post.content))
+            }:
+                tags.append((field, post, name))
+    hashtag_model.objects.bulk_create(
+        [hashtag_model(name=i) for i in {i[2] for i in tags}], ignore_conflicts=True
+    )
+    hashtag_ids = dict(hashtag_model.objects.values_list("name", "id"))
+    post_hashtag_model.objects.bulk_create(
+        [
+            post_hashtag_model(
+                hashtag_id=hashtag_ids[name], timestamp=post.timestamp, **{field: post}
+            )
+            for field, post, name in tags
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0009_post_fts"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Hashtag",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("name", models.TextField(unique=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PostHashtag",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                (
+                    "hashtag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.hashtag",
+                    ),
+                ),
+                (
+                    "post",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.post",
+                    ),
+                ),
+                (
+                    "remote_post",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.remotepost",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["hashtag", "-timestamp"], name="hashtag_timeline"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(tag_existing_posts, migrations.RunPython.noop),
+    ]
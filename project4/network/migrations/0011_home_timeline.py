@@ -0,0 +1,100 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def fill_home_timelines(apps, schema_editor):
+    follower_model = apps.get_model("network", "Follower")
+    entry_model = apps.get_model("network", "HomeTimelineEntry")
+    post_model = apps.get_model("network", "Post")
+    remote_post_model = apps.get_model("network", "RemotePost")
+    for follower in follower_model.objects.select_related("server").iterator():
+        if follower.server.ip == "local":
+            entries = [
+                entry_model(
+                    user_id=follower.following_user_id, post_id=pk, timestamp=timestamp
+                )
+                for pk, timestamp in post_model.objects.filter(
+                    user__username=follower.followee_user
+                ).values_list("pk", "timestamp")
+            ]
+        else:
+            entries = [
+                entry_model(
+                    user_id=follower.following_user_id,
+                    remote_post_id=pk,
+                    timestamp=timestamp,
+                )
+                for pk, timestamp in remote_post_model.objects.filter(
+                    server=follower.server, username=follower.followee_user
+                ).values_list("pk", "timestamp")
+            ]
+        entry_model.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0010_hashtags"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HomeTimelineEntry",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("timestamp", models.DateTimeField()),
+                (
+                    "post",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.post",
+                    ),
+                ),
+                (
+                    "remote_post",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.remotepost",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "-timestamp"], name="home_timeline")
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="hometimelineentry",
+            constraint=models.UniqueConstraint(
+                fields=("user", "post"), name="unique_home_timeline_post"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="hometimelineentry",
+            constraint=models.UniqueConstraint(
+                fields=("user", "remote_post"), name="unique_home_timeline_remote_post"
+            ),
+        ),
+        migrations.RunPython(fill_home_timelines, migrations.RunPython.noop),
+    ]
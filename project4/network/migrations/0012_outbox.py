@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0011_home_timeline"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxDelivery",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("queued", models.DateTimeField(default=django.utils.timezone.now)),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                (
+                    "next_attempt",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("last_error", models.TextField(blank=True)),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="network.post"
+                    ),
+                ),
+                (
+                    "server",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="network.foreignserver",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["next_attempt"], name="outbox_due")],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="outboxdelivery",
+            constraint=models.UniqueConstraint(
+                fields=("post", "server"), name="unique_outbox_delivery"
+            ),
+        ),
+    ]
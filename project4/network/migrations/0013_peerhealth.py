@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0012_outbox"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PeerHealth",
+            fields=[
+                (
+                    "server",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="network.foreignserver",
+                    ),
+                ),
+                ("latency_buckets", models.JSONField(default=list)),
+                ("successes", models.PositiveIntegerField(default=0)),
+                ("failures", models.PositiveIntegerField(default=0)),
+                ("consecutive_failures", models.PositiveIntegerField(default=0)),
+                ("last_success", models.DateTimeField(null=True)),
+                ("last_failure", models.DateTimeField(null=True)),
+                ("last_error", models.TextField(blank=True)),
+                ("open_until", models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:50
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def copy_timestamps(apps, schema_editor):
+    apps.get_model("network", "Post").objects.update(updated=F("timestamp"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0013_peerhealth"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="updated",
+            field=models.DateTimeField(
+                auto_now=True, default=django.utils.timezone.now
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_timestamps, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["updated"], name="post_updated"),
+        ),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:24
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def duplicate_groups(model, fields):
+    # The values of fields shared by more than one row.
+    groups = (
+        model.objects.values(*fields)
+        .annotate(count=Count("pk"))
+        .filter(count__gt=1)
+        .order_by()
+    )
+    return [{i: group[i] for i in fields} for group in groups]
+
+
+def remove_duplicates(model, fields):
+    # Keeps one row of every group of duplicates and returns the groups.
+    groups = duplicate_groups(model, fields)
+    for group in groups:
+        rows = model.objects.filter(**group)
+        keep = rows.order_by("pk").values_list("pk", flat=True).first()
+        rows.exclude(pk=keep).delete()
+    return groups
+
+
+def unique_field_sets(model):
+    # The names of the fields of every unique field or constraint of a model.
+    sets = [[i.name] for i in model._meta.fields if i.unique]
+    sets += [
+        list(i.fields)
+        for i in model._meta.constraints
+        if isinstance(i, models.UniqueConstraint) and i.fields and i.condition is None
+    ]
+    sets += [list(i) for i in model._meta.unique_together]
+    return sets
+
+
+def merge_rows(model, keep, duplicate):
+    # Moves the rows pointing at duplicate to keep, then deletes duplicate. Rows keep already has
+    # an equal of are merged into that row the same way, so nothing pointing at them is lost.
+    for relation in model._meta.related_objects:
+        related = relation.related_model
+        field = relation.field.name
+        for fields in unique_field_sets(related):
+            if field not in fields:
+                continue
+            others = [related._meta.get_field(i).attname for i in fields if i != field]
+            for row in list(related.objects.filter(**{field: duplicate})):
+                values = {i: getattr(row, i) for i in others}
+                # Null values never collide in a unique constraint.
+                if None in values.values():
+                    continue
+                existing = related.objects.filter(**{field: keep}, **values).first()
+                if existing is not None:
+                    merge_rows(related, existing, row)
+        related.objects.filter(**{field: duplicate}).update(**{field: keep})
+    duplicate.delete()
+
+
+def merge_duplicate_servers(apps, schema_editor):
+    server_model = apps.get_model("network", "ForeignServer")
+    for group in duplicate_groups(server_model, ["ip", "port"]):
+        keep, *duplicates = server_model.objects.filter(**group).order_by("pk")
+        for duplicate in duplicates:
+            merge_rows(server_model, keep, duplicate)
+
+
+def remove_duplicate_rows(apps, schema_editor):
+    like_model = apps.get_model("network", "ForeignLike")
+    post_model = apps.get_model("network", "Post")
+    groups = remove_duplicates(like_model, ["post", "user", "server"])
+    # Recount the likes of the posts that lost duplicates.
+    post_model.objects.filter(pk__in={i["post"] for i in groups}).update(
+        like_count=Coalesce(
+            Subquery(
+                like_model.objects.filter(post=OuterRef("pk"))
+                .values("post")
+                .annotate(count=Count("pk"))
+                .values("count")
+            ),
+            0,
+        )
+    )
+    remove_duplicates(
+        apps.get_model("network", "Follower"),
+        ["following_user", "server", "followee_user"],
+    )
+    remove_duplicates(
+        apps.get_model("network", "ForeignUserBlocklist"),
+        ["user", "server", "blocked_user"],
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0015_pending_interactions"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_servers, migrations.RunPython.noop),
+        migrations.RunPython(remove_duplicate_rows, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="follower",
+            index=models.Index(
+                fields=["server", "followee_user"], name="follower_followee"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="follower",
+            constraint=models.UniqueConstraint(
+                fields=("following_user", "server", "followee_user"),
+                name="unique_follower",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="foreignlike",
+            constraint=models.UniqueConstraint(
+                fields=("post", "user", "server"), name="unique_foreign_like"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="foreignserver",
+            constraint=models.UniqueConstraint(
+                fields=("ip", "port"), name="unique_foreign_server"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="foreignuserblocklist",
+            constraint=models.UniqueConstraint(
+                fields=("user", "server", "blocked_user"),
+                name="unique_foreign_user_block",
+            ),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0017_outbox_failed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ChangeStamp",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(fields=["user", "updated"], name="post_user_updated"),
+        ),
+    ]
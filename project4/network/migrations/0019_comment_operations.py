@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0018_change_stamps"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="foreigncomment",
+            name="operation",
+            field=models.UUIDField(null=True),
+        ),
+        migrations.AddConstraint(
+            model_name="foreigncomment",
+            constraint=models.UniqueConstraint(
+                fields=("server", "operation"), name="unique_comment_operation"
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0019_comment_operations"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pendinginteraction",
+            name="failed",
+            field=models.DateTimeField(null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("network", "0020_interaction_failed"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SyncState",
+            fields=[
+                (
+                    "server",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="network.foreignserver",
+                    ),
+                ),
+                ("newest", models.DateTimeField(null=True)),
+                ("cursor", models.TextField(null=True)),
+                ("cursor_newest", models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
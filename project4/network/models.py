@@ -2,6 +2,7 @@ import uuid
 
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -13,6 +14,17 @@ class Post(models.Model):
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    # Changed on every edit, like and comment, so federation endpoints can tell when posts changed.
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated"], name="post_updated"),
+            # Finds the last change to the posts of a user for the ETag of their profile.
+            models.Index(fields=["user", "updated"], name="post_user_updated"),
+        ]
 
 
 class ForeignServer(models.Model):
@@ -21,6 +33,14 @@ class ForeignServer(models.Model):
     port = models.PositiveBigIntegerField(default=8000)
     block = models.BooleanField(default=False)
 
+    class Meta:
+        # Federation endpoints identify the calling server by its address on every request.
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ip", "port"], name="unique_foreign_server"
+            ),
+        ]
+
 
 class Follower(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -30,6 +50,18 @@ class Follower(models.Model):
     followee_user = models.TextField()
     server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["following_user", "server", "followee_user"],
+                name="unique_follower",
+            ),
+        ]
+        indexes = [
+            # Finds the followers of an author when their posts are added to home timelines.
+            models.Index(fields=["server", "followee_user"], name="follower_followee"),
+        ]
+
 
 class ForeignLike(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -37,6 +69,13 @@ class ForeignLike(models.Model):
     user = models.TextField()
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "user", "server"], name="unique_foreign_like"
+            ),
+        ]
+
 
 class ForeignComment(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -45,6 +84,16 @@ class ForeignComment(models.Model):
     user = models.TextField()
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
+    # The id of the federation/batch operation that added the comment, so a batch sent again by
+    # the server does not add it twice.
+    operation = models.UUIDField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["server", "operation"], name="unique_comment_operation"
+            ),
+        ]
 
 
 class Blocklist(models.Model):
@@ -65,3 +114,178 @@ class ForeignUserBlocklist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
     blocked_user = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "server", "blocked_user"],
+                name="unique_foreign_user_block",
+            ),
+        ]
+
+
+class RemotePost(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
+    remote_id = models.TextField()
+    username = models.TextField()
+    content = models.TextField()
+    timestamp = models.DateTimeField()
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    comments = models.JSONField(default=list)
+    synced = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["server", "remote_id"], name="unique_remote_post"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["-timestamp"], name="remote_post_timestamp"),
+            models.Index(
+                fields=["server", "username", "-timestamp"],
+                name="remote_post_author",
+            ),
+        ]
+
+
+class SyncState(models.Model):
+    # How far sync_remote_posts mirrored the posts of a server. Posts pushed to the inbox are
+    # not counted, so the posts older than them are still fetched.
+    server = models.OneToOneField(
+        ForeignServer, primary_key=True, on_delete=models.CASCADE
+    )
+    # Every post of the server up to this timestamp was fetched by a sync.
+    newest = models.DateTimeField(null=True)
+    # Where a sync stopped after FEDERATION_SYNC_MAX_PAGES pages, and the newest post it had fetched.
+    cursor = models.TextField(null=True)
+    cursor_newest = models.DateTimeField(null=True)
+
+
+class RemoteLike(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
+    post = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "server", "post"], name="unique_remote_like"
+            )
+        ]
+
+
+class Hashtag(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    name = models.TextField(unique=True)
+
+
+class PostHashtag(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, null=True, on_delete=models.CASCADE)
+    remote_post = models.ForeignKey(RemotePost, null=True, on_delete=models.CASCADE)
+    # Copied from the post so a tag timeline is a range scan of the index below.
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["hashtag", "-timestamp"], name="hashtag_timeline"),
+        ]
+
+
+class HomeTimelineEntry(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, null=True, on_delete=models.CASCADE)
+    remote_post = models.ForeignKey(RemotePost, null=True, on_delete=models.CASCADE)
+    # Copied from the post so the Following view is a range scan of the index below.
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "post"], name="unique_home_timeline_post"
+            ),
+            models.UniqueConstraint(
+                fields=["user", "remote_post"], name="unique_home_timeline_remote_post"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["user", "-timestamp"], name="home_timeline"),
+        ]
+
+
+class OutboxDelivery(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
+    # When the post was first queued for the server, used to measure delivery lag.
+    created = models.DateTimeField(auto_now_add=True)
+    # When the post was last created or edited, so an edit made during a delivery is sent again.
+    queued = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # When the delivery was given up after FEDERATION_OUTBOX_MAX_ATTEMPTS, null while it is retried.
+    failed = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["post", "server"], name="unique_outbox_delivery"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["next_attempt"], name="outbox_due"),
+        ]
+
+
+class PendingInteraction(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    server = models.ForeignKey(ForeignServer, on_delete=models.CASCADE)
+    # The id of the post on the foreign server.
+    post = models.TextField()
+    # 'like', 'unlike' or 'comment', see counters.BATCH_ACTIONS.
+    action = models.TextField()
+    content = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Set while a dispatcher is sending the interaction, so it is not sent twice.
+    claim = models.UUIDField(null=True)
+    # When the interaction was given up after FEDERATION_INTERACTION_MAX_ATTEMPTS, null while it is retried.
+    failed = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["next_attempt"], name="interaction_due"),
+            models.Index(fields=["user", "server", "post"], name="interaction_post"),
+        ]
+
+
+class PeerHealth(models.Model):
+    server = models.OneToOneField(
+        ForeignServer, primary_key=True, on_delete=models.CASCADE
+    )
+    # Request counts per latency bucket, see health.LATENCY_BUCKETS.
+    latency_buckets = models.JSONField(default=list)
+    successes = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    last_success = models.DateTimeField(null=True)
+    last_failure = models.DateTimeField(null=True)
+    last_error = models.TextField(blank=True)
+    # The circuit breaker is open until this time, when a single probe request is let through.
+    open_until = models.DateTimeField(null=True)
+
+
+class ChangeStamp(models.Model):
+    # Bumped on changes that leave no timestamp behind, such as deletions, see stamps.py.
+    name = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
@@ -0,0 +1,210 @@
+"""
+Pushes new and edited local posts to foreign servers through a durable outbox.
+
+Saving a local post queues an OutboxDelivery row for every foreign server that
+is not blocked (signals.py). The deliver_outbox command sends the due rows of
+each server in batches to its federation/inbox endpoint and deletes them once
+the server accepts them. Failed deliveries are retried with exponential
+backoff and marked failed after FEDERATION_OUTBOX_MAX_ATTEMPTS, such as for
+servers without a federation/inbox endpoint, so they stop being sent. The age
+of the oldest queued row of a server is its delivery lag.
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db.models import Count, Min, Prefetch, Q
+from django.utils import timezone
+
+from . import federation, timeline
+from .models import ForeignComment, ForeignServer, OutboxDelivery
+
+
+def peers():
+    """
+    Lists the servers local posts are delivered to.
+
+    Returns:
+    QuerySet: The foreign servers that are not blocked.
+    """
+    return ForeignServer.objects.exclude(ip="local").exclude(block=True)
+
+
+def enqueue(post):
+    """
+    Queues a created or edited local post for delivery to every peer.
+
+    A post that is still queued for a server is not queued twice, its delivery sends the latest content.
+
+    Parameters:
+    post (Post): The post to deliver.
+    """
+    now = timezone.now()
+    OutboxDelivery.objects.bulk_create(
+        [OutboxDelivery(post=post, server=i, queued=now) for i in peers()],
+        update_conflicts=True,
+        unique_fields=["post", "server"],
+        update_fields=["queued"],
+    )
+
+
+def post_payload(post):
+    """
+    Converts a post into the format returned by the federation/posts endpoint.
+
+    Parameters:
+    post (Post): The post to convert, with its user and comments loaded.
+
+    Returns:
+    dict: The post.
+    """
+    return {
+        "id": post.id,
+        "content": post.content,
+        "timestamp": post.timestamp,
+        "timestamp_user": timeline.format_timestamp(post.timestamp),
+        "user_id": post.user_id,
+        "username": post.user.username,
+        "like_count": post.like_count,
+        "comment_count": post.comment_count,
+        "likes": post.like_count,
+        "comments": [
+            {
+                "id": i.id,
+                "server_id": i.server_id,
+                "user": i.user,
+                "post_id": i.post_id,
+                "content": i.content,
+                "timestamp": timeline.format_timestamp(i.timestamp),
+            }
+            for i in post.foreigncomment_set.all()
+        ],
+        "liked": False,
+    }
+
+
+def retry_delay(attempts):
+    """
+    Computes how long to wait before retrying a failed delivery.
+
+    Parameters:
+    attempts (int): The number of failed attempts so far.
+
+    Returns:
+    timedelta: The delay before the next attempt.
+    """
+    return datetime.timedelta(
+        seconds=min(
+            settings.FEDERATION_OUTBOX_RETRY_BASE * 2 ** (attempts - 1),
+            settings.FEDERATION_OUTBOX_RETRY_MAX,
+        )
+    )
+
+
+def _send(server, posts, timeout):
+    # Returns the error of a failed delivery instead of raising it, so fan_out reports every server.
+    try:
+        federation.deliver_posts(server, posts, timeout)
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+
+def deliver_due():
+    """
+    Delivers one batch of due posts to every peer, all peers at once.
+
+    Returns:
+    dict: A mapping of ForeignServer to the number of posts delivered, 0 for the servers that failed.
+    """
+    started = timezone.now()
+    batches = {}
+    for server in (
+        peers()
+        .filter(outboxdelivery__next_attempt__lte=started, outboxdelivery__failed=None)
+        .distinct()
+    ):
+        batches[server] = list(
+            OutboxDelivery.objects.filter(
+                server=server, next_attempt__lte=started, failed=None
+            )
+            .select_related("post__user")
+            .prefetch_related(
+                Prefetch(
+                    "post__foreigncomment_set",
+                    queryset=ForeignComment.objects.order_by("timestamp"),
+                )
+            )
+            .order_by("created")[: settings.FEDERATION_OUTBOX_BATCH_SIZE]
+        )
+    # Only the requests run on the federation pool, the outbox is updated from this thread.
+    errors = federation.fan_out(
+        batches,
+        lambda server, timeout: _send(
+            server, [post_payload(i.post) for i in batches[server]], timeout
+        ),
+        settings.FEDERATION_TIMEOUT,
+    )
+    delivered = {}
+    for server, deliveries in batches.items():
+        if server in errors and errors[server] is None:
+            # Posts edited while they were being sent stay queued to send the new content.
+            OutboxDelivery.objects.filter(
+                pk__in=[i.pk for i in deliveries], queued__lte=started
+            ).delete()
+            delivered[server] = len(deliveries)
+            continue
+        for i in deliveries:
+            i.attempts += 1
+            i.next_attempt = timezone.now() + retry_delay(i.attempts)
+            i.last_error = errors.get(server) or "No answer"
+            if i.attempts >= settings.FEDERATION_OUTBOX_MAX_ATTEMPTS:
+                i.failed = timezone.now()
+        OutboxDelivery.objects.bulk_update(
+            deliveries, ["attempts", "next_attempt", "last_error", "failed"]
+        )
+        delivered[server] = 0
+    return delivered
+
+
+def lag():
+    """
+    Measures the delivery lag of every peer with queued or failed posts.
+
+    Returns:
+    dict: A mapping of ForeignServer to a dict with the number of 'queued' posts, 'lag_seconds',
+    the age of the oldest of them, and the number of 'failed' posts that are no longer sent.
+    """
+    now = timezone.now()
+    retried = Q(outboxdelivery__failed=None)
+    servers = peers().annotate(
+        queued=Count("outboxdelivery", filter=retried),
+        oldest=Min("outboxdelivery__created", filter=retried),
+        failed=Count("outboxdelivery", filter=~retried),
+    )
+    return {
+        i: {
+            "queued": i.queued,
+            "lag_seconds": (now - i.oldest).total_seconds() if i.queued else 0,
+            "failed": i.failed,
+        }
+        for i in servers.filter(Q(queued__gt=0) | Q(failed__gt=0))
+    }
+
+
+def retry_failed(server=None):
+    """
+    Queues the failed deliveries again, such as after a server added the federation/inbox endpoint.
+
+    Parameters:
+    server (ForeignServer, optional): Only retry the deliveries to this server. Defaults to every server.
+
+    Returns:
+    int: The number of deliveries queued again.
+    """
+    failed = OutboxDelivery.objects.exclude(failed=None)
+    if server is not None:
+        failed = failed.filter(server=server)
+    return failed.update(
+        failed=None, attempts=0, next_attempt=timezone.now(), last_error=""
+    )
@@ -0,0 +1,64 @@
+"""
+Keyset pagination of posts for the federation endpoints.
+
+A cursor is an opaque string encoding the (timestamp, id) of the last post of a
+page. The next page holds the posts that come after it when ordering by
+("-timestamp", "-id"), so a page costs the same no matter how deep it is.
+"""
+
+import base64
+import datetime
+import json
+import uuid
+
+from django.db.models import Q
+
+
+def encode_cursor(timestamp, pk):
+    """
+    Encodes the position of a post into a cursor.
+
+    Parameters:
+    timestamp (datetime): The timestamp of the last post of the page.
+    pk (UUID): The id of the last post of the page.
+
+    Returns:
+    str: The opaque cursor.
+    """
+    raw = json.dumps([timestamp.isoformat(), str(pk)])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor made by encode_cursor.
+
+    Parameters:
+    cursor (str): The opaque cursor.
+
+    Returns:
+    tuple: The timestamp and id of the post the cursor points at.
+
+    Raises:
+    ValueError: If the cursor is malformed.
+    """
+    try:
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.datetime.fromisoformat(timestamp), uuid.UUID(pk)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def after_cursor(posts, cursor):
+    """
+    Filters posts ordered by ("-timestamp", "-id") down to the ones after a cursor.
+
+    Parameters:
+    posts (QuerySet): The posts to filter.
+    cursor (str): The cursor of the last post of the previous page.
+
+    Returns:
+    QuerySet: The posts after the cursor.
+    """
+    timestamp, pk = decode_cursor(cursor)
+    return posts.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
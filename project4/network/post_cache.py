@@ -0,0 +1,204 @@
+"""
+Cache in front of the federation/posts requests made by render_index.
+
+Entries are stored per foreign server in the cache named by
+FEDERATION_CACHE_ALIAS. The posts are fetched anonymously, so one entry serves
+every viewer, and the views mark the posts the viewer liked from their
+RemoteLike rows. A fresh entry is served as is, a stale entry is served while a
+background refresh fetches the new posts, and an expired entry is fetched again
+before the page is rendered.
+
+aget_posts and arefresh do the same for the async views.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import federation
+
+# Keys currently being refreshed in the background by this process.
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the cache used to store the posts of foreign servers.
+
+    Returns:
+    BaseCache: The cache named by FEDERATION_CACHE_ALIAS.
+    """
+    return caches[settings.FEDERATION_CACHE_ALIAS]
+
+
+def cache_key(server):
+    """
+    Builds the cache key of the posts of a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server the posts come from.
+
+    Returns:
+    str: The cache key.
+    """
+    return f"federation-posts:{server.id}"
+
+
+def _complete(entry, limit, match):
+    # Whether an entry holds enough posts for a page, or every post of the server.
+    if entry["next_cursor"] is None:
+        return True
+    if match is None:
+        return len(entry["posts"]) >= limit
+    return sum(1 for i in entry["posts"] if match(i)) >= limit
+
+
+def _expires(entry):
+    # Seconds an extended entry is kept, counted from the time its first posts were fetched.
+    return max(
+        entry["fetched"]
+        + settings.FEDERATION_CACHE_TTL
+        + settings.FEDERATION_CACHE_STALE
+        - time.time(),
+        1,
+    )
+
+
+def get_posts(server, port, limit, timeout=None, match=None):
+    """
+    Returns the newest posts of a foreign server, using the cache when possible.
+
+    When the page only shows some of the posts, such as the posts of followed users or the ones
+    matching a search, older pages are fetched after the cached ones until enough posts match, the
+    server has no more posts or FEDERATION_LIVE_MAX_PAGES more pages were fetched.
+
+    Parameters:
+    server (ForeignServer): The server to get the posts of.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts needed.
+    timeout (float, optional): The timeout of the request if the posts have to be fetched.
+    match (callable, optional): Tells if a post is shown on the page. Defaults to showing every post.
+
+    Returns:
+    dict: The posts of the server and the next_cursor after the last of them.
+    """
+    entry = get_cache().get(cache_key(server))
+    if entry is None:
+        entry = refresh(server, port, limit, timeout)
+    elif time.time() - entry["fetched"] >= settings.FEDERATION_CACHE_TTL:
+        # Serve the stale posts now and fetch the new ones for the next page view.
+        _refresh_in_background(server, port, max(limit, len(entry["posts"])))
+    if _complete(entry, limit, match):
+        return entry
+    for _ in range(settings.FEDERATION_LIVE_MAX_PAGES):
+        page = federation.fetch_page(
+            server, "", port, limit, entry["next_cursor"], timeout
+        )
+        entry["posts"] += page["posts"]
+        entry["next_cursor"] = page["next_cursor"]
+        if _complete(entry, limit, match):
+            break
+    get_cache().set(cache_key(server), entry, _expires(entry))
+    return entry
+
+
+def refresh(server, port, limit, timeout=None):
+    """
+    Fetches the newest posts of a foreign server and stores them in the cache.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts of.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts to fetch.
+    timeout (float, optional): The timeout of the request.
+
+    Returns:
+    dict: The posts of the server and the next_cursor after the last of them.
+    """
+    # Fetched anonymously so the entry can be shared, the views apply the liked flags of the viewer.
+    entry = federation.fetch_posts(server, "", port, limit, timeout)
+    entry["fetched"] = time.time()
+    get_cache().set(
+        cache_key(server),
+        entry,
+        settings.FEDERATION_CACHE_TTL + settings.FEDERATION_CACHE_STALE,
+    )
+    return entry
+
+
+async def aget_posts(server, port, limit, timeout=None, match=None):
+    """
+    Returns the newest posts of a foreign server without blocking the event loop, like get_posts.
+
+    Parameters:
+    server (ForeignServer): The server to get the posts of.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts needed.
+    timeout (float, optional): The timeout of the request if the posts have to be fetched.
+    match (callable, optional): Tells if a post is shown on the page. Defaults to showing every post.
+
+    Returns:
+    dict: The posts of the server and the next_cursor after the last of them.
+    """
+    entry = await get_cache().aget(cache_key(server))
+    if entry is None:
+        entry = await arefresh(server, port, limit, timeout)
+    elif time.time() - entry["fetched"] >= settings.FEDERATION_CACHE_TTL:
+        _refresh_in_background(server, port, max(limit, len(entry["posts"])))
+    if _complete(entry, limit, match):
+        return entry
+    for _ in range(settings.FEDERATION_LIVE_MAX_PAGES):
+        page = await federation.afetch_page(
+            server, "", port, limit, entry["next_cursor"], timeout
+        )
+        entry["posts"] += page["posts"]
+        entry["next_cursor"] = page["next_cursor"]
+        if _complete(entry, limit, match):
+            break
+    await get_cache().aset(cache_key(server), entry, _expires(entry))
+    return entry
+
+
+async def arefresh(server, port, limit, timeout=None):
+    """
+    Fetches the newest posts of a foreign server without blocking the event loop and caches them, like refresh.
+
+    Parameters:
+    server (ForeignServer): The server to get the posts of.
+    port (str): The port this server is listening on.
+    limit (int): The number of posts needed.
+    timeout (float, optional): The timeout of the request if the posts have to be fetched.
+
+    Returns:
+    dict: The posts of the server and the next_cursor after the last of them.
+    """
+    entry = await federation.afetch_posts(server, "", port, limit, timeout)
+    entry["fetched"] = time.time()
+    await get_cache().aset(
+        cache_key(server),
+        entry,
+        settings.FEDERATION_CACHE_TTL + settings.FEDERATION_CACHE_STALE,
+    )
+    return entry
+
+
+def _refresh_in_background(server, port, limit):
+    key = cache_key(server)
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            refresh(server, port, limit)
+        except Exception as e:
+            print(f"Error refreshing posts from {server.ip}: {e}")
+        finally:
+            with _refreshing_lock:
+                _refreshing.discard(key)
+
+    federation.submit(run)
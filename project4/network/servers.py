@@ -0,0 +1,157 @@
+"""
+A process-wide registry of the ForeignServer rows, so resolving a server costs no query.
+
+Views look servers up by id, by the (ip, port) address of a calling server, or
+ask for the local server on almost every request. The rows are loaded once per
+process and indexed for those lookups. Saving or deleting a server clears the
+registry of the process through signals (signals.py) and bumps the SERVERS
+change stamp (stamps.py) in the same transaction. Other processes compare their
+version with the stamp, a primary key lookup, at most every
+FEDERATION_SERVER_REGISTRY_CHECK seconds and reload on change.
+
+The servers returned are shared by every request of the process and must not be changed.
+"""
+
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+
+from . import stamps
+from .models import ForeignServer
+
+_lock = threading.Lock()
+_registry = None
+
+
+class _Registry:
+    # The servers of one version, indexed for every lookup.
+
+    def __init__(self, version):
+        self.version = version
+        self.checked = time.monotonic()
+        self.servers = list(ForeignServer.objects.order_by("ip", "port"))
+        self.by_id = {i.id: i for i in self.servers}
+        self.by_address = {(i.ip, i.port): i for i in self.servers}
+        self.local = next((i for i in self.servers if i.ip == "local"), None)
+
+
+def _get_registry():
+    global _registry
+    registry = _registry
+    if (
+        registry is not None
+        and time.monotonic() - registry.checked
+        < settings.FEDERATION_SERVER_REGISTRY_CHECK
+    ):
+        return registry
+    with _lock:
+        (version,) = stamps.get(stamps.SERVERS)
+        if _registry is not None and _registry.version == version:
+            _registry.checked = time.monotonic()
+        else:
+            _registry = _Registry(version)
+        return _registry
+
+
+def invalidate():
+    """
+    Drops the registry of every process after a server was saved or deleted.
+
+    The stamp is bumped in the transaction of the change, so other processes see both at once.
+    The registry of this process is dropped right away and again once the transaction commits,
+    so it is never reloaded with the rows from before the change.
+    """
+
+    def drop():
+        global _registry
+        with _lock:
+            _registry = None
+
+    stamps.bump(stamps.SERVERS)
+    drop()
+    transaction.on_commit(drop)
+
+
+def all_servers():
+    """
+    Lists every server, the local one included.
+
+    Returns:
+    list: The ForeignServer objects, ordered by address.
+    """
+    return _get_registry().servers
+
+
+def remote_servers():
+    """
+    Lists the foreign servers.
+
+    Returns:
+    list: The ForeignServer objects other than the local one, ordered by address.
+    """
+    return [i for i in _get_registry().servers if i.ip != "local"]
+
+
+def get_local():
+    """
+    Returns the server entry of this server.
+
+    Returns:
+    ForeignServer: The local server.
+
+    Raises:
+    Http404: If there is no local server entry.
+    """
+    local = _get_registry().local
+    if local is None:
+        raise Http404("No ForeignServer matches the given query.")
+    return local
+
+
+def get(server_id):
+    """
+    Finds a server by id, like get_object_or_404 without the query.
+
+    Parameters:
+    server_id (str): The id of the server.
+
+    Returns:
+    ForeignServer: The server.
+
+    Raises:
+    Http404: If the id is invalid or no server has it.
+    """
+    try:
+        server = _get_registry().by_id.get(uuid.UUID(str(server_id)))
+    except ValueError:
+        server = None
+    if server is None:
+        raise Http404("No ForeignServer matches the given query.")
+    return server
+
+
+def get_by_address(ip, port):
+    """
+    Finds a server by the address it calls from, like get_object_or_404 without the query.
+
+    Parameters:
+    ip (str): The IP address of the server.
+    port (str): The port the server listens on, as sent in the request.
+
+    Returns:
+    ForeignServer: The server.
+
+    Raises:
+    Http404: If the port is invalid or no server has the address.
+    """
+    try:
+        server = _get_registry().by_address.get((ip, int(port)))
+    except (TypeError, ValueError):
+        server = None
+    if server is None:
+        raise Http404("No ForeignServer matches the given query.")
+    return server
@@ -0,0 +1,100 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import federation, fulltext, hashtags, home_timeline, outbox, servers, stamps
+from .models import Follower, ForeignServer, Post, RemotePost
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    """Adds a created or edited local post to the full-text index."""
+    fulltext.index_posts(fulltext.LOCAL, [instance])
+
+
+@receiver(post_save, sender=Post)
+def tag_post(sender, instance, **kwargs):
+    """Stores the hashtags of a created or edited local post."""
+    hashtags.tag_posts([instance])
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    """Adds a new local post to the home timelines of the followers of its author."""
+    if created:
+        home_timeline.add_local_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def queue_post_delivery(sender, instance, **kwargs):
+    """Queues a created or edited local post for delivery to foreign servers."""
+    outbox.enqueue(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    """Removes a deleted local post from the full-text index."""
+    fulltext.remove_posts(fulltext.LOCAL, [instance.pk])
+
+
+@receiver(post_delete, sender=Post)
+def stamp_deleted_post(sender, instance, **kwargs):
+    """Changes the ETags of the federation endpoints, which a deletion does not show in."""
+    stamps.bump(stamps.POSTS)
+
+
+@receiver(post_save, sender=RemotePost)
+def index_remote_post(sender, instance, **kwargs):
+    """Adds a saved remote post to the full-text index."""
+    fulltext.index_posts(fulltext.REMOTE, [instance])
+
+
+@receiver(post_save, sender=RemotePost)
+def tag_remote_post(sender, instance, **kwargs):
+    """Stores the hashtags of a saved remote post."""
+    hashtags.tag_posts([instance], remote=True)
+
+
+@receiver(post_save, sender=RemotePost)
+def fan_out_remote_post(sender, instance, created, **kwargs):
+    """Adds a new remote post to the home timelines of the followers of its author."""
+    if created:
+        home_timeline.add_remote_posts(instance.server, [instance])
+
+
+@receiver(post_delete, sender=RemotePost)
+def unindex_remote_post(sender, instance, **kwargs):
+    """Removes a deleted remote post, for example of a deleted server, from the full-text index."""
+    fulltext.remove_posts(fulltext.REMOTE, [instance.pk])
+
+
+@receiver(post_save, sender=Follower)
+def backfill_home_timeline(sender, instance, created, **kwargs):
+    """Adds the posts of a newly followed user to the home timeline of the follower."""
+    if created:
+        home_timeline.backfill(instance)
+
+
+@receiver(post_delete, sender=Follower)
+def prune_home_timeline(sender, instance, **kwargs):
+    """Removes the posts of an unfollowed or blocked user from the home timeline of the follower."""
+    home_timeline.prune(instance)
+
+
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def stamp_followers(sender, instance, **kwargs):
+    """Changes the ETags of the federation/user responses, which show the follower counts."""
+    stamps.bump(stamps.FOLLOWERS)
+
+
+@receiver(post_delete, sender=ForeignServer)
+def close_server_session(sender, instance, **kwargs):
+    """Closes the pooled connections to a deleted server."""
+    federation.close_session(instance)
+
+
+@receiver(post_save, sender=ForeignServer)
+@receiver(post_delete, sender=ForeignServer)
+def invalidate_server_registry(sender, instance, **kwargs):
+    """Reloads the server registry of every process after a server was added, changed or deleted."""
+    servers.invalidate()
@@ -0,0 +1,47 @@
+"""
+Version numbers of data that has no timestamp to tell when it last changed.
+
+Deleting a post or following a user leaves no Post.updated behind, so the
+ETags of the federation endpoints would miss it, and the server registry of
+every process has to notice a changed ForeignServer. Such changes bump a named
+ChangeStamp row instead, which every process reads with a primary key lookup.
+"""
+
+from django.db.models import F
+
+from .models import ChangeStamp
+
+# Bumped when a local post is deleted.
+POSTS = "posts"
+# Bumped when a local user follows or unfollows someone.
+FOLLOWERS = "followers"
+# Bumped when a foreign server is added, changed or deleted, see servers.py.
+SERVERS = "servers"
+
+
+def bump(name):
+    """
+    Marks the data of a stamp as changed.
+
+    Parameters:
+    name (str): The name of the stamp, such as POSTS.
+    """
+    if not ChangeStamp.objects.filter(name=name).update(version=F("version") + 1):
+        # Any version differs from the missing row, even if another caller created it first.
+        ChangeStamp.objects.get_or_create(name=name, defaults={"version": 1})
+
+
+def get(*names):
+    """
+    Reads the versions of stamps.
+
+    Parameters:
+    *names (str): The names of the stamps.
+
+    Returns:
+    tuple: The version of every stamp in the order of the names, 0 for stamps never bumped.
+    """
+    versions = dict(
+        ChangeStamp.objects.filter(name__in=names).values_list("name", "version")
+    )
+    return tuple(versions.get(i, 0) for i in names)
@@ -11,8 +11,12 @@ document.addEventListener('DOMContentLoaded', () => {
     handleEditButtons();
     handleCommentButtons();
     handleSubmitEditButtons();
+    scheduleCountRefresh();
 });
 
+// Milliseconds between two refreshes of the like and comment counts of the visible posts.
+const COUNT_REFRESH_INTERVAL = 30000;
+
 /**
  * Adds click event listeners to like buttons.
  * Each button makes an asynchronous request to either like or unlike a post based on its current state.
@@ -29,9 +33,19 @@ function handleLikeButtons() {
             const data = await response.json();
 
             if (data.success) {
-                document.querySelector(`#like-count-${postId}`).textContent = `Like Count: ${data.likeCount}`;
+                const likeCount = document.querySelector(`#like-count-${postId}`);
+                let count = data.likeCount;
+                // Likes of posts that are not mirrored only know the count shown on the page.
+                if (count === null || count === undefined) {
+                    count = parseInt(likeCount.textContent.replace(/\D/g, ''), 10) + (isLiked ? -1 : 1);
+                }
+                likeCount.textContent = `Like Count: ${count}` + (data.pending ? ' (sending...)' : '');
                 this.textContent = isLiked ? 'Like post' : 'Unlike post';
                 this.dataset.liked = isLiked ? 'false' : 'true';
+                if (data.pending) {
+                    // Refreshes would show the counts of the server before the like is delivered.
+                    this.closest('.post-item').dataset.pending = 'true';
+                }
             } else {
                 console.error('An error occurred while liking/unliking the post.');
             }
@@ -106,4 +120,87 @@ function handleSubmitEditButtons() {
             document.getElementById(`submit-edit-button-${postId}`).style.display = "none";
         });
     });
-}
\ No newline at end of file
+}
+
+
+/**
+ * Refreshes the like and comment counts of the posts on the page every COUNT_REFRESH_INTERVAL,
+ * while the page is visible, and as soon as it becomes visible again.
+ * Only signed in users, whose pages hold a CSRF token, can refresh the counts.
+ */
+function scheduleCountRefresh() {
+    if (!document.querySelector('.post-item') || !csrfToken()) {
+        return;
+    }
+    setInterval(() => {
+        if (document.visibilityState === 'visible') {
+            refreshCounts();
+        }
+    }, COUNT_REFRESH_INTERVAL);
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'visible') {
+            refreshCounts();
+        }
+    });
+}
+
+/**
+ * Returns the CSRF token of the forms on the page, null if there is none.
+ */
+function csrfToken() {
+    const input = document.querySelector('[name=csrfmiddlewaretoken]');
+    return input ? input.value : null;
+}
+
+/**
+ * Fetches the counts of every post on the page in one request and updates them without reloading the page.
+ * Posts with interactions that are still being sent keep the counts shown for them.
+ */
+async function refreshCounts() {
+    const posts = {};
+    document.querySelectorAll('.post-item').forEach(item => {
+        if (item.dataset.pending === 'true') {
+            return;
+        }
+        (posts[item.dataset.server] = posts[item.dataset.server] || []).push(item.dataset.postId);
+    });
+    if (!Object.keys(posts).length) {
+        return;
+    }
+
+    let data;
+    try {
+        const response = await fetch('/refresh_counts', {
+            method: 'POST', headers: {
+                'Content-Type': 'application/json', 'X-CSRFToken': csrfToken()
+            }, body: JSON.stringify({posts})
+        });
+        data = await response.json();
+    } catch (error) {
+        console.error('An error occurred while refreshing the counts.', error);
+        return;
+    }
+
+    Object.values(data.posts || {}).forEach(serverCounts => {
+        Object.entries(serverCounts).forEach(([postId, counts]) => {
+            const item = document.querySelector(`.post-item[data-post-id="${postId}"]`);
+            // A like may have been sent while the counts were being fetched.
+            if (item && item.dataset.pending === 'true') {
+                return;
+            }
+            const likeCount = document.getElementById(`like-count-${postId}`);
+            const commentCount = document.getElementById(`comment-count-${postId}`);
+            const likeButton = document.getElementById(`like-button-${postId}`);
+            if (likeCount) {
+                likeCount.textContent = `Like Count: ${counts.likeCount}`;
+            }
+            if (commentCount) {
+                commentCount.textContent = `Comment Count: ${counts.commentCount}`;
+            }
+            if (likeButton) {
+                likeButton.textContent = counts.liked ? 'Unlike post' : 'Like post';
+                likeButton.dataset.liked = counts.liked ? 'true' : 'false';
+            }
+        });
+    });
+}
@@ -0,0 +1,146 @@
+"""
+Mirrors the posts of foreign servers into the RemotePost table.
+
+The sync_remote_posts command calls sync_servers periodically. Each run walks
+the newest pages of every server's federation/posts endpoint until it reaches
+the newest post an earlier run fetched, so a quiet server costs a single
+request. That mark is kept in the SyncState of the server and only moved by
+the sync: posts pushed to federation/inbox can be newer than posts that were
+never mirrored. A run that stops after FEDERATION_SYNC_MAX_PAGES pages leaves
+its cursor behind, and the next run continues the walk from there.
+"""
+
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+
+from . import federation, fulltext, hashtags, home_timeline
+from .models import ForeignServer, RemotePost, SyncState
+
+
+def fetch_new_posts(server, newest, timeout=None, cursor=None):
+    """
+    Fetches the posts of a foreign server newer than the newest one fetched by an earlier sync.
+
+    The page holding that post is fetched too, which refreshes the like and comment counts of
+    the most recent posts.
+
+    Parameters:
+    server (ForeignServer): The server to fetch the posts of.
+    newest (datetime): The timestamp of the newest post fetched by an earlier sync, None if there is none.
+    timeout (float, optional): The timeout of each request in seconds.
+    cursor (str, optional): The cursor an earlier sync stopped at. Defaults to the newest posts.
+
+    Returns:
+    dict: The posts fetched from the server, newest first, and the next_cursor to continue from,
+    which is None once the posts reach back to newest or to the oldest post of the server.
+    """
+    posts = []
+    for _ in range(settings.FEDERATION_SYNC_MAX_PAGES):
+        page = federation.fetch_page(
+            server,
+            "",
+            settings.FEDERATION_PORT,
+            settings.FEDERATION_SYNC_PAGE_SIZE,
+            cursor,
+            timeout,
+        )
+        posts += page["posts"]
+        cursor = page["next_cursor"]
+        if cursor is None or (
+            newest is not None
+            and any(parse_datetime(i["timestamp"]) <= newest for i in page["posts"])
+        ):
+            return {"posts": posts, "next_cursor": None}
+    return {"posts": posts, "next_cursor": cursor}
+
+
+def save_posts(server, posts):
+    """
+    Inserts or updates the mirrored copies of posts fetched from a foreign server.
+
+    Parameters:
+    server (ForeignServer): The server the posts come from.
+    posts (list): The posts as returned by the federation/posts endpoint of the server.
+
+    Returns:
+    int: The number of posts saved.
+    """
+    RemotePost.objects.bulk_create(
+        [
+            RemotePost(
+                server=server,
+                remote_id=str(i["id"]),
+                username=i["username"],
+                content=i["content"],
+                timestamp=parse_datetime(i["timestamp"]),
+                like_count=i["likes"],
+                comment_count=len(i["comments"]),
+                comments=i["comments"],
+            )
+            for i in posts
+        ],
+        update_conflicts=True,
+        unique_fields=["server", "remote_id"],
+        update_fields=["content", "like_count", "comment_count", "comments", "synced"],
+    )
+    # Bulk inserts send no signals, so index, tag and fan out the saved rows here.
+    saved = list(
+        RemotePost.objects.filter(
+            server=server, remote_id__in=[str(i["id"]) for i in posts]
+        )
+    )
+    fulltext.index_posts(fulltext.REMOTE, saved)
+    hashtags.tag_posts(saved, remote=True)
+    home_timeline.add_remote_posts(server, saved)
+    return len(posts)
+
+
+def sync_servers(servers=None):
+    """
+    Mirrors the new posts of foreign servers, fetching from all of them at once.
+
+    Parameters:
+    servers (iterable, optional): The ForeignServer objects to sync. Defaults to every foreign server.
+
+    Returns:
+    dict: A mapping of ForeignServer to the number of posts saved, for every server that answered.
+    """
+    if servers is None:
+        servers = ForeignServer.objects.exclude(ip="local")
+    servers = list(servers)
+    states = {
+        i.server_id: i
+        for i in SyncState.objects.filter(server__in=[i.id for i in servers])
+    }
+    for server in servers:
+        states.setdefault(server.id, SyncState(server=server))
+    # Only the requests run on the federation pool, the database is written from this thread.
+    fetched = federation.fan_out(
+        servers,
+        lambda server, timeout: fetch_new_posts(
+            server, states[server.id].newest, timeout, states[server.id].cursor
+        ),
+        settings.FEDERATION_SYNC_DEADLINE,
+    )
+    saved = {}
+    for server, result in fetched.items():
+        saved[server] = save_posts(server, result["posts"])
+        _advance(states[server.id], result)
+    return saved
+
+
+def _advance(state, result):
+    # Moves the mark of a server past the posts of a run, or keeps the cursor of an unfinished walk.
+    timestamps = [parse_datetime(i["timestamp"]) for i in result["posts"]]
+    newest = max(
+        [i for i in timestamps + [state.cursor_newest] if i is not None], default=None
+    )
+    if result["next_cursor"] is None:
+        if newest is not None and (state.newest is None or newest > state.newest):
+            state.newest = newest
+        state.cursor = None
+        state.cursor_newest = None
+    else:
+        state.cursor = result["next_cursor"]
+        state.cursor_newest = newest
+    state.save()
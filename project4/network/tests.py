@@ -1,3 +1,1427 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import runpy
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import msgpack
+import requests
+from requests.cookies import MockRequest, create_cookie
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.migrations.executor import MigrationExecutor
+from django.test import (
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (
+    benchmark,
+    checks,
+    codecs,
+    counters,
+    db,
+    federation,
+    fulltext,
+    hashtags,
+    health,
+    home_timeline,
+    interactions,
+    outbox,
+    pagination,
+    post_cache,
+    servers,
+    stamps,
+    sync,
+    timeline,
+)
+from .models import (
+    Follower,
+    ForeignBlocklist,
+    ForeignComment,
+    ForeignLike,
+    ForeignServer,
+    ForeignUserBlocklist,
+    Hashtag,
+    OutboxDelivery,
+    PeerHealth,
+    PendingInteraction,
+    Post,
+    RemoteLike,
+    RemotePost,
+    SyncState,
+    User,
+)
+from .viewer import ViewerContext
+
+
+def remote_post(number, username="bob", timestamp="2024-01-01T00:00:00.000000Z"):
+    # A post in the format of the federation/posts endpoint of a foreign server.
+    return {
+        "id": str(uuid.UUID(int=number)),
+        "content": f"remote post {number}",
+        "timestamp": timestamp,
+        "timestamp_user": "Jan. 01, 2024, 12:00 AM",
+        "user_id": 1,
+        "username": username,
+        "likes": 0,
+        "like_count": 0,
+        "comment_count": 0,
+        "comments": [],
+        "liked": False,
+    }
+
+
+class FakeResponse:
+    # The parts of a requests.Response read by federation.
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.content = json.dumps(data or {}).encode()
+        self.headers = {"Content-Type": codecs.JSON}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+
+@override_settings(ALLOWED_HOSTS=["127.0.0.1"])
+class FederationTestCase(TestCase):
+    # A local user with a post, and a foreign server calling from 127.0.0.1.
+
+    def setUp(self):
+        self.local = servers.get_local()
+        self.peer = ForeignServer.objects.create(ip="127.0.0.1", port=9000)
+        self.user = User.objects.create(username="alice")
+        self.post = Post.objects.create(user=self.user, content="Hello #world")
+        self.client = Client(REMOTE_ADDR="127.0.0.1", HTTP_HOST="127.0.0.1")
+
+    def federation_get(self, path, data, **extra):
+        return self.client.generic(
+            "GET",
+            path,
+            json.dumps(dict(data, port=self.peer.port)),
+            content_type="application/json",
+            **extra,
+        )
+
+
+@mock.patch("builtins.print")
+class FanOutTests(SimpleTestCase):
+    def setUp(self):
+        self.fast = ForeignServer(ip="10.0.0.1")
+        self.slow = ForeignServer(ip="10.0.0.2")
+        self.broken = ForeignServer(ip="10.0.0.3")
+
+    def fetch(self, server, timeout):
+        if server is self.slow:
+            time.sleep(1)
+        if server is self.broken:
+            raise ConnectionError("refused")
+        return server.ip
+
+    def test_servers_missing_the_deadline_are_left_out(self, _):
+        started = time.monotonic()
+        results = federation.fan_out(
+            [self.fast, self.slow, self.broken], self.fetch, deadline=0.2
+        )
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(results, {self.fast: "10.0.0.1"})
+
+    @override_settings(FEDERATION_TIMEOUT=5)
+    def test_requests_time_out_with_the_deadline(self, _):
+        results = federation.fan_out(
+            [self.fast], lambda server, timeout: timeout, deadline=0.5
+        )
+        self.assertEqual(results, {self.fast: 0.5})
+
+
+class LivePageTests(TestCase):
+    @override_settings(FEDERATION_TIMELINE_SOURCE="live", FEDERATION_PAGE_DEADLINE=0.2)
+    def test_page_is_rendered_without_slow_servers(self):
+        fast = ForeignServer.objects.create(ip="10.0.0.1")
+        ForeignServer.objects.create(ip="10.0.0.2")
+
+        async def get_posts(server, port, limit, timeout, match):
+            if server != fast:
+                await asyncio.sleep(1)
+            return {"posts": [remote_post(1, username=server.ip)], "next_cursor": None}
+
+        started = time.monotonic()
+        with mock.patch.object(post_cache, "aget_posts", get_posts), mock.patch(
+            "builtins.print"
+        ):
+            response = Client().get("/all")
+        self.assertLess(time.monotonic() - started, 0.9)
+        self.assertEqual(
+            [i["username"] for i in response.context["posts"]], ["10.0.0.1"]
+        )
+
+
+class PostCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ForeignServer(ip="10.0.0.1")
+        post_cache.get_cache().clear()
+        self.addCleanup(post_cache.get_cache().clear)
+
+    def page(self, *numbers, next_cursor=None):
+        return {"posts": [remote_post(i) for i in numbers], "next_cursor": next_cursor}
+
+    def test_posts_are_fetched_once_for_every_viewer(self):
+        with mock.patch.object(
+            federation, "fetch_posts", return_value=self.page(1)
+        ) as fetch:
+            first = post_cache.get_posts(self.server, "8000", 10)
+            second = post_cache.get_posts(self.server, "8000", 10)
+        fetch.assert_called_once_with(self.server, "", "8000", 10, None)
+        self.assertEqual(first["posts"], second["posts"])
+
+    def test_stale_posts_are_served_while_they_are_refreshed(self):
+        with mock.patch.object(federation, "fetch_posts", return_value=self.page(1)):
+            post_cache.refresh(self.server, "8000", 10)
+        entry = post_cache.get_cache().get(post_cache.cache_key(self.server))
+        entry["fetched"] -= settings.FEDERATION_CACHE_TTL
+        post_cache.get_cache().set(post_cache.cache_key(self.server), entry)
+
+        with mock.patch.object(federation, "submit") as submit:
+            stale = post_cache.get_posts(self.server, "8000", 10)
+            # A refresh already running is not started twice.
+            post_cache.get_posts(self.server, "8000", 10)
+        self.assertEqual([i["id"] for i in stale["posts"]], [remote_post(1)["id"]])
+        submit.assert_called_once()
+
+        with mock.patch.object(federation, "fetch_posts", return_value=self.page(2)):
+            submit.call_args[0][0]()
+        fresh = post_cache.get_posts(self.server, "8000", 10)
+        self.assertEqual([i["id"] for i in fresh["posts"]], [remote_post(2)["id"]])
+
+    def test_expired_posts_are_fetched_again(self):
+        with mock.patch.object(federation, "fetch_posts", return_value=self.page(1)):
+            post_cache.refresh(self.server, "8000", 10)
+        expired = (
+            time.time()
+            + settings.FEDERATION_CACHE_TTL
+            + settings.FEDERATION_CACHE_STALE
+        )
+        with mock.patch("time.time", return_value=expired + 1), mock.patch.object(
+            federation, "fetch_posts", return_value=self.page(2)
+        ) as fetch:
+            entry = post_cache.get_posts(self.server, "8000", 10)
+        fetch.assert_called_once()
+        self.assertEqual([i["id"] for i in entry["posts"]], [remote_post(2)["id"]])
+
+    def test_filtered_pages_fetch_older_posts(self):
+        with mock.patch.object(
+            federation, "fetch_posts", return_value=self.page(1, next_cursor="a")
+        ), mock.patch.object(
+            federation, "fetch_page", return_value=self.page(2, 3, next_cursor="b")
+        ) as fetch_page:
+            entry = post_cache.get_posts(
+                self.server,
+                "8000",
+                2,
+                match=lambda post: post["id"] != str(uuid.UUID(int=1)),
+            )
+        fetch_page.assert_called_once_with(self.server, "", "8000", 2, "a", None)
+        self.assertEqual(len(entry["posts"]), 3)
+        # The older posts are kept for the next page view.
+        cached = post_cache.get_cache().get(post_cache.cache_key(self.server))
+        self.assertEqual(cached["next_cursor"], "b")
+
+
+class CursorTests(FederationTestCase):
+    def test_round_trip(self):
+        timestamp = timezone.now()
+        cursor = pagination.encode_cursor(timestamp, self.post.pk)
+        self.assertEqual(pagination.decode_cursor(cursor), (timestamp, self.post.pk))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            pagination.decode_cursor("not a cursor")
+        response = self.federation_get("/federation/posts", {"cursor": "x"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_limit(self):
+        response = self.federation_get("/federation/posts", {"limit": 0})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(FEDERATION_POSTS_MAX_LIMIT=2)
+    def test_limit_is_capped(self):
+        for i in range(3):
+            Post.objects.create(user=self.user, content=f"post {i}")
+        data = self.federation_get("/federation/posts", {"limit": 10}).json()
+        self.assertEqual(len(data["posts"]), 2)
+        self.assertIsNotNone(data["next_cursor"])
+
+    def test_posts_with_the_same_timestamp_are_paged_by_id(self):
+        for i in range(4):
+            Post.objects.create(user=self.user, content=f"post {i}")
+        Post.objects.update(timestamp=self.post.timestamp)
+        expected = list(
+            Post.objects.order_by("-timestamp", "-id").values_list("pk", flat=True)
+        )
+        seen = []
+        cursor = None
+        while True:
+            data = self.federation_get(
+                "/federation/posts", {"limit": 2, "cursor": cursor}
+            ).json()
+            seen += [uuid.UUID(i["id"]) for i in data["posts"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_pages_are_followed_until_enough_posts_are_fetched(self):
+        pages = [
+            {"posts": [remote_post(1), remote_post(2)], "next_cursor": "a"},
+            {"posts": [remote_post(3)], "next_cursor": "b"},
+        ]
+        with mock.patch.object(federation, "fetch_page", side_effect=pages) as fetch:
+            result = federation.fetch_posts(self.peer, "", "8000", 3)
+        self.assertEqual(len(result["posts"]), 3)
+        self.assertEqual(result["next_cursor"], "b")
+        self.assertEqual(fetch.call_args[0][3:5], (1, "a"))
+
+
+@override_settings(FEDERATION_SYNC_PAGE_SIZE=2)
+class SyncTests(TestCase):
+    def setUp(self):
+        self.server = ForeignServer.objects.create(ip="10.0.0.1")
+        self.fetched = []
+
+    def posts(self, *numbers):
+        # Posts numbered by age, 1 is the oldest.
+        return [
+            remote_post(i, timestamp=f"2024-01-01T00:00:{i:02d}.000000Z")
+            for i in sorted(numbers, reverse=True)
+        ]
+
+    def sync(self, *numbers):
+        # Runs a sync against a server holding the given posts, in pages of two.
+        posts = self.posts(*numbers)
+
+        def fetch_page(server, username, port, limit, cursor=None, timeout=None):
+            self.fetched.append(cursor)
+            start = int(cursor or 0)
+            end = start + limit
+            return {
+                "posts": posts[start:end],
+                "next_cursor": str(end) if end < len(posts) else None,
+            }
+
+        with mock.patch.object(federation, "fetch_page", fetch_page):
+            return sync.sync_servers([self.server])[self.server]
+
+    def test_posts_are_saved_once(self):
+        sync.save_posts(self.server, self.posts(1))
+        updated = self.posts(1)
+        updated[0]["likes"] = 3
+        sync.save_posts(self.server, updated)
+        self.assertEqual(
+            list(RemotePost.objects.values_list("remote_id", "like_count")),
+            [(updated[0]["id"], 3)],
+        )
+
+    def test_sync_stops_at_the_newest_synced_post(self):
+        self.assertEqual(self.sync(1, 2, 3, 4, 5), 5)
+        self.fetched.clear()
+        self.sync(1, 2, 3, 4, 5, 6)
+        self.assertEqual(self.fetched, [None])
+
+    def test_pushed_posts_do_not_hide_older_posts(self):
+        self.sync(1, 2)
+        # Post 5 is pushed to the inbox before posts 3 and 4 were ever synced.
+        sync.save_posts(self.server, self.posts(5))
+        self.fetched.clear()
+        self.sync(1, 2, 3, 4, 5)
+        self.assertEqual(self.fetched, [None, "2"])
+        self.assertEqual(RemotePost.objects.count(), 5)
+
+    @override_settings(FEDERATION_SYNC_MAX_PAGES=1)
+    def test_unfinished_sync_continues_from_its_cursor(self):
+        self.sync(1, 2, 3, 4)
+        state = SyncState.objects.get()
+        self.assertEqual((state.newest, state.cursor), (None, "2"))
+        self.fetched.clear()
+        self.sync(1, 2, 3, 4)
+        self.assertEqual(self.fetched, ["2"])
+        state.refresh_from_db()
+        self.assertIsNone(state.cursor)
+        self.assertEqual(state.newest.second, 4)
+        self.assertEqual(RemotePost.objects.count(), 4)
+
+
+class TimelineQueryTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.user.following_user.create(server=self.peer, followee_user="bob")
+        # The server registry is loaded once per process, not per page.
+        servers.all_servers()
+
+    def queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return len(queries)
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(user=self.user, content=f"post {i}")
+            counters.add_comment(post, "bob", self.peer, "comment")
+            counters.add_like(post, "alice", self.local)
+        sync.save_posts(
+            self.peer,
+            [remote_post(RemotePost.objects.count() + i + 1) for i in range(count)],
+        )
+
+    def test_pages_have_a_fixed_number_of_queries(self):
+        self.add_posts(1)
+        expected = {
+            i: self.queries(i) for i in ("/all", "/following", "/user/local/alice")
+        }
+        self.add_posts(9)
+        self.assertEqual({i: self.queries(i) for i in expected}, expected)
+
+
+class CounterTests(FederationTestCase):
+    def test_likes_are_counted_once(self):
+        self.assertEqual(counters.add_like(self.post, "bob", self.peer), (True, 1))
+        self.assertEqual(counters.add_like(self.post, "bob", self.peer), (False, 1))
+        self.assertEqual(counters.remove_like(self.post, "bob", self.peer), (True, 0))
+        self.assertEqual(counters.remove_like(self.post, "bob", self.peer), (False, 0))
+
+    def test_comments_are_counted(self):
+        counters.add_comment(self.post, "bob", self.peer, "first")
+        counters.add_comment(self.post, "bob", self.peer, "second")
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 2)
+
+    def test_counts_of_a_page_are_read_at_once(self):
+        counters.add_like(self.post, "bob", self.peer)
+        with self.assertNumQueries(1):
+            counts = counters.post_counts(
+                [str(self.post.pk), "not an id", str(uuid.uuid4())], "bob", self.peer
+            )
+        self.assertEqual(
+            counts,
+            {str(self.post.pk): {"likeCount": 1, "commentCount": 0, "liked": True}},
+        )
+
+    def test_drifted_counters_are_repaired(self):
+        counters.add_like(self.post, "bob", self.peer)
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comment_count=3)
+        self.assertEqual(list(counters.drifted_posts()), [self.post])
+        self.assertEqual(counters.repair_counters(counters.drifted_posts()), 1)
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 0))
+        self.assertFalse(counters.drifted_posts().exists())
+
+
+class ViewerContextTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.carol = User.objects.create(username="carol")
+        self.user.following_user.create(server=self.local, followee_user="carol")
+        ForeignUserBlocklist.objects.create(
+            user=self.user, server=self.peer, blocked_user="mallory"
+        )
+
+    def test_follows_and_blocks_are_loaded_at_once(self):
+        with self.assertNumQueries(4):
+            viewer = ViewerContext(self.user)
+        with self.assertNumQueries(0):
+            self.assertTrue(viewer.is_following(self.local.id, "carol"))
+            self.assertFalse(viewer.is_following(self.peer.id, "carol"))
+            self.assertTrue(viewer.is_blocked(self.peer.id, "mallory"))
+            self.assertEqual(viewer.followed_usernames(self.local.id), ["carol"])
+            self.assertEqual(viewer.blocked_usernames(self.peer.id), ["mallory"])
+
+    def test_anonymous_viewers_need_no_queries(self):
+        with self.assertNumQueries(0):
+            viewer = ViewerContext(AnonymousUser())
+        self.assertFalse(viewer.is_following(self.local.id, "carol"))
+
+    def test_posts_of_blocked_users_and_servers_are_hidden(self):
+        Post.objects.create(user=self.carol, content="Hi")
+        sync.save_posts(self.peer, [remote_post(1, "mallory"), remote_post(2, "bob")])
+        other = ForeignServer.objects.create(ip="10.0.0.1")
+        sync.save_posts(other, [remote_post(3, "dave")])
+        ForeignBlocklist.objects.create(user=self.user, server=other)
+        response = self.client.get("/all")
+        self.assertEqual(
+            {i["username"]: i["following"] for i in response.context["posts"]},
+            {"alice": False, "bob": False, "carol": True},
+        )
+
+
+class SearchTests(FederationTestCase):
+    def test_words_match_in_any_case(self):
+        self.assertEqual(fulltext.search("HELLO", 10), [("local", str(self.post.pk))])
+        self.assertEqual(fulltext.search("goodbye", 10), [])
+
+    def test_html_is_not_indexed(self):
+        Post.objects.create(user=self.user, content="<b>bold</b> move")
+        self.assertEqual(len(fulltext.search("bold", 10)), 1)
+        self.assertEqual(fulltext.search("b", 10), [])
+
+    def test_operators_in_queries_are_quoted(self):
+        self.assertEqual(fulltext.match_expression('hello OR "x'), '"hello" "OR" """x"')
+        self.assertEqual(fulltext.search("hello OR goodbye", 10), [])
+        self.assertEqual(fulltext.search("NEAR(", 10), [])
+        self.assertEqual(fulltext.search("<p></p>", 10), [])
+
+    def test_remote_posts_are_indexed(self):
+        sync.save_posts(self.peer, [remote_post(1)])
+        remote = RemotePost.objects.get()
+        self.assertEqual(fulltext.search("post", 10), [("remote", str(remote.pk))])
+
+    def test_edited_posts_are_indexed_again(self):
+        self.post.content = "Goodbye"
+        self.post.save()
+        self.assertEqual(fulltext.search("hello", 10), [])
+        self.assertEqual(len(fulltext.search("goodbye", 10)), 1)
+
+    def test_deleted_posts_are_removed(self):
+        self.post.delete()
+        self.assertEqual(fulltext.search("hello", 10), [])
+
+    def test_pages_are_filled_past_blocked_posts(self):
+        self.client.force_login(self.user)
+        sync.save_posts(
+            self.peer,
+            [remote_post(i, "mallory") for i in range(1, 13)]
+            + [remote_post(i, "bob") for i in range(13, 25)],
+        )
+        ForeignUserBlocklist.objects.create(
+            user=self.user, server=self.peer, blocked_user="mallory"
+        )
+        response = self.client.get("/search", {"q": "post"})
+        self.assertEqual(len(response.context["posts"]), 10)
+        self.assertEqual({i["username"] for i in response.context["posts"]}, {"bob"})
+        self.assertNotEqual(response.context["next_page"], "0")
+        response = self.client.get("/search/2/", {"q": "post"})
+        self.assertEqual(len(response.context["posts"]), 2)
+        self.assertEqual(response.context["next_page"], "0")
+
+    def test_tag_pages_are_filled_past_blocked_posts(self):
+        self.client.force_login(self.user)
+        posts = [remote_post(i, "mallory") for i in range(1, 13)]
+        for i in posts:
+            i["content"] += " #news"
+        sync.save_posts(self.peer, posts)
+        ForeignUserBlocklist.objects.create(
+            user=self.user, server=self.peer, blocked_user="mallory"
+        )
+        response = self.client.get("/tag/news")
+        self.assertEqual(response.context["posts"], [])
+        self.assertEqual(response.context["next_page"], "0")
+
+
+class HashtagTests(FederationTestCase):
+    def test_hashtags_are_extracted(self):
+        self.assertEqual(
+            hashtags.extract_hashtags("#One two#three <b>#Four_4</b> #one"),
+            {"one", "four_4"},
+        )
+        self.assertEqual(hashtags.extract_hashtags("no tags # here"), set())
+
+    def test_posts_are_tagged_when_saved(self):
+        self.assertEqual(hashtags.tagged_posts("WORLD", 10), [(self.post.id, None)])
+        self.post.content = "Hello #moon"
+        self.post.save()
+        self.assertEqual(hashtags.tagged_posts("world", 10), [])
+        self.assertEqual(hashtags.tagged_posts("moon", 10), [(self.post.id, None)])
+        self.assertEqual(Hashtag.objects.filter(name="world").count(), 1)
+
+    def test_remote_posts_are_tagged(self):
+        post = remote_post(1, timestamp="2099-01-01T00:00:00.000000Z")
+        post["content"] += " #world"
+        sync.save_posts(self.peer, [post])
+        remote = RemotePost.objects.get()
+        self.assertEqual(
+            hashtags.tagged_posts("world", 10),
+            [(None, remote.id), (self.post.id, None)],
+        )
+        self.assertEqual(
+            hashtags.tagged_posts("world", 10, offset=1), [(self.post.id, None)]
+        )
+
+    def test_submitted_hashtags_link_to_their_page(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse("submit_post"), {"content": "Hi #Django"})
+        post = Post.objects.latest("timestamp")
+        self.assertIn(
+            f'<a href="{reverse("tag", args=("django",))}">#Django</a>', post.content
+        )
+        response = self.client.get(reverse("tag", args=("django",)))
+        self.assertEqual([i["id"] for i in response.context["posts"]], [post.id])
+
+    def test_tag_page_is_paged(self):
+        for i in range(12):
+            Post.objects.create(user=self.user, content=f"Post {i} #world")
+        response = self.client.get("/tag/world")
+        self.assertEqual(len(response.context["posts"]), 10)
+        self.assertNotEqual(response.context["next_page"], "0")
+        response = self.client.get("/tag/world/2")
+        self.assertEqual(len(response.context["posts"]), 3)
+        self.assertEqual(response.context["next_page"], "0")
+
+
+class HomeTimelineTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.carol = User.objects.create(username="carol")
+        self.viewer = ViewerContext(self.carol)
+
+    def test_local_posts_are_added_to_the_timelines_of_followers(self):
+        Follower.objects.create(
+            following_user=self.carol, server=self.local, followee_user="alice"
+        )
+        post = Post.objects.create(user=self.user, content="New")
+        self.assertEqual(
+            home_timeline.entries(self.viewer, 10),
+            [(post.id, None), (self.post.id, None)],
+        )
+
+    def test_mirrored_posts_are_added_to_the_timelines_of_followers(self):
+        Follower.objects.create(
+            following_user=self.carol, server=self.peer, followee_user="bob"
+        )
+        sync.save_posts(self.peer, [remote_post(1, "bob"), remote_post(2, "dave")])
+        self.assertEqual(
+            home_timeline.entries(self.viewer, 10),
+            [(None, RemotePost.objects.get(username="bob").id)],
+        )
+
+    def test_following_backfills_and_unfollowing_prunes(self):
+        sync.save_posts(self.peer, [remote_post(1, "bob")])
+        follow = Follower.objects.create(
+            following_user=self.carol, server=self.local, followee_user="alice"
+        )
+        Follower.objects.create(
+            following_user=self.carol, server=self.peer, followee_user="bob"
+        )
+        self.assertEqual(len(home_timeline.entries(self.viewer, 10)), 2)
+        follow.delete()
+        self.assertEqual(
+            home_timeline.entries(self.viewer, 10),
+            [(None, RemotePost.objects.get().id)],
+        )
+
+    def test_following_page_reads_the_timeline(self):
+        Follower.objects.create(
+            following_user=self.carol, server=self.local, followee_user="alice"
+        )
+        Follower.objects.create(
+            following_user=self.carol, server=self.peer, followee_user="bob"
+        )
+        sync.save_posts(self.peer, [remote_post(1, "bob")])
+        self.client.force_login(self.carol)
+        response = self.client.get("/following")
+        self.assertEqual(
+            [i["username"] for i in response.context["posts"]], ["alice", "bob"]
+        )
+        ForeignBlocklist.objects.create(user=self.carol, server=self.peer)
+        response = self.client.get("/following")
+        self.assertEqual([i["username"] for i in response.context["posts"]], ["alice"])
+
+
+@override_settings(FEDERATION_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(FederationTestCase):
+    def test_posts_are_queued_for_peers(self):
+        self.assertEqual(
+            list(OutboxDelivery.objects.values_list("post", "server")),
+            [(self.post.pk, self.peer.pk)],
+        )
+
+    def test_delivered_posts_are_removed(self):
+        with mock.patch.object(federation, "deliver_posts") as deliver:
+            self.assertEqual(outbox.deliver_due(), {self.peer: 1})
+        self.assertEqual(deliver.call_args[0][1][0]["id"], self.post.pk)
+        self.assertFalse(OutboxDelivery.objects.exists())
+
+    def test_failed_deliveries_are_retried_then_given_up(self):
+        error = requests.ConnectionError("refused")
+        with mock.patch.object(federation, "deliver_posts", side_effect=error):
+            self.assertEqual(outbox.deliver_due(), {self.peer: 0})
+            delivery = OutboxDelivery.objects.get()
+            self.assertEqual(delivery.attempts, 1)
+            self.assertEqual(delivery.last_error, "refused")
+            self.assertGreater(delivery.next_attempt, timezone.now())
+            self.assertIsNone(delivery.failed)
+
+            OutboxDelivery.objects.update(next_attempt=timezone.now())
+            outbox.deliver_due()
+            self.assertIsNotNone(OutboxDelivery.objects.get().failed)
+            self.assertEqual(outbox.lag()[self.peer]["failed"], 1)
+
+            # Failed deliveries are no longer sent.
+            OutboxDelivery.objects.update(next_attempt=timezone.now())
+            self.assertEqual(outbox.deliver_due(), {})
+
+        self.assertEqual(outbox.retry_failed(), 1)
+        self.assertEqual(OutboxDelivery.objects.get().attempts, 0)
+
+
+class SessionTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ForeignServer(ip="127.0.0.1", port=9000)
+        self.addCleanup(federation.close_session, self.server)
+
+    def test_sessions_are_reused(self):
+        session = federation.get_session(self.server)
+        self.assertIs(federation.get_session(self.server), session)
+        self.assertIsNot(
+            federation.get_session(ForeignServer(ip="127.0.0.1", port=9000)), session
+        )
+
+    def test_sessions_are_replaced_when_the_address_changes(self):
+        session = federation.get_session(self.server)
+        self.server.port = 9001
+        with mock.patch.object(session, "close") as close:
+            self.assertIsNot(federation.get_session(self.server), session)
+        close.assert_called_once()
+
+    def test_no_cookies_are_kept(self):
+        session = federation.get_session(self.server)
+        request = MockRequest(
+            requests.Request("GET", "http://127.0.0.1:9000/federation/posts").prepare()
+        )
+        cookie = create_cookie("sessionid", "1", domain="127.0.0.1")
+        self.assertFalse(session.cookies.get_policy().set_ok(cookie, request))
+
+    def test_closed_sessions_are_created_again(self):
+        session = federation.get_session(self.server)
+        with mock.patch.object(session, "close") as close:
+            federation.close_session(self.server)
+        close.assert_called_once()
+        self.assertIsNot(federation.get_session(self.server), session)
+        federation.close_session(ForeignServer(ip="127.0.0.1"))
+
+
+@override_settings(FEDERATION_BREAKER_THRESHOLD=2)
+class HealthTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, value in [
+            ("_peers", {}),
+            ("_dirty", set()),
+            ("_loaded", {}),
+            ("_persisted", time.monotonic()),
+        ]:
+            patcher = mock.patch.object(health, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_breaker_opens_after_failures_in_a_row(self):
+        health.record(self.peer, error="refused")
+        self.assertEqual(health.before_request(self.peer, 5), 5)
+        health.record(self.peer, error="refused")
+        with self.assertRaises(health.PeerUnavailable):
+            health.before_request(self.peer, 5)
+        self.assertEqual(health.summary(health.current(self.peer))["status"], "Skipped")
+
+    def test_health_saved_by_other_processes_is_loaded(self):
+        PeerHealth.objects.create(
+            server=self.peer,
+            consecutive_failures=2,
+            open_until=timezone.now() + datetime.timedelta(seconds=30),
+        )
+        with mock.patch.object(federation, "get_session") as get_session:
+            with self.assertRaises(health.PeerUnavailable):
+                federation.request(self.peer, "GET", "federation/posts")
+        get_session.assert_not_called()
+        self.assertFalse(health.stale(self.peer))
+
+    def test_unsaved_health_is_kept_when_loading(self):
+        health.record(self.peer, latency=0.01)
+        PeerHealth.objects.create(
+            server=self.peer,
+            open_until=timezone.now() + datetime.timedelta(seconds=30),
+        )
+        health.load(self.peer)
+        self.assertEqual(health.before_request(self.peer, 5), 5)
+        self.assertEqual(health.persist(), 1)
+        health.load(self.peer)
+        self.assertEqual(health.before_request(self.peer, 5), 5)
+
+    def test_health_is_persisted(self):
+        health.record(self.peer, latency=0.01)
+        health.record(self.peer, error="refused")
+        self.assertEqual(health.persist(), 1)
+        self.assertEqual(health.persist(), 0)
+        peer = PeerHealth.objects.get(server=self.peer)
+        self.assertEqual((peer.successes, peer.failures), (1, 1))
+        self.assertEqual(peer.last_error, "refused")
+
+
+@mock.patch("builtins.print")
+class AsyncFederationTests(SimpleTestCase):
+    def setUp(self):
+        self.fast = ForeignServer(ip="10.0.0.1")
+        self.slow = ForeignServer(ip="10.0.0.2")
+        self.cancelled = []
+
+    async def fetch(self, server, timeout):
+        if server is self.slow:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                self.cancelled.append(server)
+                raise
+        return server.ip
+
+    def test_servers_missing_the_deadline_are_cancelled(self, _):
+        async def fan_out():
+            results = await federation.afan_out(
+                [self.fast, self.slow], self.fetch, deadline=0.2
+            )
+            # Lets the cancelled task handle its cancellation.
+            await asyncio.sleep(0)
+            return results
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(fan_out()), {self.fast: "10.0.0.1"})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.cancelled, [self.slow])
+
+    def test_clients_are_closed_with_their_event_loop(self, _):
+        async def get_client():
+            self.loop = asyncio.get_running_loop()
+            client = federation.get_async_client(self.fast)
+            self.assertIs(federation.get_async_client(self.fast), client)
+            return client
+
+        client = asyncio.run(get_client())
+        self.assertTrue(client.is_closed)
+        self.assertNotIn(self.loop, federation._async_clients)
+        other = asyncio.run(get_client())
+        self.assertIsNot(other, client)
+        self.assertTrue(other.is_closed)
+
+
+class CodecTests(FederationTestCase):
+    def test_msgpack_is_sent_to_servers_accepting_it(self):
+        response = self.federation_get(
+            "/federation/posts", {}, HTTP_ACCEPT=codecs.accept_header()
+        )
+        self.assertEqual(response["Content-Type"], codecs.MSGPACK)
+        self.assertIn("Accept", response["Vary"])
+        data = msgpack.unpackb(response.content)
+        self.assertEqual(data["posts"][0]["content"], "Hello #world")
+
+    def test_json_is_the_default(self):
+        response = self.federation_get("/federation/posts", {})
+        self.assertEqual(response["Content-Type"], codecs.JSON)
+        self.assertEqual(response.json()["posts"][0]["content"], "Hello #world")
+
+    def test_values_are_encoded_like_json_response(self):
+        data = {"timestamp": timezone.now(), "id": uuid.uuid4()}
+        expected = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+        for accept in ["", codecs.accept_header()]:
+            body, content_type = codecs.encode(data, accept)
+            response = requests.Response()
+            response.headers["Content-Type"] = content_type
+            response._content = body
+            self.assertEqual(codecs.decode(response), expected)
+
+    def test_large_responses_are_compressed(self):
+        for i in range(10):
+            Post.objects.create(user=self.user, content=f"post {i}")
+        response = self.federation_get(
+            "/federation/posts", {}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            json.loads(gzip.decompress(response.content))["posts"][0]["content"],
+            "post 9",
+        )
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.federation_get(
+            "/federation/user/nobody", {}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class ETagTests(FederationTestCase):
+    def test_unchanged_posts_are_not_modified(self):
+        etag = self.federation_get("/federation/posts", {})["ETag"]
+        response = self.federation_get("/federation/posts", {}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.federation_get(
+            "/federation/posts", {}, HTTP_IF_NONE_MATCH='"stale"'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_with_likes_and_deletions(self):
+        first = self.federation_get("/federation/posts", {})["ETag"]
+        counters.add_like(self.post, "bob", self.peer)
+        second = self.federation_get("/federation/posts", {})["ETag"]
+        Post.objects.create(user=self.user, content="newer").delete()
+        third = self.federation_get("/federation/posts", {})["ETag"]
+        self.assertEqual(len({first, second, third}), 3)
+
+    def test_likes_change_the_post(self):
+        updated = self.post.updated
+        counters.add_like(self.post, "bob", self.peer)
+        self.post.refresh_from_db()
+        self.assertGreater(self.post.updated, updated)
+
+    def test_user_etag_changes_with_follows(self):
+        other = User.objects.create(username="carol")
+        first = self.federation_get("/federation/user/alice", {})["ETag"]
+        other.following_user.create(server=self.local, followee_user="alice")
+        second = self.federation_get("/federation/user/alice", {})["ETag"]
+        self.assertNotEqual(first, second)
+
+    def test_etag_needs_no_count(self):
+        etag = self.federation_get("/federation/posts", {})["ETag"]
+        with self.assertNumQueries(2):
+            self.federation_get("/federation/posts", {}, HTTP_IF_NONE_MATCH=etag)
+
+
+class StreamTests(FederationTestCase):
+    def stream(self, data=None, **extra):
+        response = self.federation_get(
+            "/federation/posts", dict(data or {}, stream=True), **extra
+        )
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def add_posts(self, count):
+        for i in range(count):
+            Post.objects.create(user=self.user, content=f"post {i}")
+
+    @override_settings(FEDERATION_POSTS_DEFAULT_LIMIT=2)
+    def test_every_post_is_streamed(self):
+        self.add_posts(3)
+        data = json.loads(self.stream())
+        self.assertEqual(len(data["posts"]), 4)
+        self.assertIsNone(data["next_cursor"])
+
+    def test_limited_streams_continue_from_their_cursor(self):
+        self.add_posts(3)
+        first = json.loads(self.stream({"limit": 3}))
+        rest = json.loads(self.stream({"cursor": first["next_cursor"]}))
+        self.assertEqual(
+            [i["content"] for i in first["posts"] + rest["posts"]],
+            ["post 2", "post 1", "post 0", "Hello #world"],
+        )
+        self.assertIsNone(rest["next_cursor"])
+
+    def test_streams_are_compressed(self):
+        self.add_posts(10)
+        response = self.federation_get(
+            "/federation/posts", {"stream": True}, HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        data = json.loads(gzip.decompress(b"".join(response.streaming_content)))
+        self.assertEqual(len(data["posts"]), 11)
+
+    @override_settings(FEDERATION_STREAM_CHUNK_SIZE=100)
+    def test_streams_take_a_fixed_number_of_queries(self):
+        ForeignComment.objects.create(
+            post=self.post, user="bob", server=self.peer, content="Hi"
+        )
+        servers.all_servers()
+        with CaptureQueriesContext(connection) as one:
+            self.stream()
+        self.add_posts(9)
+        with CaptureQueriesContext(connection) as ten:
+            self.stream()
+        self.assertEqual(len(one), len(ten))
+
+    def test_pages_take_a_fixed_number_of_queries(self):
+        self.add_posts(9)
+        servers.all_servers()
+        with self.assertNumQueries(4):
+            response = self.federation_get("/federation/posts", {})
+        self.assertEqual(len(response.json()["posts"]), 10)
+
+
+class FederatedUserTests(FederationTestCase):
+    def get_user(self, **data):
+        return self.federation_get("/federation/user/alice", data).json()
+
+    def test_liked_flags_are_sent_for_the_calling_user(self):
+        counters.add_like(self.post, "bob", self.peer)
+        self.assertTrue(self.get_user(user="bob")["posts"][0]["liked"])
+        self.assertFalse(self.get_user(user="carol")["posts"][0]["liked"])
+        self.assertFalse(self.get_user()["posts"][0]["liked"])
+
+    def test_posts_take_a_fixed_number_of_queries(self):
+        servers.all_servers()
+        with CaptureQueriesContext(connection) as one:
+            self.get_user(user="bob")
+        for i in range(9):
+            post = Post.objects.create(user=self.user, content=f"post {i}")
+            ForeignComment.objects.create(
+                post=post, user="bob", server=self.peer, content="Hi"
+            )
+        with CaptureQueriesContext(connection) as ten:
+            data = self.get_user(user="bob")
+        self.assertEqual(len(data["posts"]), 10)
+        self.assertEqual(len(one), len(ten))
+
+
+class MergeTests(SimpleTestCase):
+    def posts(self, *days):
+        # Posts of the given days of January 2024, in the order given.
+        return [
+            {"id": day, "timestamp": datetime.datetime(2024, 1, day)} for day in days
+        ]
+
+    def test_sources_are_merged_newest_first(self):
+        posts, has_more = timeline.merge_posts(
+            [self.posts(9, 5, 1), self.posts(8, 2), []], 4
+        )
+        self.assertEqual([i["id"] for i in posts], [9, 8, 5, 2])
+        self.assertTrue(has_more)
+        posts, has_more = timeline.merge_posts([self.posts(9, 5), self.posts(8)], 4)
+        self.assertEqual([i["id"] for i in posts], [9, 8, 5])
+        self.assertFalse(has_more)
+
+    def test_sources_are_read_up_to_the_limit(self):
+        def source():
+            for day in range(31, 0, -1):
+                read.append(day)
+                yield self.posts(day)[0]
+
+        read = []
+        posts, has_more = timeline.merge_posts([source()], 3)
+        self.assertEqual(len(posts), 3)
+        self.assertTrue(has_more)
+        self.assertLessEqual(len(read), 5)
+
+
+class BatchTests(FederationTestCase):
+    def operation(self, action, **extra):
+        return dict(action=action, post_id=str(self.post.pk), username="bob", **extra)
+
+    def test_like_and_unlike_in_one_batch_write_nothing(self):
+        results, counts = counters.apply_batch(
+            self.peer, [self.operation("like"), self.operation("unlike")]
+        )
+        self.assertEqual(results, [{"success": True}, {"success": True}])
+        self.assertEqual(counts[str(self.post.pk)]["likeCount"], 0)
+        self.assertFalse(ForeignLike.objects.exists())
+
+    def test_invalid_operations_fail_alone(self):
+        results, _ = counters.apply_batch(
+            self.peer,
+            [
+                {"action": "like", "post_id": str(uuid.uuid4()), "username": "bob"},
+                self.operation("share"),
+                self.operation("like"),
+            ],
+        )
+        self.assertEqual([i["success"] for i in results], [False, False, True])
+        self.assertEqual(ForeignLike.objects.count(), 1)
+
+    def test_comments_sent_again_are_added_once(self):
+        operation = self.operation("comment", content="hi", id=str(uuid.uuid4()))
+        first, _ = counters.apply_batch(self.peer, [operation, operation])
+        again, counts = counters.apply_batch(self.peer, [operation])
+        self.assertEqual(ForeignComment.objects.count(), 1)
+        self.assertEqual(counts[str(self.post.pk)]["commentCount"], 1)
+        self.assertEqual(first[0], again[0])
+        self.assertEqual(first[1], again[0])
+
+    def test_endpoint_limits_operations(self):
+        with override_settings(FEDERATION_BATCH_MAX_OPERATIONS=1):
+            response = self.client.post(
+                "/federation/batch",
+                json.dumps(
+                    {
+                        "port": self.peer.port,
+                        "operations": [self.operation("like")] * 2,
+                    }
+                ),
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 400)
+
+
+@mock.patch("builtins.print")
+class RefreshCountsTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = Client(
+            REMOTE_ADDR="127.0.0.1", HTTP_HOST="127.0.0.1", enforce_csrf_checks=True
+        )
+        self.client.force_login(self.user)
+        # Loads a page to get a CSRF token.
+        self.client.get("/all")
+        self.token = self.client.cookies["csrftoken"].value
+
+    def refresh(self, body, **extra):
+        return self.client.post(
+            "/refresh_counts", body, content_type="application/json", **extra
+        )
+
+    def test_counts_are_sent_to_signed_in_users(self, _):
+        counters.add_like(self.post, "alice", self.local)
+        with mock.patch.object(
+            federation, "fetch_counts", return_value={"1": {"likeCount": 2}}
+        ) as fetch_counts:
+            response = self.refresh(
+                {
+                    "posts": {
+                        str(self.local.id): [self.post.id],
+                        str(self.peer.id): ["1"],
+                    }
+                },
+                HTTP_X_CSRFTOKEN=self.token,
+            )
+        self.assertEqual(
+            response.json()["posts"],
+            {
+                str(self.local.id): {
+                    str(self.post.id): {
+                        "likeCount": 1,
+                        "commentCount": 0,
+                        "liked": True,
+                    }
+                },
+                str(self.peer.id): {"1": {"likeCount": 2}},
+            },
+        )
+        self.assertEqual(fetch_counts.call_args[0][3], ["1"])
+
+    def test_anonymous_users_are_sent_to_the_login_page(self, _):
+        client = Client(REMOTE_ADDR="127.0.0.1", HTTP_HOST="127.0.0.1")
+        response = client.post(
+            "/refresh_counts", {"posts": {}}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_requests_need_a_csrf_token(self, _):
+        self.assertEqual(self.refresh({"posts": {}}).status_code, 403)
+
+    def test_invalid_bodies_are_refused(self, _):
+        for body in ["{", "[]", {"posts": []}]:
+            response = self.refresh(body, HTTP_X_CSRFTOKEN=self.token)
+            self.assertEqual(response.status_code, 400)
+
+    def test_pages_show_the_counts_and_pending_posts(self, _):
+        post = remote_post(1)
+        post["comments"] = [{"user": "bob", "content": "Hi", "timestamp": "x"}] * 3
+        sync.save_posts(self.peer, [post])
+        interactions.like(self.user, self.peer, post["id"])
+        response = self.client.get("/all")
+        self.assertContains(response, "Comment Count: 3")
+        self.assertContains(response, 'data-pending="true"', count=1)
+        self.assertContains(response, 'data-pending="false"', count=1)
+
+
+@override_settings(FEDERATION_INTERACTION_MAX_ATTEMPTS=2)
+class InteractionTests(FederationTestCase):
+    def setUp(self):
+        super().setUp()
+        sync.save_posts(self.peer, [remote_post(1)])
+        self.remote_id = str(uuid.UUID(int=1))
+
+    def remote_post(self):
+        return RemotePost.objects.get(server=self.peer, remote_id=self.remote_id)
+
+    def test_like_is_optimistic_and_reconciled(self):
+        self.assertEqual(
+            interactions.like(self.user, self.peer, self.remote_id), (True, 1)
+        )
+        pending = PendingInteraction.objects.get()
+        answer = {
+            "results": [{"success": True}],
+            "posts": {self.remote_id: {"likeCount": 5, "commentCount": 2}},
+        }
+        with mock.patch.object(federation, "send_batch", return_value=answer) as send:
+            self.assertEqual(interactions.deliver_due(), {self.peer: 1})
+        operation = send.call_args[0][1][0]
+        self.assertEqual(operation["action"], "like")
+        self.assertEqual(operation["id"], str(pending.id))
+        self.assertEqual(
+            (self.remote_post().like_count, self.remote_post().comment_count), (5, 2)
+        )
+        self.assertFalse(PendingInteraction.objects.exists())
+
+    def test_dispatchers_close_their_database_connection(self):
+        with mock.patch.object(federation, "connection") as connection:
+            self.assertEqual(federation.submit(len, "abc").result(), 3)
+        connection.close.assert_called_once()
+
+    def test_like_and_unlike_before_delivery_cancel_out(self):
+        interactions.like(self.user, self.peer, self.remote_id)
+        interactions.unlike(self.user, self.peer, self.remote_id)
+        self.assertFalse(PendingInteraction.objects.exists())
+        self.assertEqual(self.remote_post().like_count, 0)
+
+    def test_answer_without_results_is_retried(self):
+        interactions.comment(self.user, self.peer, self.remote_id, "hi")
+        with mock.patch.object(federation, "send_batch", return_value={}):
+            self.assertEqual(interactions.deliver_due(), {self.peer: 0})
+        pending = PendingInteraction.objects.get()
+        self.assertEqual(
+            (pending.attempts, pending.last_error), (1, "Incomplete answer")
+        )
+
+    def test_failing_interactions_are_given_up_and_rolled_back(self):
+        interactions.like(self.user, self.peer, self.remote_id)
+        interactions.comment(self.user, self.peer, self.remote_id, "hi")
+        self.assertEqual(
+            (self.remote_post().like_count, self.remote_post().comment_count), (1, 1)
+        )
+        error = requests.ConnectionError("refused")
+        with mock.patch.object(federation, "send_batch", side_effect=error):
+            for _ in range(2):
+                PendingInteraction.objects.update(next_attempt=timezone.now())
+                interactions.deliver_due()
+        self.assertEqual(PendingInteraction.objects.exclude(failed=None).count(), 2)
+        self.assertEqual(
+            (self.remote_post().like_count, self.remote_post().comment_count), (0, 0)
+        )
+        self.assertFalse(RemoteLike.objects.exists())
+        self.assertEqual(ViewerContext(self.user).pending, {})
+
+    def test_servers_without_batch_get_single_operations(self):
+        interactions.like(self.user, self.peer, self.remote_id)
+        interactions.comment(self.user, self.peer, self.remote_id, "hi")
+        answers = {
+            "federation/batch": FakeResponse(404),
+            f"federation/like/{self.remote_id}": FakeResponse(
+                200, {"success": True, "likeCount": 3}
+            ),
+            f"federation/comment/{self.remote_id}": FakeResponse(200),
+        }
+        with mock.patch.object(
+            federation,
+            "request",
+            side_effect=lambda server, method, path, **kwargs: answers[path],
+        ) as request:
+            self.assertEqual(interactions.deliver_due(), {self.peer: 2})
+        self.assertEqual([i[0][2] for i in request.call_args_list], list(answers))
+        self.assertEqual(self.remote_post().like_count, 3)
+        self.assertFalse(PendingInteraction.objects.exists())
+
+
+class DuplicateServerMigrationTests(TransactionTestCase):
+    before = [("network", "0015_pending_interactions")]
+    after = [("network", "0016_lookup_constraints")]
+
+    def tearDown(self):
+        # Leave the database migrated for the next tests.
+        MigrationExecutor(connection).migrate(
+            MigrationExecutor(connection).loader.graph.leaf_nodes()
+        )
+
+    def test_rows_of_duplicates_are_merged(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        apps = executor.loader.project_state(self.before).apps
+        server_model = apps.get_model("network", "ForeignServer")
+        user_model = apps.get_model("network", "User")
+        post_model = apps.get_model("network", "RemotePost")
+        like_model = apps.get_model("network", "RemoteLike")
+        entry_model = apps.get_model("network", "HomeTimelineEntry")
+        now = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+        keep, duplicate = sorted(
+            [server_model.objects.create(ip="10.0.0.3", port=80) for _ in range(2)],
+            key=lambda i: i.pk,
+        )
+        alice = user_model.objects.create(username="alice")
+        bob = user_model.objects.create(username="bob")
+        for server in (keep, duplicate):
+            post_model.objects.create(
+                server=server, remote_id="1", username="x", content="", timestamp=now
+            )
+            like_model.objects.create(user=alice, server=server, post="1")
+        post_model.objects.create(
+            server=duplicate, remote_id="2", username="x", content="", timestamp=now
+        )
+        like_model.objects.create(user=bob, server=duplicate, post="1")
+        # Only the duplicate post is on the timeline of bob.
+        entry_model.objects.create(
+            user=bob,
+            remote_post=post_model.objects.get(server=duplicate, remote_id="1"),
+            timestamp=now,
+        )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        server_model = apps.get_model("network", "ForeignServer")
+        post_model = apps.get_model("network", "RemotePost")
+        like_model = apps.get_model("network", "RemoteLike")
+        entry_model = apps.get_model("network", "HomeTimelineEntry")
+
+        self.assertEqual(
+            list(
+                server_model.objects.filter(ip="10.0.0.3").values_list("pk", flat=True)
+            ),
+            [keep.pk],
+        )
+        self.assertEqual(
+            sorted(
+                post_model.objects.filter(server=keep.pk).values_list(
+                    "remote_id", flat=True
+                )
+            ),
+            ["1", "2"],
+        )
+        self.assertEqual(
+            sorted(like_model.objects.values_list("user__username", "post")),
+            [("alice", "1"), ("bob", "1")],
+        )
+        self.assertEqual(
+            list(
+                entry_model.objects.values_list(
+                    "user__username", "remote_post__remote_id"
+                )
+            ),
+            [("bob", "1")],
+        )
+
+
+class RegistryTests(TestCase):
+    def test_saved_servers_are_found(self):
+        servers.all_servers()
+        server = ForeignServer.objects.create(ip="10.0.0.1", port=8000)
+        self.assertEqual(servers.get_by_address("10.0.0.1", "8000"), server)
+
+    @override_settings(FEDERATION_SERVER_REGISTRY_CHECK=3600)
+    def test_lookups_need_no_queries(self):
+        server = ForeignServer.objects.create(ip="10.0.0.1", port=8000)
+        local = servers.get_local()
+        with self.assertNumQueries(0):
+            self.assertEqual(servers.get(str(server.id)), server)
+            self.assertEqual(servers.get_by_address("10.0.0.1", 8000), server)
+            self.assertEqual(servers.remote_servers(), [server])
+            self.assertEqual(servers.get_local(), local)
+
+    def test_deleted_servers_are_not_found(self):
+        server = ForeignServer.objects.create(ip="10.0.0.1", port=8000)
+        servers.all_servers()
+        server.delete()
+        self.assertNotIn(server, servers.all_servers())
+
+    @override_settings(FEDERATION_SERVER_REGISTRY_CHECK=0)
+    def test_changes_of_other_processes_are_seen(self):
+        before = len(servers.all_servers())
+        # Another process writes the row and bumps the stamp, without the signals of this one.
+        ForeignServer.objects.bulk_create([ForeignServer(ip="10.0.0.2", port=8000)])
+        with override_settings(FEDERATION_SERVER_REGISTRY_CHECK=3600):
+            self.assertEqual(len(servers.all_servers()), before)
+        stamps.bump(stamps.SERVERS)
+        self.assertEqual(len(servers.all_servers()), before + 1)
+
+
+class DatabaseTests(SimpleTestCase):
+    def connect(self, alias):
+        # A new SQLite connection to a memory database, tuned by db.apply_pragmas as it opens.
+        wrapper = SQLiteDatabaseWrapper(
+            dict(connection.settings_dict, NAME=":memory:"), alias=alias
+        )
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.connection.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    @override_settings(SQLITE_PRAGMAS={"cache_size": -1000, "temp_store": "MEMORY"})
+    def test_pragmas_are_run_on_new_connections(self):
+        wrapper = self.connect("default")
+        self.assertEqual(self.pragma(wrapper, "cache_size"), -1000)
+        self.assertEqual(self.pragma(wrapper, "temp_store"), 2)
+        self.assertEqual(self.pragma(wrapper, "query_only"), 0)
+
+    def test_read_connection_is_read_only(self):
+        wrapper = self.connect(settings.DATABASE_READ_ALIAS)
+        self.assertEqual(self.pragma(wrapper, "query_only"), 1)
+
+    @override_settings(SQLITE_TRANSACTION_MODE="IMMEDIATE")
+    def test_transactions_begin_in_the_transaction_mode(self):
+        self.assertTrue(db.transaction_patch_supported())
+        wrapper = self.connect("default")
+        with CaptureQueriesContext(wrapper) as queries:
+            wrapper.set_autocommit(
+                False, force_begin_transaction_with_broken_autocommit=True
+            )
+            wrapper.rollback()
+            wrapper.set_autocommit(True)
+        self.assertEqual(queries[0]["sql"], "BEGIN IMMEDIATE")
+
+    @override_settings(SQLITE_TRANSACTION_MODE="IMMEDIATE")
+    def test_missing_transaction_method_is_reported(self):
+        self.assertEqual(checks.check_transaction_mode(None), [])
+        with mock.patch.object(db, "PATCHED_METHOD", "_begin"):
+            self.assertFalse(db.transaction_patch_supported())
+            self.assertEqual(
+                [i.id for i in checks.check_transaction_mode(None)], ["network.E002"]
+            )
+            with self.assertRaises(ImproperlyConfigured):
+                self.connect("default")
+
+    def test_read_connection_has_options_of_its_own(self):
+        with mock.patch.dict(os.environ, {"DATABASE_MODE": "production"}):
+            production = runpy.run_path(
+                os.path.join(settings.BASE_DIR, "project4", "settings.py")
+            )
+        databases = production["DATABASES"]
+        self.assertEqual(databases["read"]["OPTIONS"], {"timeout": 20})
+        self.assertIsNot(databases["read"]["OPTIONS"], databases["default"]["OPTIONS"])
+
+    def test_timeline_reads_use_the_read_connection(self):
+        router = db.ReadRouter()
+        self.assertEqual(router.db_for_read(Post), settings.DATABASE_READ_ALIAS)
+        self.assertIsNone(router.db_for_read(User))
+        self.assertEqual(router.db_for_write(Post), "default")
+        self.assertFalse(router.allow_migrate(settings.DATABASE_READ_ALIAS, "network"))
+
+    def test_reads_in_a_transaction_stay_on_its_connection(self):
+        router = db.ReadRouter()
+        with mock.patch.object(connection, "in_atomic_block", True):
+            self.assertEqual(router.db_for_read(Post), "default")
+
+
+class BenchmarkTests(TestCase):
+    def test_generated_posts_are_indexed(self):
+        data = benchmark.generate(50, users=5, follows=2, blocks=0)
+        self.assertEqual(data["rows"]["posts"], 50)
+        self.assertGreater(data["rows"]["home_timeline_entries"], 0)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM network_post_fts WHERE source = 'local'"
+            )
+            self.assertEqual(cursor.fetchone()[0], 50)
+
+    def test_the_same_seed_gives_the_same_posts(self):
+        first = benchmark.generate(20, users=5)
+        posts = list(Post.objects.order_by("pk").values_list("pk", "content"))
+        self.assertEqual(first["user"], "user0")
+        self.assertEqual(len(posts), 20)
+        self.assertEqual(
+            [i["id"] for i in benchmark.peer_posts(0, 3, 10)],
+            [i["id"] for i in benchmark.peer_posts(0, 3, 10)],
+        )
@@ -0,0 +1,293 @@
+"""
+Queries building the posts of a timeline page.
+
+Every query here fetches a whole page at once, with the author, comments and the
+liked flag of the viewing user joined in, and checks follows and blocks against
+the ViewerContext of the request, so the number of queries per page does not
+grow with the number of posts. The posts of every source are merged by their
+timestamps without sorting them all.
+"""
+
+import datetime
+import heapq
+import itertools
+import operator
+
+from django.db.models import Exists, OuterRef, Prefetch, Q, Value
+
+from .models import (
+    ForeignComment,
+    ForeignLike,
+    Post,
+    RemoteLike,
+    RemotePost,
+)
+
+
+def format_timestamp(timestamp):
+    """
+    Formats a timestamp the way it is shown to users.
+
+    Parameters:
+    timestamp (datetime): The timestamp to format.
+
+    Returns:
+    str: The formatted timestamp, such as 'Jan. 01, 2024, 12:00 AM'.
+    """
+    return timestamp.astimezone(datetime.timezone.utc).strftime("%b. %d, %Y, %I:%M %p")
+
+
+def local_posts(viewer, local_server, posts_contains=None, following_only=False):
+    """
+    Builds the query of the local posts shown to a user.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the user viewing the posts.
+    local_server (ForeignServer): The server entry of this server.
+    posts_contains (str, optional): Filter string for posts. Defaults to None.
+    following_only (bool, optional): If true, only include posts from followed users. Defaults to False.
+
+    Returns:
+    QuerySet: The posts, newest first, annotated with liked.
+    """
+    posts = Post.objects.select_related("user").prefetch_related(
+        Prefetch(
+            "foreigncomment_set",
+            queryset=ForeignComment.objects.order_by("timestamp"),
+        )
+    )
+    blocked = viewer.blocked_usernames(local_server.id)
+    if blocked:
+        posts = posts.exclude(user__username__in=blocked)
+    if following_only:
+        posts = posts.filter(
+            user__username__in=viewer.followed_usernames(local_server.id)
+        )
+    if viewer.user.is_authenticated:
+        posts = posts.annotate(
+            liked=Exists(
+                ForeignLike.objects.filter(
+                    user=viewer.user.username,
+                    server=local_server,
+                    post=OuterRef("pk"),
+                )
+            )
+        )
+    else:
+        posts = posts.annotate(liked=Value(False))
+    if posts_contains is not None:
+        posts = posts.filter(
+            Q(content__contains=posts_contains)
+            | Q(user__username__contains=posts_contains)
+        )
+    return posts.order_by("-timestamp", "-id")
+
+
+def local_post_dict(post, local_server, viewer):
+    """
+    Converts a post returned by local_posts into the dictionary used by the templates.
+
+    Parameters:
+    post (Post): The post to convert.
+    local_server (ForeignServer): The server entry of this server.
+    viewer (ViewerContext): The follows and blocks of the user viewing the post.
+
+    Returns:
+    dict: The post.
+    """
+    return {
+        "id": post.id,
+        "content": post.content,
+        "user_id": post.user_id,
+        "username": post.user.username,
+        "likes": post.like_count,
+        "comment_count": post.comment_count,
+        "comments": [
+            {
+                "id": i.id,
+                "content": i.content,
+                "timestamp": format_timestamp(i.timestamp),
+                "user": i.user,
+                "post_id": i.post_id,
+                "server_id": i.server_id,
+            }
+            for i in post.foreigncomment_set.all()
+        ],
+        "liked": post.liked,
+        "following": viewer.is_following(local_server.id, post.user.username),
+        "server_id": str(local_server.id),
+        "server_name": "local",
+        "server_port": "",
+        "timestamp_user": format_timestamp(post.timestamp),
+        "timestamp": post.timestamp,
+    }
+
+
+def remote_posts(viewer, servers, posts_contains=None, following_only=False):
+    """
+    Builds the query of the mirrored posts of foreign servers shown to a user.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the user viewing the posts.
+    servers (list): The ForeignServer objects to include the posts of.
+    posts_contains (str, optional): Filter string for posts. Defaults to None.
+    following_only (bool, optional): If true, only include posts from followed users. Defaults to False.
+
+    Returns:
+    QuerySet: The RemotePost objects, newest first, annotated with liked.
+    """
+    posts = RemotePost.objects.filter(server__in=servers).select_related("server")
+    for server in servers:
+        blocked = viewer.blocked_usernames(server.id)
+        if blocked:
+            posts = posts.exclude(server=server, username__in=blocked)
+    if following_only:
+        followed = Q(pk__in=[])
+        for server in servers:
+            followed |= Q(
+                server=server, username__in=viewer.followed_usernames(server.id)
+            )
+        posts = posts.filter(followed)
+    if viewer.user.is_authenticated:
+        posts = posts.annotate(
+            liked=Exists(
+                RemoteLike.objects.filter(
+                    user=viewer.user,
+                    server=OuterRef("server"),
+                    post=OuterRef("remote_id"),
+                )
+            )
+        )
+    else:
+        posts = posts.annotate(liked=Value(False))
+    if posts_contains is not None:
+        posts = posts.filter(
+            Q(content__contains=posts_contains) | Q(username__contains=posts_contains)
+        )
+    return posts.order_by("-timestamp")
+
+
+def remote_post_dict(post, viewer):
+    """
+    Converts a post returned by remote_posts into the dictionary used by the templates.
+
+    Parameters:
+    post (RemotePost): The post to convert.
+    viewer (ViewerContext): The follows and blocks of the user viewing the post.
+
+    Returns:
+    dict: The post.
+    """
+    return {
+        "id": post.remote_id,
+        "content": post.content,
+        "username": post.username,
+        "likes": post.like_count,
+        "comment_count": post.comment_count,
+        "comments": post.comments,
+        "liked": post.liked,
+        "following": viewer.is_following(post.server_id, post.username),
+        "pending": viewer.pending_interactions(post.server_id, post.remote_id),
+        "server_id": str(post.server.id),
+        "server_name": str(post.server.ip),
+        "server_port": str(post.server.port),
+        "timestamp_user": format_timestamp(post.timestamp),
+        "timestamp": post.timestamp,
+    }
+
+
+def first_posts(posts, to_dict, limit):
+    """
+    Fetches the first posts of a query and converts them into dictionaries.
+
+    Parameters:
+    posts (QuerySet): The posts to fetch.
+    to_dict (callable): The function converting a post into a dictionary.
+    limit (int): The maximum number of posts to fetch.
+
+    Returns:
+    tuple: The posts as dictionaries, and whether there are more posts after them.
+    """
+    # Fetch one extra post to know if there are more posts after the limit.
+    post_list = list(posts[: limit + 1])
+    return [to_dict(i) for i in post_list[:limit]], len(post_list) > limit
+
+
+def merge_posts(sources, limit):
+    """
+    Merges sources of posts, each sorted newest first, into the first posts of a timeline.
+
+    Only the posts up to the limit are taken from the sources, so the cost of a page grows with
+    its offset instead of with the number of posts the sources hold.
+
+    Parameters:
+    sources (list): Iterables of posts as dictionaries, each sorted by their 'timestamp' datetime, newest first.
+    limit (int): The maximum number of posts to return.
+
+    Returns:
+    tuple: The posts newest first, and whether the sources hold more posts after them.
+    """
+    merged = heapq.merge(*sources, key=operator.itemgetter("timestamp"), reverse=True)
+    # Take one extra post to know if there are more posts after the limit.
+    post_list = list(itertools.islice(merged, limit + 1))
+    return post_list[:limit], len(post_list) > limit
+
+
+def posts_in_order(viewer, local_server, remote_servers, post_ids):
+    """
+    Loads posts by id and converts them into the dictionaries used by the templates.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the user viewing the posts.
+    local_server (ForeignServer): The server entry of this server.
+    remote_servers (list): The ForeignServer objects the remote posts may come from.
+    post_ids (list): (post_id, remote_post_id) pairs of the posts, with one of the ids set.
+
+    Returns:
+    list: The posts as dictionaries in the order of post_ids, without the ones hidden from the viewer.
+    """
+    found = {}
+    for i in local_posts(viewer, local_server).filter(
+        pk__in=[post_id for post_id, _ in post_ids if post_id is not None]
+    ):
+        found[str(i.pk)] = local_post_dict(i, local_server, viewer)
+    for i in remote_posts(viewer, remote_servers).filter(
+        pk__in=[post_id for _, post_id in post_ids if post_id is not None]
+    ):
+        found[str(i.pk)] = remote_post_dict(i, viewer)
+    return [
+        found[str(post_id or remote_post_id)]
+        for post_id, remote_post_id in post_ids
+        if str(post_id or remote_post_id) in found
+    ]
+
+
+def visible_posts(viewer, local_server, remote_servers, fetch, limit):
+    """
+    Loads the first posts of an index, such as the search or hashtag index, that are shown to a user.
+
+    The index also holds the posts of the users and servers the viewer blocked. Those are left
+    out and more posts are read from the index after them, so a page is never cut short by them.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the user viewing the posts.
+    local_server (ForeignServer): The server entry of this server.
+    remote_servers (list): The ForeignServer objects the remote posts may come from.
+    fetch (callable): A function taking a limit and an offset, returning the (post_id, remote_post_id)
+    pairs of that range of the index.
+    limit (int): The maximum number of posts to return.
+
+    Returns:
+    tuple: The posts as dictionaries in the order of the index, and whether more posts are shown after them.
+    """
+    posts = []
+    offset = 0
+    while len(posts) <= limit:
+        # One extra post is read to know if there are more posts after the limit.
+        count = limit + 1 - len(posts)
+        post_ids = fetch(count, offset)
+        posts += posts_in_order(viewer, local_server, remote_servers, post_ids)
+        if len(post_ids) < count:
+            break
+        offset += count
+    return posts[:limit], len(posts) > limit
@@ -10,6 +10,7 @@ urlpatterns = [
     path("register", views.register, name="register"),
     path("like_post/<str:server_id>/<str:like_post>", views.like, name="like_post"),
     path("edit/<str:edit_post>", views.edit, name="edit_post"),
+    path("refresh_counts", views.refresh_counts, name="refresh_counts"),
     path(
         "unlike_post/<str:server_id>/<str:like_post>", views.unlike, name="unlike_post"
     ),
@@ -23,6 +24,9 @@ urlpatterns = [
     path("all/<int:page_num>", views.all_posts, name="all"),
     path("federation/get_likes", views.federated_get_likes, name="federated_get_likes"),
     path("federation/posts", views.federated_posts, name="federated_posts"),
+    path("federation/inbox", views.federated_inbox, name="federated_inbox"),
+    path("federation/batch", views.federated_batch, name="federated_batch"),
+    path("federation/metrics", views.federation_metrics, name="federation_metrics"),
     path(
         "comment/<str:server_id>/<str:post_id>",
         views.comment,
@@ -54,7 +58,7 @@ urlpatterns = [
     path(
         "federation/unblock_user/<str:server_id>/<str:username>",
         views.unblock_user,
-        name="block_user",
+        name="unblock_user",
     ),
     path(
         "federation/user/<str:username>",
@@ -64,5 +68,7 @@ urlpatterns = [
     path("federation/unblock_server", views.unblock_server, name="unblock_server"),
     path("federation/rss", views.RSSFeed(), name="rss"),
     path("search", views.search, name="search"),
-    path("search/<str:page_num>/", views.search, name="search"),
+    path("search/<int:page_num>/", views.search, name="search"),
+    path("tag/<str:name>", views.tag, name="tag"),
+    path("tag/<str:name>/<int:page_num>", views.tag, name="tag"),
 ]
@@ -0,0 +1,139 @@
+"""
+The follows, blocks and pending interactions of the user viewing a page, loaded once per request.
+
+Timelines check every post against the users the viewer follows or blocks.
+Loading those rows into sets up front turns each check into a set lookup
+instead of a query per post.
+"""
+
+from .models import (
+    Follower,
+    ForeignBlocklist,
+    ForeignUserBlocklist,
+    PendingInteraction,
+)
+
+
+class ViewerContext:
+    """
+    The follows and blocks of a user.
+
+    Users are identified by (server_id, username) pairs, where server_id is the id
+    of the ForeignServer the user belongs to.
+
+    Attributes:
+    user (User): The viewing user, which may be anonymous.
+    following (set): The (server_id, username) pairs of the users the viewer follows.
+    blocked_users (set): The (server_id, username) pairs of the users the viewer blocked.
+    blocked_servers (set): The ids of the servers the viewer blocked.
+    pending (dict): The undelivered interactions of the viewer by (server_id, post_id) pair.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.following = set()
+        self.blocked_users = set()
+        self.blocked_servers = set()
+        self.pending = {}
+        if user.is_authenticated:
+            self.following = set(
+                Follower.objects.filter(following_user=user).values_list(
+                    "server_id", "followee_user"
+                )
+            )
+            self.blocked_users = set(
+                ForeignUserBlocklist.objects.filter(user=user).values_list(
+                    "server_id", "blocked_user"
+                )
+            )
+            self.blocked_servers = set(
+                ForeignBlocklist.objects.filter(user=user).values_list(
+                    "server_id", flat=True
+                )
+            )
+            for server_id, post_id, action, content in (
+                PendingInteraction.objects.filter(user=user, failed=None)
+                .order_by("created")
+                .values_list("server_id", "post", "action", "content")
+            ):
+                self.pending.setdefault((server_id, post_id), []).append(
+                    {"action": action, "content": content}
+                )
+
+    def is_following(self, server_id, username):
+        """
+        Checks if the viewer follows a user.
+
+        Parameters:
+        server_id (UUID): The id of the server the user belongs to.
+        username (str): The username of the user.
+
+        Returns:
+        bool: True if the viewer follows the user, False otherwise.
+        """
+        return (server_id, username) in self.following
+
+    def is_blocked(self, server_id, username):
+        """
+        Checks if the viewer blocked a user.
+
+        Parameters:
+        server_id (UUID): The id of the server the user belongs to.
+        username (str): The username of the user.
+
+        Returns:
+        bool: True if the viewer blocked the user, False otherwise.
+        """
+        return (server_id, username) in self.blocked_users
+
+    def pending_interactions(self, server_id, post_id):
+        """
+        Lists the interactions of the viewer with a post of a foreign server that were not delivered yet.
+
+        Parameters:
+        server_id (UUID): The id of the server the post belongs to.
+        post_id (str): The id of the post on the server.
+
+        Returns:
+        list: The pending interactions as dicts with their 'action' and 'content', oldest first.
+        """
+        return self.pending.get((server_id, str(post_id)), [])
+
+    def followed_usernames(self, server_id):
+        """
+        Lists the users of a server the viewer follows.
+
+        Parameters:
+        server_id (UUID): The id of the server.
+
+        Returns:
+        list: The usernames of the followed users of the server.
+        """
+        return [i[1] for i in self.following if i[0] == server_id]
+
+    def blocked_usernames(self, server_id):
+        """
+        Lists the users of a server the viewer blocked.
+
+        Parameters:
+        server_id (UUID): The id of the server.
+
+        Returns:
+        list: The usernames of the blocked users of the server.
+        """
+        return [i[1] for i in self.blocked_users if i[0] == server_id]
+
+
+def get_viewer(request):
+    """
+    Returns the viewer context of a request, loading it on first use.
+
+    Parameters:
+    request (HttpRequest): Django request object
+
+    Returns:
+    ViewerContext: The follows and blocks of the user making the request.
+    """
+    if not hasattr(request, "_viewer"):
+        request._viewer = ViewerContext(request.user)
+    return request._viewer
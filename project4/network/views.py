@@ -1,21 +1,44 @@
-import datetime
+import functools
 import json
-import time
+import operator
+from urllib.parse import urlencode
 
-import requests
+from django.conf import settings
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.decorators import user_passes_test
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.syndication.views import Feed
 from django.core import serializers
 from django.core.paginator import Paginator, Page
 from django.db import IntegrityError
+from django.db.models import Exists, OuterRef, Prefetch
 from django.http import HttpResponseRedirect
 from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse
+from django.utils.dateparse import parse_datetime
 from django.views.decorators.csrf import csrf_exempt
-
+from django.views.decorators.http import condition
+
+from . import (
+    codecs,
+    counters,
+    etags,
+    federation,
+    fulltext,
+    hashtags,
+    health,
+    home_timeline,
+    interactions,
+    outbox,
+    pagination,
+    post_cache,
+    servers,
+    sync,
+    timeline,
+)
 from .models import (
     User,
     Follower,
@@ -25,7 +48,12 @@ from .models import (
     ForeignServer,
     ForeignBlocklist,
     ForeignUserBlocklist,
+    RemoteLike,
 )
+from .viewer import get_viewer
+
+# Number of posts shown on each page of a timeline or profile.
+POSTS_PER_PAGE = 10
 
 
 def superuser_check(user_check):
@@ -56,31 +84,75 @@ def index(request):
     return HttpResponseRedirect(reverse("all"))
 
 
-@login_required
-def following(request, page_num):
+async def following(request, page_num=1):
     """
     Handles requests for posts from followed users and renders them on the index page.
 
-    This function fetches posts from users that the current authenticated user is following.
+    This function reads the posts from the precomputed home timeline of the current authenticated user.
 
     Parameters:
     request (WSGIRequest): The incoming HTTP request.
-    page_num (int): The page number for pagination.
+    page_num (int, optional): The page number for pagination. Default is 1.
 
     Returns:
     HttpResponse: A response with the rendered index page including the requested posts from followed users.
     """
-    return render_index(request, "following", following_only=True, page_num=page_num)
+    # login_required does not support async views, so check the user here.
+    if not await sync_to_async(lambda: request.user.is_authenticated)():
+        return redirect_to_login(request.get_full_path())
+    if settings.FEDERATION_TIMELINE_SOURCE != "mirror":
+        # Remote posts that are not mirrored are not on the home timelines, filter the timeline instead.
+        return await arender_index(
+            request, "following", following_only=True, page_num=page_num
+        )
+    return await sync_to_async(_render_following)(request, page_num)
 
 
-def render_index(
+def _render_following(request, page_num):
+    # Renders a page of the home timeline of the user.
+    # Read the page of the home timeline, with one extra post to know if there is a next page.
+    viewer = get_viewer(request)
+    entries = home_timeline.entries(
+        viewer, POSTS_PER_PAGE + 1, (page_num - 1) * POSTS_PER_PAGE
+    )
+    has_more = len(entries) > POSTS_PER_PAGE
+
+    local_server = servers.get_local()
+    remote_servers = [
+        i for i in servers.remote_servers() if i.id not in viewer.blocked_servers
+    ]
+    posts = timeline.posts_in_order(
+        viewer, local_server, remote_servers, entries[:POSTS_PER_PAGE]
+    )
+
+    next_page = "0"
+    prev_page = "0"
+    if page_num > 1:
+        prev_page = reverse("following", args=(page_num - 1,))
+    if has_more:
+        next_page = reverse("following", args=(page_num + 1,))
+
+    return render(
+        request,
+        "network/index.html",
+        {
+            "posts": posts,
+            "next_page": next_page,
+            "prev_page": prev_page,
+            "server_id": str(local_server.id),
+        },
+    )
+
+
+async def arender_index(
     request, page_view_name, posts_contains=None, following_only=False, page_num=1
 ):
     """
     Renders the index page with posts and relevant data.
 
     This function fetches posts based on various conditions, handles pagination, and renders the 'network/index.html'
-    template with the context containing posts and pagination data.
+    template with the context containing posts and pagination data. Posts fetched live from foreign servers are
+    awaited without holding a thread.
 
     Parameters:
     request (HttpRequest): Django request object
@@ -92,145 +164,196 @@ def render_index(
     Returns:
     HttpResponse: Rendered page
     """
-    blocked_servers = []
-    if request.user.is_authenticated:
-        blocked_servers = ForeignBlocklist.objects.filter(
-            user=request.user
-        ).values_list("server", flat=True)
-    # Query all posts and handle pagination
-    local_server = get_object_or_404(ForeignServer, ip="local")
-    # Count likes for each post
-    initial_post_list = list(Post.objects.order_by("-timestamp").values())
-    post_list = []
-    for i in initial_post_list:
-        i["username"] = str(get_object_or_404(User, id=i["user_id"]).username)
-        if (
-            request.user.is_authenticated
-            and (
-                (
-                    ForeignUserBlocklist.objects.filter(
-                        user=request.user,
-                        server=local_server,
-                        blocked_user=i["username"],
-                    ).exists()
-                )
-                or (
-                    following_only
-                    and not Follower.objects.filter(
-                        following_user=request.user,
-                        server=local_server,
-                        followee_user=i["username"],
-                    ).exists()
-                )
-            )
-            or (posts_contains is not None and posts_contains not in str(i))
-        ):
-            continue
-        i["server_id"] = str(local_server.id)
-        i["likes"] = len(ForeignLike.objects.filter(post__id=i["id"]))
-        i["comments"] = list(ForeignComment.objects.filter(post__id=i["id"]).values())
-        for j in i["comments"]:
-            j["timestamp"] = (
-                j["timestamp"]
-                .astimezone(datetime.timezone.utc)
-                .strftime("%b. %d, %Y, %I:%M %p")
-            )
-        i["server_name"] = "local"
-        i["server_port"] = ""
-        i["timestamp_user"] = (
-            i["timestamp"]
-            .astimezone(datetime.timezone.utc)
-            .strftime("%b. %d, %Y, %I:%M %p")
-        )
-        i["timestamp"] = (
-            i["timestamp"]
-            .replace(tzinfo=datetime.timezone.utc)
-            .strftime("%Y-%m-%dT%H:%M:%S.%fZ")
-        )
-        i["liked"] = ForeignLike.objects.filter(
-            user=request.user, server=local_server, post__id=i["id"]
-        ).exists()
-        if request.user.is_authenticated:
-            i["following"] = Follower.objects.filter(
-                following_user=request.user,
-                followee_user=i["username"],
-                server=local_server,
-            ).exists()
-        else:
-            i["following"] = False
-        post_list.append(i)
-    for i in ForeignServer.objects.all():
-        if i.id not in blocked_servers and i.ip != "local":
-            try:
-                result = requests.get(
-                    "http://" + i.ip + ":" + str(i.port) + "/federation/posts",
-                    timeout=5,
-                    data=json.dumps(
-                        {
-                            "username": request.user.username,
-                            "port": request.META["SERVER_PORT"],
-                        }
-                    ),
-                )
-                if result.status_code == 200:
-                    json_data = json.loads(result.content)
-                    append_posts = []
-                    for j in json_data["posts"]:
-                        j["server_name"] = str(i.ip)
-                        j["server_port"] = str(i.port)
-                        j["server_id"] = str(i.id)
-                        if (
-                            request.user.is_authenticated
-                            and Follower.objects.filter(
-                                following_user=request.user,
-                                followee_user=j["username"],
-                                server=i,
-                            ).exists()
-                        ):
-                            j["following"] = True
-                        else:
-                            j["following"] = False
-                        if (
-                            request.user.is_authenticated
-                            and (
-                                ForeignUserBlocklist.objects.filter(
-                                    user=request.user,
-                                    server=local_server,
-                                    blocked_user=j["username"],
-                                ).exists()
-                                or (following_only and not j["following"])
-                            )
-                            or (
-                                posts_contains is not None
-                                and posts_contains not in str(j)
-                            )
-                        ):
-                            continue
-                        append_posts.append(j)
-                    post_list += append_posts
-            except Exception as e:
-                print(e)
-                pass
-    sorted_post_list = sorted(
-        post_list,
-        key=lambda x: int(
-            time.mktime(
-                datetime.datetime.strptime(
-                    x["timestamp"], "%Y-%m-%dT%H:%M:%S.%fZ"
-                ).utctimetuple()
+    sources, has_more, live_servers = await sync_to_async(_index_posts)(
+        request, posts_contains, following_only, page_num
+    )
+    # Filtered pages keep fetching older posts of a server until enough of them are shown.
+    viewer = get_viewer(request)
+    match = None
+    if posts_contains is not None or following_only:
+        match = {
+            i: functools.partial(
+                _live_post_shown, viewer, i, posts_contains, following_only
             )
+            for i in live_servers
+        }
+    # Fetch the posts of every foreign server at once, leaving out the ones that miss the page deadline.
+    remote_posts = await federation.afan_out(
+        live_servers,
+        lambda server, timeout: post_cache.aget_posts(
+            server,
+            request.META["SERVER_PORT"],
+            page_num * POSTS_PER_PAGE,
+            timeout,
+            match[server] if match else None,
         ),
-        reverse=True,
     )
-    paginator = Paginator(sorted_post_list, 10)
+    remote_has_more = await sync_to_async(_add_live_posts)(
+        request, sources, live_servers, remote_posts, posts_contains, following_only
+    )
+    return await sync_to_async(_render_index_page)(
+        request,
+        page_view_name,
+        sources,
+        has_more or remote_has_more,
+        posts_contains,
+        page_num,
+    )
+
+
+def _index_posts(request, posts_contains, following_only, page_num):
+    """
+    Loads the posts of an index page from the database.
+
+    Parameters:
+    request (HttpRequest): Django request object
+    posts_contains (str): Filter string for posts, None for no filter.
+    following_only (bool): If true, only include posts from followed users.
+    page_num (int): The number of the page to display.
+
+    Returns:
+    tuple: The lists of posts as dictionaries of every source, each newest first, whether a source
+    has more posts after them, and the foreign servers whose posts have to be fetched live, which
+    is empty when they are read from the mirror.
+    """
+    # Load the follows and blocks of the user once instead of checking every post against the database.
+    viewer = get_viewer(request)
+    local_server = servers.get_local()
+    # Every source only has to contribute as many posts as fit up to the requested page.
+    limit = page_num * POSTS_PER_PAGE
+    post_list, has_more = timeline.first_posts(
+        timeline.local_posts(viewer, local_server, posts_contains, following_only),
+        lambda post: timeline.local_post_dict(post, local_server, viewer),
+        limit,
+    )
+    remote_servers = [
+        i for i in servers.remote_servers() if i.id not in viewer.blocked_servers
+    ]
+    if settings.FEDERATION_TIMELINE_SOURCE != "mirror":
+        return [post_list], has_more, remote_servers
+    # Read the posts of foreign servers from the local mirror filled by sync_remote_posts.
+    remote_post_list, remote_has_more = timeline.first_posts(
+        timeline.remote_posts(viewer, remote_servers, posts_contains, following_only),
+        lambda post: timeline.remote_post_dict(post, viewer),
+        limit,
+    )
+    return [post_list, remote_post_list], has_more or remote_has_more, []
+
+
+def _add_live_posts(
+    request, sources, live_servers, remote_posts, posts_contains, following_only
+):
+    """
+    Adds the posts fetched live from foreign servers to the sources of an index page.
+
+    Parameters:
+    request (HttpRequest): Django request object, whose viewer context is already loaded.
+    sources (list): The lists of posts of every source, extended in place with one list per server.
+    live_servers (list): The foreign servers the posts were fetched from, in display order.
+    remote_posts (dict): A mapping of ForeignServer to its posts, for every server that answered.
+    posts_contains (str): Filter string for posts, None for no filter.
+    following_only (bool): If true, only include posts from followed users.
+
+    Returns:
+    bool: True if a server has more posts than were fetched, False otherwise.
+    """
+    viewer = get_viewer(request)
+    # The cached posts are shared by every viewer, so the likes of this viewer are looked up here.
+    liked = set()
+    if request.user.is_authenticated:
+        liked = set(
+            RemoteLike.objects.filter(
+                user=request.user,
+                post__in=[
+                    str(j["id"]) for i in remote_posts.values() for j in i["posts"]
+                ],
+            ).values_list("server_id", "post")
+        )
+    remote_has_more = False
+    for i in live_servers:
+        if i not in remote_posts:
+            continue
+        if remote_posts[i]["next_cursor"] is not None:
+            remote_has_more = True
+        append_posts = []
+        for j in remote_posts[i]["posts"]:
+            if not _live_post_shown(viewer, i, posts_contains, following_only, j):
+                continue
+            j["server_name"] = str(i.ip)
+            j["server_port"] = str(i.port)
+            j["server_id"] = str(i.id)
+            j["following"] = viewer.is_following(i.id, j["username"])
+            timestamp = parse_datetime(j["timestamp"])
+            if timestamp is None:
+                continue
+            j["timestamp"] = timestamp
+            j["liked"] = (i.id, str(j["id"])) in liked
+            j["pending"] = viewer.pending_interactions(i.id, j["id"])
+            # Servers that do not count comments send the comments themselves.
+            j.setdefault("comment_count", len(j.get("comments") or []))
+            append_posts.append(j)
+        # Servers that do not paginate may send their posts in any order.
+        append_posts.sort(key=operator.itemgetter("timestamp"), reverse=True)
+        sources.append(append_posts)
+    return remote_has_more
+
+
+def _live_post_shown(viewer, server, posts_contains, following_only, post):
+    """
+    Checks if a post fetched live from a foreign server is shown on an index page.
+
+    Parameters:
+    viewer (ViewerContext): The follows and blocks of the viewing user.
+    server (ForeignServer): The server the post comes from.
+    posts_contains (str): Filter string for posts, None for no filter.
+    following_only (bool): If true, only show posts from followed users.
+    post (dict): The post, as returned by the federation/posts endpoint of the server.
+
+    Returns:
+    bool: True if the post is shown, False otherwise.
+    """
+    if viewer.is_blocked(server.id, post["username"]):
+        return False
+    if following_only and not viewer.is_following(server.id, post["username"]):
+        return False
+    return posts_contains is None or posts_contains in str(post)
+
+
+def _render_index_page(
+    request, page_view_name, sources, has_more, posts_contains, page_num
+):
+    """
+    Merges and paginates the posts of an index page and renders it.
+
+    Parameters:
+    request (HttpRequest): Django request object
+    page_view_name (str): Name of the page view
+    sources (list): The lists of posts as dictionaries of every source, each newest first.
+    has_more (bool): True if a source has more posts than the ones in sources.
+    posts_contains (str): Filter string for posts, None for no filter.
+    page_num (int): The number of the page to display.
+
+    Returns:
+    HttpResponse: Rendered page
+    """
+    # Only the posts up to the end of the requested page are merged.
+    post_list, merged_has_more = timeline.merge_posts(
+        sources, page_num * POSTS_PER_PAGE
+    )
+    has_more = has_more or merged_has_more
+    paginator = Paginator(post_list, POSTS_PER_PAGE)
     posts: Page = paginator.get_page(page_num)
     # Handle pagination
     next_page = "0"
     prev_page = "0"
+    # Search pages keep their query in the query string.
+    query_string = ""
+    if posts_contains is not None:
+        query_string = "?" + urlencode({"q": posts_contains})
     if page_num > 1:
-        prev_page = reverse(page_view_name, args=(page_num - 1,))
-    if page_num < paginator.num_pages:
-        next_page = reverse(page_view_name, args=(page_num + 1,))
+        prev_page = reverse(page_view_name, args=(page_num - 1,)) + query_string
+    if page_num < paginator.num_pages or has_more:
+        next_page = reverse(page_view_name, args=(page_num + 1,)) + query_string
 
     # Render the page
     return render(
@@ -240,12 +363,12 @@ def render_index(
             "posts": posts,
             "next_page": next_page,
             "prev_page": prev_page,
-            "server_id": str(get_object_or_404(ForeignServer, ip="local").id),
+            "server_id": str(servers.get_local().id),
         },
     )
 
 
-def all_posts(request, page_num=1):
+async def all_posts(request, page_num=1):
     """
     Handles requests for all posts and renders them on the index page.
 
@@ -258,7 +381,7 @@ def all_posts(request, page_num=1):
     Returns:
     HttpResponse: A response with the rendered index page including the requested posts.
     """
-    return render_index(request, page_view_name="all", page_num=page_num)
+    return await arender_index(request, page_view_name="all", page_num=page_num)
 
 
 def login_view(request):
@@ -336,12 +459,11 @@ def post(request):
         if "#" in content_str:
             new_string = ""
             for i in request.POST["content"].split(" "):
-                if i.startswith("#"):
+                hashtag = hashtags.HASHTAG.match(i)
+                if hashtag:
                     new_string += (
                         '<a href="'
-                        + reverse("search")
-                        + "?q=%23"
-                        + i[1:]
+                        + reverse("tag", args=(hashtag.group(1).lower(),))
                         + '">'
                         + i
                         + "</a> "
@@ -362,11 +484,12 @@ def post(request):
         return render(request, "network/post.html")
 
 
-def user(request, username, server_id, page_num=1):
+async def user(request, username, server_id, page_num=1):
     """
     Display a user's profile page including their posts and profile info.
 
-    This function fetches a user's posts along with their profile information..
+    This function fetches a user's posts along with their profile information.
+    The profile of a user on a foreign server is awaited without holding a thread.
 
     Parameters:
     request (WSGIRequest): The incoming HTTP request.
@@ -377,54 +500,103 @@ def user(request, username, server_id, page_num=1):
     Returns:
     HttpResponse: The HTTP response rendering the user's profile page.
     """
-    local_server = get_object_or_404(ForeignServer, ip="local")
+    profile = await sync_to_async(_load_profile)(request, username, server_id)
+    if profile["server"].ip != "local":
+        try:
+            json_response = await federation.afetch_json(
+                profile["server"],
+                f"federation/user/{username}",
+                json.dumps(
+                    {"port": request.META["SERVER_PORT"], "user": request.user.username}
+                ),
+            )
+            profile["followers"] += json_response["followers"]
+            profile["following"] = json_response["following_users"]
+            profile["posts"] = json_response["posts"]
+            for i in profile["posts"]:
+                i.setdefault("comment_count", len(i.get("comments") or []))
+        except Exception as e:
+            print(f"Error loading user data: {e}")
+            return HttpResponseRedirect(reverse("index"))
+    return await sync_to_async(_render_profile)(
+        request, username, server_id, page_num, profile
+    )
+
+
+def _load_profile(request, username, server_id):
+    """
+    Loads the profile of a user from the database.
+
+    Parameters:
+    request (WSGIRequest): The incoming HTTP request.
+    username (str): The username of the user to fetch the profile of.
+    server_id (str): The id of the server where the user is located.
+
+    Returns:
+    dict: The 'server' of the user, the number of 'followers' on this server, and for local users
+    the number of users they are 'following' and their 'posts'.
+    """
+    local_server = servers.get_local()
     if server_id == "local":
         server = local_server
     else:
-        server = get_object_or_404(ForeignServer, id=server_id)
-    user_following = False
-    if request.user.is_authenticated:
-        followers_filter = Follower.objects.filter(
-            following_user=request.user, followee_user=username, server=server
-        )
-        user_following = followers_filter.exists()
-    followers = len(Follower.objects.filter(server=server, followee_user=username))
+        server = servers.get(server_id)
+    # Load the follows and blocks of the user for _render_profile.
+    get_viewer(request)
+    profile = {
+        "server": server,
+        "followers": Follower.objects.filter(
+            server=server, followee_user=username
+        ).count(),
+        "following": 0,
+        "posts": [],
+    }
     if server == local_server:
         request_user = get_object_or_404(User, username=username)
         posts = list(
             Post.objects.filter(user=request_user).order_by("-timestamp").values()
         )
-        following_users = len(Follower.objects.filter(followee_user=request_user))
+        profile["following"] = len(Follower.objects.filter(followee_user=request_user))
+        # Load the likes of the viewer and the comments of all posts at once.
+        liked_posts = set(
+            ForeignLike.objects.filter(
+                user=request.user.username, server=local_server, post__user=request_user
+            ).values_list("post", flat=True)
+        )
+        comments = {}
+        for i in ForeignComment.objects.filter(
+            user=username, server=server, post__user=request_user
+        ).values():
+            comments.setdefault(i["post_id"], []).append(i)
         for i in posts:
-            i["likes"] = len(ForeignLike.objects.filter(post=i["id"]))
-            i["liked"] = ForeignLike.objects.filter(
-                post=i["id"], user=request.user.username, server=local_server
-            )
+            i["likes"] = i["like_count"]
+            i["liked"] = i["id"] in liked_posts
             i["username"] = request_user.username
-            i["comments"] = list(
-                ForeignComment.objects.filter(
-                    user=username, server=server, post=i["id"]
-                ).values()
-            )
-    else:
-        try:
-            result = requests.get(
-                url=f"http://{server.ip}:{server.port}/federation/user/{username}",
-                timeout=5,
-                data=json.dumps(
-                    {"port": request.META["SERVER_PORT"], "user": request.user.username}
-                ),
-            )
-            json_response = json.loads(result.content)
-            followers += json_response["followers"]
-            following_users = json_response["following_users"]
-            posts = json_response["posts"]
-        except Exception as e:
-            print(f"Error loading user data: {e}")
-            return HttpResponseRedirect(reverse("index"))
+            i["comments"] = comments.get(i["id"], [])
+        profile["posts"] = posts
+    return profile
+
+
+def _render_profile(request, username, server_id, page_num, profile):
+    """
+    Paginates the posts of a user and renders their profile page.
+
+    Parameters:
+    request (WSGIRequest): The incoming HTTP request.
+    username (str): The username of the user.
+    server_id (str): The id of the server where the user is located.
+    page_num (int): The number of the page to be displayed.
+    profile (dict): The profile of the user, as loaded by _load_profile.
+
+    Returns:
+    HttpResponse: The HTTP response rendering the user's profile page.
+    """
+    server = profile["server"]
+    viewer = get_viewer(request)
+    posts = profile["posts"]
     next_page = "0"
     prev_page = "0"
-    paginator = Paginator(posts, 10)
+    paginator = Paginator(posts, POSTS_PER_PAGE)
     if page_num > 1:
         prev_page = reverse(
             "user",
@@ -451,12 +623,13 @@ def user(request, username, server_id, page_num=1):
             "username": username,
             "next_page": next_page,
             "prev_page": prev_page,
-            "followers": followers,
-            "following": following_users,
-            "user_following": user_following,
+            "followers": profile["followers"],
+            "following": profile["following"],
+            "user_following": viewer.is_following(server.id, username),
+            "blocked": viewer.is_blocked(server.id, username),
             "server_id": server_id,
             "local_server": server.ip == "local",
-            "not_self": server != local_server or request.user.username != username,
+            "not_self": server.ip != "local" or request.user.username != username,
         },
     )
 
@@ -476,39 +649,23 @@ def like(request, like_post, server_id):
 
     Returns:
     JsonResponse: A JSON response containing the updated count of likes for the post and the success status.
+    Likes of posts of foreign servers are 'pending' until they are delivered, and their count is optimistic.
     """
     if server_id == "local":
-        server = get_object_or_404(ForeignServer, ip="local")
+        server = servers.get_local()
     else:
-        server = get_object_or_404(ForeignServer, id=server_id)
+        server = servers.get(server_id)
     if server.ip == "local":
         like_post = get_object_or_404(Post, id=like_post)
-        likes = ForeignLike.objects.filter(
-            post=like_post, user=request.user, server=server
+        success, like_count = counters.add_like(
+            like_post, request.user.username, server
         )
-        success = False
-        if not likes.exists():
-            likes.create(post=like_post, user=request.user, server=server)
-            success = True
-        like_count = len(ForeignLike.objects.filter(post=like_post))
         return JsonResponse({"likeCount": like_count, "success": success})
-    else:
-        try:
-            result = requests.post(
-                f"http://{server.ip}:{server.port}/federation/like/{like_post}",
-                timeout=5,
-                data=json.dumps(
-                    {
-                        "username": request.user.username,
-                        "port": request.META["SERVER_PORT"],
-                    }
-                ),
-            )
-            if result.status_code == 200:
-                return JsonResponse(json.loads(result.content))
-        except requests.exceptions.Timeout:
-            pass
-        return JsonResponse({"success": False})
+    # Answer right away and let the dispatcher deliver the like to the foreign server.
+    success, like_count = interactions.like(request.user, server, like_post)
+    if success:
+        interactions.dispatch(server)
+    return JsonResponse({"likeCount": like_count, "success": success, "pending": True})
 
 
 @csrf_exempt
@@ -526,42 +683,24 @@ def unlike(request, like_post, server_id):
 
     Returns:
     JsonResponse: A JSON response containing the updated count of likes for the post and the success status.
+    Unlikes of posts of foreign servers are 'pending' until they are delivered, and their count is optimistic.
     """
     if server_id == "local":
-        server = get_object_or_404(ForeignServer, ip="local")
+        server = servers.get_local()
     else:
-        server = get_object_or_404(ForeignServer, id=server_id)
+        server = servers.get(server_id)
     # If the server is local, handle the unlike operation locally.
     if server.ip == "local":
         like_post = get_object_or_404(Post, id=like_post)
-        likes = ForeignLike.objects.filter(
-            post=like_post, user=request.user, server=server
+        success, like_count = counters.remove_like(
+            like_post, request.user.username, server
         )
-        success = False
-        if likes.exists():
-            likes.delete()
-            success = True
-        like_count = len(ForeignLike.objects.filter(post=like_post))
         return JsonResponse({"likeCount": like_count, "success": success})
-    # If the server is not local, send an HTTP request to the foreign server to handle the unlike operation.
-    else:
-        try:
-            result = requests.post(
-                f"http://{server.ip}:{server.port}/federation/unlike/{like_post}",
-                timeout=5,
-                data=json.dumps(
-                    {
-                        "username": request.user.username,
-                        "port": request.META["SERVER_PORT"],
-                    }
-                ),
-            )
-            if result.status_code == 200:
-                return JsonResponse(json.loads(result.content))
-        except requests.exceptions.Timeout:
-            pass
-        # If the request is not successful or it times out, return a JSON response with success set to False.
-        return JsonResponse({"success": False})
+    # If the server is not local, answer right away and let the dispatcher deliver the unlike.
+    success, like_count = interactions.unlike(request.user, server, like_post)
+    if success:
+        interactions.dispatch(server)
+    return JsonResponse({"likeCount": like_count, "success": success, "pending": True})
 
 
 @csrf_exempt
@@ -613,7 +752,7 @@ def follow(request, username, server_id):
     Follower.objects.get_or_create(
         following_user=request.user,
         followee_user=username,
-        server=get_object_or_404(ForeignServer, id=server_id),
+        server=servers.get(server_id),
     )
 
     # Redirect the user to the index page.
@@ -639,7 +778,7 @@ def unfollow(request, username, server_id):
         Follower,
         following_user=request.user,
         followee_user=username,
-        server=get_object_or_404(ForeignServer, id=server_id),
+        server=servers.get(server_id),
     )
     # Delete the fetched Follower object, effectively unfollowing the user.
     follower_to_delete.delete()
@@ -665,40 +804,20 @@ def comment(request, post_id, server_id):
     # Check if the request is a POST.
     if request.method == "POST":
         # Fetch the server where the post resides.
-        server = get_object_or_404(ForeignServer, id=server_id)
+        server = servers.get(server_id)
 
         # If the server is local, create the comment locally.
-        if server == get_object_or_404(ForeignServer, ip="local"):
-            ForeignComment.objects.create(
-                content=request.POST["content"],
-                user=request.user,
-                post=get_object_or_404(Post, id=post_id),
-                server=server,
+        if server == servers.get_local():
+            counters.add_comment(
+                get_object_or_404(Post, id=post_id),
+                request.user.username,
+                server,
+                request.POST["content"],
             )
-        # If the server is foreign, send a POST request to create the comment.
+        # If the server is foreign, queue the comment for the dispatcher to deliver.
         else:
-            try:
-                # Formulate the URL for the POST request.
-                url = "http://{}:{}/federation/comment/{}".format(
-                    server.ip, server.port, post_id
-                )
-
-                # Prepare the payload data.
-                data = json.dumps(
-                    {
-                        "username": request.user.username,
-                        "content": request.POST["content"],
-                        "port": request.META["SERVER_PORT"],
-                    }
-                )
-
-                # Send the POST request to the foreign server.
-                requests.post(url, timeout=5, data=data)
-
-            # Catch any timeout exceptions.
-            except requests.exceptions.Timeout:
-                # If the request times out, redirect to the index page.
-                return HttpResponseRedirect(reverse("index"))
+            interactions.comment(request.user, server, post_id, request.POST["content"])
+            interactions.dispatch(server)
 
     # Redirect to the index page.
     return HttpResponseRedirect(reverse("index"))
@@ -722,15 +841,11 @@ def federated_comment(request, post_id):
         json_data = json.loads(request.body)
 
         # Create a new ForeignComment in the database with the data from the payload.
-        createdComment = ForeignComment.objects.create(
-            content=json_data["content"],
-            user=json_data["username"],
-            post=get_object_or_404(Post, id=post_id),
-            server=get_object_or_404(
-                ForeignServer,
-                ip=request.META.get("REMOTE_ADDR"),
-                port=json_data["port"],
-            ),
+        createdComment = counters.add_comment(
+            get_object_or_404(Post, id=post_id),
+            json_data["username"],
+            servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"]),
+            json_data["content"],
         )
 
         # Return a JSON response containing a serialized version of the new comment.
@@ -757,25 +872,11 @@ def federated_like(request, post_id):
 
     # Load the JSON data from the request body.
     json_data = json.loads(request.body)
-    server = get_object_or_404(
-        ForeignServer, ip=request.META.get("REMOTE_ADDR"), port=json_data["port"]
-    )
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
     like_post = get_object_or_404(Post, id=post_id)
 
-    success = False
-
-    # Check if a ForeignLike object already exists for the given server, user, and post.
-    if not ForeignLike.objects.filter(
-        server=server, user=json_data["username"], post=like_post
-    ).exists():
-        # If no ForeignLike object exists, create one.
-        ForeignLike.objects.create(
-            server=server, user=json_data["username"], post=like_post
-        )
-        success = True
-
-    # Count the total number of likes for the post.
-    like_count = ForeignLike.objects.filter(post=like_post).count()
+    # Like the post unless the user already liked it, updating its like count.
+    success, like_count = counters.add_like(like_post, json_data["username"], server)
 
     # Return a JSON response indicating the success of the operation and the updated like count.
     return JsonResponse(
@@ -786,26 +887,93 @@ def federated_like(request, post_id):
     )
 
 
+@login_required
+def refresh_counts(request):
+    """
+    Returns the current like and comment counts of the posts shown on a page, so they can be refreshed in place.
+
+    The JSON body maps the id of the server of the posts to the ids of its posts under 'posts'.
+    The counts of local posts are read directly, the others are asked of their servers at once.
+
+    Parameters:
+    request (WSGIRequest): The incoming HTTP request.
+
+    Returns:
+    JsonResponse: The counts and liked flags of the posts, by server id and post id, under 'posts'.
+    Servers that do not answer in time are left out.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=405)
+    try:
+        json_data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({"error": "Invalid JSON."}, status=400)
+    posts = json_data.get("posts") if isinstance(json_data, dict) else None
+    if not isinstance(posts, dict) or not all(
+        isinstance(i, list) for i in posts.values()
+    ):
+        return JsonResponse({"error": "Invalid posts."}, status=400)
+
+    viewer = get_viewer(request)
+    counts = {}
+    remote_servers = []
+    for server in servers.all_servers():
+        if str(server.id) not in posts or server.id in viewer.blocked_servers:
+            continue
+        post_ids = posts.get(str(server.id), [])[: settings.FEDERATION_POSTS_MAX_LIMIT]
+        if server.ip == "local":
+            counts[str(server.id)] = counters.post_counts(
+                post_ids, request.user.username, server
+            )
+        else:
+            remote_servers.append(server)
+    remote_counts = federation.fan_out(
+        remote_servers,
+        lambda server, timeout: federation.fetch_counts(
+            server,
+            request.user.username,
+            request.META["SERVER_PORT"],
+            posts.get(str(server.id), [])[: settings.FEDERATION_POSTS_MAX_LIMIT],
+            timeout,
+        ),
+    )
+    for server, server_counts in remote_counts.items():
+        counts[str(server.id)] = server_counts
+    return JsonResponse({"posts": counts})
+
+
 @csrf_exempt
 def federated_get_likes(request):
     """
-    This function retrieves all 'likes' associated with a foreign server.
+    Returns the like and comment counts of posts to a federated server, and whether one of its users liked them.
+
+    The JSON body contains the 'port' of the server, the 'post_ids' of the posts and the 'username'
+    of the user viewing them.
+
     Parameters:
     request (WSGIRequest): An HTTP request object.
 
     Returns:
-    JsonResponse: A JSON response containing the likes associated with the foreign server.
+    HttpResponse: The counts and liked flags of the known posts by post id, under 'posts'.
     """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=405)
 
-    server = get_object_or_404(
-        ForeignServer, ip=request.get_host(), port=request.get_port()
-    )
-
-    # Filter ForeignLike objects based on the identified server.
-    likes = ForeignLike.objects.filter(server=server)
+    # Load JSON data from the request body.
+    json_data = json.loads(request.body)
 
-    # Return a JSON response containing the filtered 'likes'.
-    return JsonResponse({"Likes": likes})
+    # Retrieve the ForeignServer object based on the IP address and port included in the request.
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
+
+    post_ids = json_data.get("post_ids")
+    if not isinstance(post_ids, list):
+        return JsonResponse({"error": "Invalid post_ids."}, status=400)
+    counts = counters.post_counts(
+        post_ids[: settings.FEDERATION_POSTS_MAX_LIMIT],
+        json_data.get("username", ""),
+        server,
+    )
+    return codecs.negotiated_response(request, {"posts": counts})
 
 
 @csrf_exempt
@@ -825,36 +993,18 @@ def federated_unlike(request, post_id):
 
     # Get the foreign server from which the request is coming.
     # If no such server exists, raise a 404 error.
-    server = get_object_or_404(
-        ForeignServer, ip=request.META.get("REMOTE_ADDR"), port=json_data["port"]
-    )
-
-    # Check if a ForeignLike object exists for the given server, user, and post.
-    if ForeignLike.objects.filter(
-        server=server,
-        user=json_data["username"],
-        post=get_object_or_404(Post, id=post_id),
-    ).exists():
-        # If a ForeignLike object exists, delete it.
-        ForeignLike.objects.filter(
-            server=server,
-            user=json_data["username"],
-            post=get_object_or_404(Post, id=post_id),
-        ).delete()
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
 
-        # Return a JSON response indicating the success of the operation and the updated like count.
-        return JsonResponse(
-            {
-                "likeCount": len(ForeignLike.objects.filter(post__id=post_id)),
-                "success": True,
-            }
-        )
+    # Delete the like of the user if there is one, updating the like count of the post.
+    success, like_count = counters.remove_like(
+        get_object_or_404(Post, id=post_id), json_data["username"], server
+    )
 
-    # If no ForeignLike object exists, return a JSON response indicating the failure of the operation.
+    # Return a JSON response indicating the success of the operation and the updated like count.
     return JsonResponse(
         {
-            "likeCount": len(ForeignLike.objects.filter(post__id=post_id)),
-            "success": False,
+            "likeCount": like_count,
+            "success": success,
         }
     )
 
@@ -882,16 +1032,24 @@ def add_servers(request):
         # Redirect the superuser to the 'add_servers' page after adding the server.
         return HttpResponseRedirect(reverse("add_servers"))
 
+    # Attach the health of every server for the superuser, as seen by this process if it called
+    # the server, else as last saved by any process.
+    server_list = list(ForeignServer.objects.select_related("peerhealth"))
+    for server in server_list:
+        server.health = health.summary(
+            health.current(server) or getattr(server, "peerhealth", None)
+        )
+
     # If the request is not a POST request, or the user is not a superuser, render the add servers page.
     return render(
         request,
         "network/server.html",
         {
-            "servers": ForeignServer.objects.all(),
+            "servers": server_list,
             "blocklist": ForeignBlocklist.objects.filter(user=request.user).values_list(
                 "server", flat=True
             ),
-            "server_id": get_object_or_404(ForeignServer, ip="local").id,
+            "server_id": servers.get_local().id,
         },
     )
 
@@ -936,9 +1094,7 @@ def block_server(request):
     if request.method == "POST":
         # Get or create a ForeignBlocklist object for the server and user from the request.
         ForeignBlocklist.objects.get_or_create(
-            server=get_object_or_404(
-                ForeignServer, ip=request.POST["ip"], port=request.POST["port"]
-            ),
+            server=servers.get_by_address(request.POST["ip"], request.POST["port"]),
             user=request.user,
         )
 
@@ -961,9 +1117,7 @@ def unblock_server(request):
     if request.method == "POST":
         server_to_delete = get_object_or_404(
             ForeignBlocklist,
-            server=get_object_or_404(
-                ForeignServer, ip=request.POST["ip"], port=request.POST["port"]
-            ),
+            server=servers.get_by_address(request.POST["ip"], request.POST["port"]),
             user=request.user,
         )
 
@@ -975,6 +1129,8 @@ def unblock_server(request):
 
 
 @csrf_exempt
+@codecs.compressed
+@condition(etag_func=etags.user_etag)
 def federated_user(request, username):
     """
     This function returns user data to a federated server.
@@ -984,116 +1140,265 @@ def federated_user(request, username):
     username (str): The username of the user for whom information is requested.
 
     Returns:
-    JsonResponse: A JsonResponse object with user information and related posts.
+    HttpResponse: The user information and related posts, as JSON or MessagePack depending on the Accept header.
     """
 
     # Fetch the User object for the given username. If no such user exists, raise a 404 error.
     json_data = json.loads(request.body)
-    request_server = get_object_or_404(
-        ForeignServer, ip=request.get_host().split(":")[0], port=json_data["port"]
+    request_server = servers.get_by_address(
+        request.get_host().split(":")[0], json_data["port"]
     )
     request_user = get_object_or_404(User, username=username)
 
-    # Fetch the posts made by the requested user, ordered by timestamp.
-    posts = list(Post.objects.filter(user=request_user).order_by("-timestamp").values())
-
-    # Fetch the count of followers and following users for the requested user.
-    followers = len(Follower.objects.filter(following_user=request_user))
-    following_users = len(
-        Follower.objects.filter(
-            followee_user=username,
-            server=get_object_or_404(ForeignServer, ip="local"),
+    # Fetch the posts made by the requested user, ordered by timestamp, with their comments and
+    # whether the user of the calling server, sent as 'user', liked them.
+    posts = []
+    for post in (
+        Post.objects.filter(user=request_user)
+        .order_by("-timestamp")
+        .select_related("user")
+        .prefetch_related(
+            Prefetch(
+                "foreigncomment_set",
+                queryset=ForeignComment.objects.order_by("timestamp"),
+            )
         )
-    )
+        .annotate(
+            liked=Exists(
+                ForeignLike.objects.filter(
+                    server=request_server,
+                    user=json_data.get("user"),
+                    post=OuterRef("pk"),
+                )
+            )
+        )
+    ):
+        payload = outbox.post_payload(post)
+        payload["liked"] = post.liked
+        posts.append(payload)
 
-    # Loop through each post in the post list.
-    for i in posts:
-        # Add 'likes' field to the post which contains the count of likes the post has received.
-        i["comments"] = ForeignComment.objects.filter(post=i["id"])
-        i["likes"] = len(ForeignLike.objects.filter(post=i["id"]))
-        if "username" in json_data:
-            i["liked"] = ForeignLike.objects.filter(
-                user=json_data["user"],
-                server=request_server,
-                post=get_object_or_404(Post, id=i["id"]),
-            ).exists()
-        else:
-            i["liked"] = False
-        # Add 'username' field to the post which contains the username of the post's author.
-        i["username"] = request_user.username
+    # Fetch the count of followers and following users for the requested user.
+    followers = Follower.objects.filter(following_user=request_user).count()
+    following_users = Follower.objects.filter(
+        followee_user=username,
+        server=servers.get_local(),
+    ).count()
 
-    # Return a JsonResponse containing the requested user's information and related posts.
-    return JsonResponse(
+    # Return the requested user's information and related posts in the format the server accepts.
+    return codecs.negotiated_response(
+        request,
         {
             "username": username,
             "posts": posts,
             "followers": followers,
             "following_users": following_users,
-        }
+        },
     )
 
 
 @csrf_exempt
+@codecs.compressed
+@condition(etag_func=etags.posts_etag)
 def federated_posts(request):
     """
-    This function returns all of the posts on a server to any federated servers.
+    This function returns the posts on a server to any federated servers, one page at a time.
+
+    The JSON body may contain a 'limit' on the number of posts to return and the opaque 'cursor'
+    returned as 'next_cursor' by the previous page. With 'stream' set, every post after the cursor
+    is returned, or 'limit' of them, in a JSON response written while the posts are loaded.
 
     Parameters:
     request (WSGIRequest): An HTTP request object.
 
     Returns:
-    JsonResponse: A JsonResponse object with processed posts information.
+    HttpResponse: The processed posts information, as JSON or MessagePack depending on the Accept header.
     """
 
     # Load JSON data from the request body.
     json_data = json.loads(request.body)
 
     # Retrieve the ForeignServer object based on the IP address and port included in the request.
-    server = get_object_or_404(
-        ForeignServer, ip=request.META.get("REMOTE_ADDR"), port=json_data["port"]
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
+
+    # Fetch one page of posts, ordered by timestamp, starting after the cursor if one is given.
+    posts = Post.objects.order_by("-timestamp", "-id")
+    stream = bool(json_data.get("stream"))
+    try:
+        limit = json_data.get(
+            "limit", None if stream else settings.FEDERATION_POSTS_DEFAULT_LIMIT
+        )
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError(f"Invalid limit: {limit}")
+        if json_data.get("cursor"):
+            posts = pagination.after_cursor(posts, json_data["cursor"])
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    # Load the author, the comments and the liked flag of every post with the posts, in the same
+    # format for pages and streams.
+    posts = (
+        posts.select_related("user")
+        .prefetch_related(
+            Prefetch(
+                "foreigncomment_set",
+                queryset=ForeignComment.objects.order_by("timestamp"),
+            )
+        )
+        .annotate(
+            liked=Exists(
+                ForeignLike.objects.filter(
+                    server=server,
+                    user=json_data.get("username"),
+                    post=OuterRef("pk"),
+                )
+            )
+        )
     )
 
-    # Fetch all the posts, order them by timestamp and convert the QuerySet to a list of dictionaries.
-    post_list = list(Post.objects.all().order_by("-timestamp").values())
+    # Streamed responses are written one chunk of posts at a time, so they are not capped.
+    if stream:
+        return codecs.streamed_response(
+            _post_stream(posts, limit), "posts", "next_cursor"
+        )
+    limit = min(limit, settings.FEDERATION_POSTS_MAX_LIMIT)
 
-    # Loop through each post in the post list.
-    for i in post_list:
-        # Add 'likes' field to the post which contains the count of likes the post has received.
-        i["likes"] = len(ForeignLike.objects.filter(post__id=i["id"]))
+    # Fetch one extra post to know if there is a page after this one.
+    page = list(posts[: limit + 1])
+    next_cursor = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_cursor = pagination.encode_cursor(page[-1].timestamp, page[-1].id)
+
+    post_list = []
+    for post in page:
+        payload = outbox.post_payload(post)
+        payload["liked"] = post.liked
+        post_list.append(payload)
+
+    # Return the post information and the cursor of the next page in the format the server accepts.
+    return codecs.negotiated_response(
+        request, {"posts": post_list, "next_cursor": next_cursor}
+    )
 
-        # Add 'comments' field to the post which contains a list of comments the post has received.
-        i["comments"] = list(ForeignComment.objects.filter(post__id=i["id"]).values())
 
-        # For each comment, convert timestamp to a more readable string format.
-        for j in i["comments"]:
-            j["timestamp"] = (
-                j["timestamp"]
-                .astimezone(datetime.timezone.utc)
-                .strftime("%b. %d, %Y, %I:%M %p")
-            )
+def _post_stream(posts, limit):
+    """
+    Serializes posts for a streamed federation/posts response, loading them in chunks.
 
-        # Add 'username' field to the post which contains the username of the post's author.
-        i["username"] = str(get_object_or_404(User, id=i["user_id"]).username)
+    Parameters:
+    posts (QuerySet): The posts to send, with their users, comments and 'liked' flags loaded.
+    limit (int): The maximum number of posts to send, None to send every post.
 
-        # Convert timestamp of the post to a more readable string format.
-        i["timestamp_user"] = (
-            i["timestamp"]
-            .astimezone(datetime.timezone.utc)
-            .strftime("%b. %d, %Y, %I:%M %p")
+    Yields:
+    dict: Each post, then the cursor of the post after the last one sent, None if every post was sent.
+    """
+    last = None
+    sent = 0
+    for post in posts.iterator(chunk_size=settings.FEDERATION_STREAM_CHUNK_SIZE):
+        if sent == limit:
+            yield pagination.encode_cursor(last.timestamp, last.id)
+            return
+        payload = outbox.post_payload(post)
+        payload["liked"] = post.liked
+        yield payload
+        last = post
+        sent += 1
+    yield None
+
+
+@csrf_exempt
+def federated_batch(request):
+    """
+    Applies a batch of likes, unlikes and comments sent by a federated server in one round trip.
+
+    The JSON body contains the 'port' of the sending server and its 'operations' in the order they
+    were made, each with an 'action' of 'like', 'unlike' or 'comment', a 'post_id', a 'username',
+    the 'content' of a comment and an optional 'id'. Operations with an id that was already
+    applied are not applied again, see counters.apply_batch.
+
+    Parameters:
+    request (WSGIRequest): An HTTP request object.
+
+    Returns:
+    JsonResponse: The 'results' of the operations in order, and the updated 'posts' counts by post id.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=405)
+
+    # Load JSON data from the request body.
+    json_data = json.loads(request.body)
+
+    # Retrieve the ForeignServer object based on the IP address and port included in the request.
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
+
+    operations = json_data.get("operations")
+    if not isinstance(operations, list) or not all(
+        isinstance(i, dict) for i in operations
+    ):
+        return JsonResponse({"error": "Invalid operations."}, status=400)
+    if len(operations) > settings.FEDERATION_BATCH_MAX_OPERATIONS:
+        return JsonResponse(
+            {
+                "error": f"At most {settings.FEDERATION_BATCH_MAX_OPERATIONS} operations per batch."
+            },
+            status=400,
         )
+    results, counts = counters.apply_batch(server, operations)
+    return JsonResponse({"results": results, "posts": counts})
 
-        # Check if the request contains the username of the originating user.
-        # If so, add a 'liked' field to the post indicating whether the user has liked the post.
-        # If 'username' is not present, set 'liked' as False.
-        if "username" in json_data:
-            i["liked"] = ForeignLike.objects.filter(
-                server=server, user=json_data["username"], post__id=i["id"]
-            ).exists()
-        else:
-            i["liked"] = False
 
-    # Return a JsonResponse containing the post information
-    return JsonResponse({"posts": post_list})
+@csrf_exempt
+def federated_inbox(request):
+    """
+    Accepts the new and edited posts pushed by the outbox of a federated server.
+
+    The JSON body contains the 'port' of the sending server and its 'posts', in the format
+    returned by the federation/posts endpoint. The posts are saved in the local mirror.
+
+    Parameters:
+    request (WSGIRequest): An HTTP request object.
+
+    Returns:
+    JsonResponse: A JsonResponse object with the number of posts saved.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST request required."}, status=405)
+
+    # Load JSON data from the request body.
+    json_data = json.loads(request.body)
+
+    # Retrieve the ForeignServer object based on the IP address and port included in the request.
+    server = servers.get_by_address(request.META.get("REMOTE_ADDR"), json_data["port"])
+
+    try:
+        saved = sync.save_posts(server, json_data["posts"])
+    except (KeyError, TypeError, ValueError) as e:
+        return JsonResponse({"error": f"Invalid posts: {e}"}, status=400)
+    return JsonResponse({"saved": saved})
+
+
+@user_passes_test(superuser_check)
+def federation_metrics(request):
+    """
+    Reports the delivery lag of the outbox for every foreign server with queued or failed posts.
+
+    Parameters:
+    request (WSGIRequest): An HTTP request object.
+
+    Returns:
+    JsonResponse: A JsonResponse object mapping each server to its number of queued posts, lag in seconds
+    and number of failed posts.
+    """
+    return JsonResponse(
+        {
+            "outbox": {
+                f"{server.ip}:{server.port}": metrics
+                for server, metrics in outbox.lag().items()
+            }
+        }
+    )
 
 
 @login_required
@@ -1120,7 +1425,7 @@ def block_user(request, server_id, username):
 
     # If the user is not blocking themselves, block the specified user.
     ForeignUserBlocklist.objects.get_or_create(
-        server=get_object_or_404(ForeignServer, id=server_id),
+        server=servers.get(server_id),
         blocked_user=username,
         user=request.user,
     )
@@ -1224,10 +1529,12 @@ class RSSFeed(Feed):
         return reverse("index")
 
 
-def search(request, page_num=1):
+async def search(request, page_num=1):
     """
     Function to handle search requests on a web page.
 
+    Matching local and mirrored remote posts are looked up in the full-text index and ranked by relevance.
+
     Parameters:
     request (WSGIRequest): An HTTP request object.
     page_num (int, optional): The number of the page where the search result is to be displayed. Default is 1.
@@ -1238,14 +1545,109 @@ def search(request, page_num=1):
     Otherwise, it redirects to the index page.
     """
     # Check if 'q' exists in the GET parameters of the request.
-    if "q" in request.GET:
-        # 'q' exists. Render the index page with the search results.
-        return render_index(
+    if "q" not in request.GET:
+        # 'q' does not exist in the GET parameters. Redirect to the index page.
+        return HttpResponseRedirect(reverse("index"))
+
+    if not fulltext.available() or settings.FEDERATION_TIMELINE_SOURCE != "mirror":
+        # Without the index, or with remote posts that are not mirrored, filter the timeline instead.
+        return await arender_index(
             request,
-            "search?q=" + request.GET["q"],
+            "search",
             posts_contains=request.GET["q"],
             page_num=page_num,
         )
-    else:
-        # 'q' does not exist in the GET parameters. Redirect to the index page.
-        return HttpResponseRedirect(reverse("index"))
+    return await sync_to_async(_render_search)(request, page_num)
+
+
+def _render_search(request, page_num):
+    # Renders a page of the posts best matching the query in the full-text index.
+
+    # Look up the best matching posts in the full-text index up to the end of the page, leaving
+    # out the ones of blocked users and servers before the page is cut.
+    viewer = get_viewer(request)
+    local_server = servers.get_local()
+    remote_servers = [
+        i for i in servers.remote_servers() if i.id not in viewer.blocked_servers
+    ]
+    posts, has_more = timeline.visible_posts(
+        viewer,
+        local_server,
+        remote_servers,
+        lambda limit, offset: [
+            (post_id, None) if source == fulltext.LOCAL else (None, post_id)
+            for source, post_id in fulltext.search(request.GET["q"], limit, offset)
+        ],
+        page_num * POSTS_PER_PAGE,
+    )
+    posts = posts[(page_num - 1) * POSTS_PER_PAGE :]
+
+    next_page = "0"
+    prev_page = "0"
+    query_string = "?" + urlencode({"q": request.GET["q"]})
+    if page_num > 1:
+        prev_page = reverse("search", args=(page_num - 1,)) + query_string
+    if has_more:
+        next_page = reverse("search", args=(page_num + 1,)) + query_string
+
+    # Render the matching posts in the order of the index.
+    return render(
+        request,
+        "network/index.html",
+        {
+            "posts": posts,
+            "next_page": next_page,
+            "prev_page": prev_page,
+            "server_id": str(local_server.id),
+        },
+    )
+
+
+def tag(request, name, page_num=1):
+    """
+    Shows the timeline of a hashtag, newest posts first.
+
+    The posts are read from the hashtag index instead of searching the content of every post.
+
+    Parameters:
+    request (WSGIRequest): An HTTP request object.
+    name (str): The name of the hashtag, without the leading '#'.
+    page_num (int, optional): The number of the page to display. Default is 1.
+
+    Returns:
+    HttpResponse: The rendered page with the posts of the hashtag.
+    """
+    # Look up the tagged posts up to the end of the page, leaving out the ones of blocked users
+    # and servers before the page is cut.
+    viewer = get_viewer(request)
+    local_server = servers.get_local()
+    remote_servers = [
+        i for i in servers.remote_servers() if i.id not in viewer.blocked_servers
+    ]
+    posts, has_more = timeline.visible_posts(
+        viewer,
+        local_server,
+        remote_servers,
+        lambda limit, offset: hashtags.tagged_posts(name, limit, offset),
+        page_num * POSTS_PER_PAGE,
+    )
+    posts = posts[(page_num - 1) * POSTS_PER_PAGE :]
+
+    next_page = "0"
+    prev_page = "0"
+    if page_num > 1:
+        prev_page = reverse("tag", args=(name, page_num - 1))
+    if has_more:
+        next_page = reverse("tag", args=(name, page_num + 1))
+
+    # Render the tagged posts in the order of the index.
+    return render(
+        request,
+        "network/index.html",
+        {
+            "posts": posts,
+            "next_page": next_page,
+            "prev_page": prev_page,
+            "server_id": str(local_server.id),
+        },
+    )
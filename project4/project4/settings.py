@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
+import copy
 import os
 
+import django
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -80,6 +83,41 @@ DATABASES = {
     }
 }
 
+# PRAGMA statements run on every new SQLite connection by network.db.
+SQLITE_PRAGMAS = {}
+
+# How transactions of the writing SQLite connections begin, None for a plain BEGIN.
+SQLITE_TRANSACTION_MODE = None
+
+# Alias of the connection timeline reads are routed to by network.db.ReadRouter.
+DATABASE_READ_ALIAS = 'read'
+
+# DATABASE_MODE=production tunes SQLite for concurrent writers: WAL journaling
+# lets readers run alongside a writer, writers wait for the lock instead of
+# failing with "database is locked", connections are kept between requests, and
+# timeline reads use their own read-only connection to the same file.
+if os.environ.get('DATABASE_MODE') == 'production':
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    DATABASES['default']['OPTIONS'] = {'timeout': 20}
+    # A deep copy, so the OPTIONS of the writing connection set below are not shared.
+    DATABASES[DATABASE_READ_ALIAS] = dict(
+        copy.deepcopy(DATABASES['default']),
+        TEST={'MIRROR': 'default'},
+    )
+    DATABASE_ROUTERS = ['network.db.ReadRouter']
+    SQLITE_TRANSACTION_MODE = 'IMMEDIATE'
+    if django.VERSION >= (5, 1):
+        # Django 5.1 begins transactions this way itself, older versions are patched by network.db.
+        DATABASES['default']['OPTIONS']['transaction_mode'] = SQLITE_TRANSACTION_MODE
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 20000,
+        'mmap_size': 268435456,
+        'cache_size': -65536,
+        'temp_store': 'MEMORY',
+    }
+
 AUTH_USER_MODEL = "network.User"
 
 # Password validation
@@ -119,3 +157,141 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Federation
+
+# Seconds to wait for a single request to a foreign server.
+FEDERATION_TIMEOUT = 5
+
+# Seconds a page waits for all foreign servers together before leaving the slow ones out.
+FEDERATION_PAGE_DEADLINE = 3
+
+# Maximum number of requests to foreign servers running at the same time.
+FEDERATION_MAX_WORKERS = 8
+
+# Seconds the posts fetched from a foreign server are served without refreshing them.
+FEDERATION_CACHE_TTL = 30
+
+# Seconds past FEDERATION_CACHE_TTL during which the old posts are still served
+# while they are refreshed in the background.
+FEDERATION_CACHE_STALE = 300
+
+# Cache holding the posts fetched from foreign servers, one entry per server.
+# Like the cache of FEDERATION_VALIDATOR_CACHE_ALIAS, it keeps at most
+# MAX_ENTRIES entries and evicts the least recently used one when full. By
+# default both are local memory caches, private to each process: every worker
+# fetches and keeps its own copy of the posts, and the federation_cache command
+# can not see them. Set FEDERATION_REDIS_URL to share them between processes
+# through a Redis server started with 'maxmemory-policy allkeys-lru', which
+# bounds the memory and evicts the same way.
+FEDERATION_CACHE_ALIAS = 'federation'
+FEDERATION_REDIS_URL = os.environ.get('FEDERATION_REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'federation': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'federation',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    },
+    'federation_validators': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'federation_validators',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+}
+if FEDERATION_REDIS_URL:
+    for alias in ('federation', 'federation_validators'):
+        CACHES[alias] = {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': FEDERATION_REDIS_URL,
+            'KEY_PREFIX': alias,
+        }
+
+# Most pages fetched from a foreign server after its cached posts when a page
+# shows only some of them, such as the posts of followed users or search results.
+FEDERATION_LIVE_MAX_PAGES = 5
+
+# Number of posts federation/posts returns when a server does not ask for a limit,
+# and the most it returns in a single page.
+FEDERATION_POSTS_DEFAULT_LIMIT = 50
+FEDERATION_POSTS_MAX_LIMIT = 100
+
+# Number of posts loaded from the database at a time when federation/posts
+# streams its response to a server that asks for 'stream'.
+FEDERATION_STREAM_CHUNK_SIZE = 200
+
+# Where render_index reads the posts of foreign servers from. 'mirror' reads the
+# RemotePost table filled by the sync_remote_posts command, 'live' fetches them
+# from every foreign server while the page is rendered.
+FEDERATION_TIMELINE_SOURCE = 'mirror'
+
+# Port this server listens on, sent to foreign servers by background workers so
+# they can tell which server is calling.
+FEDERATION_PORT = 8000
+
+# Number of posts requested per page, the most pages fetched from a server in a
+# single run, seconds to wait for all servers in a run, and seconds between runs
+# of sync_remote_posts --loop.
+FEDERATION_SYNC_PAGE_SIZE = 100
+FEDERATION_SYNC_MAX_PAGES = 10
+FEDERATION_SYNC_DEADLINE = 60
+FEDERATION_SYNC_INTERVAL = 30
+
+# Number of posts pushed to a server in one federation/inbox request, seconds
+# before the first retry of a failed delivery (doubled on every further
+# failure, up to FEDERATION_OUTBOX_RETRY_MAX), attempts before a delivery is
+# marked failed, and seconds between runs of deliver_outbox --loop.
+FEDERATION_OUTBOX_BATCH_SIZE = 50
+FEDERATION_OUTBOX_RETRY_BASE = 30
+FEDERATION_OUTBOX_RETRY_MAX = 3600
+FEDERATION_OUTBOX_MAX_ATTEMPTS = 10
+FEDERATION_OUTBOX_INTERVAL = 5
+
+# Number of keep-alive connections kept open to each foreign server.
+FEDERATION_POOL_SIZE = 10
+
+# Peer health tracking. Latencies and outcomes of the last
+# FEDERATION_HEALTH_WINDOW requests to a server are kept. After
+# FEDERATION_BREAKER_THRESHOLD failures in a row the server is skipped for
+# FEDERATION_BREAKER_COOLDOWN seconds, then probed with a single request. Once
+# FEDERATION_HEALTH_MIN_SAMPLES requests are recorded, the timeout of a server is
+# FEDERATION_TIMEOUT_P99_FACTOR times its p99 latency, kept between
+# FEDERATION_TIMEOUT_MIN and FEDERATION_TIMEOUT. The health is kept in the memory
+# of each process, saved to the database every
+# FEDERATION_HEALTH_PERSIST_INTERVAL seconds and read back from it once older
+# than that, so every process skips the servers failing the calls of the others.
+FEDERATION_HEALTH_WINDOW = 200
+FEDERATION_HEALTH_MIN_SAMPLES = 20
+FEDERATION_BREAKER_THRESHOLD = 5
+FEDERATION_BREAKER_COOLDOWN = 30
+FEDERATION_TIMEOUT_P99_FACTOR = 2
+FEDERATION_TIMEOUT_MIN = 0.5
+FEDERATION_HEALTH_PERSIST_INTERVAL = 10
+
+# Seconds the last response of a foreign server to a federation request is kept
+# to revalidate it with its ETag, in a cache of its own so the long lived
+# responses never evict the posts in FEDERATION_CACHE_ALIAS.
+FEDERATION_VALIDATOR_TTL = 3600
+FEDERATION_VALIDATOR_CACHE_ALIAS = 'federation_validators'
+
+# Most likes, unlikes and comments a server can send in one federation/batch request.
+FEDERATION_BATCH_MAX_OPERATIONS = 500
+
+# Most pending likes, unlikes and comments sent per run of the interaction dispatcher.
+# After FEDERATION_INTERACTION_MAX_ATTEMPTS failed deliveries an interaction is
+# given up and its optimistic change to the local mirror is taken back.
+FEDERATION_INTERACTION_BATCH_SIZE = 100
+FEDERATION_INTERACTION_MAX_ATTEMPTS = 10
+
+# Seconds a process uses its registry of foreign servers before checking the
+# version stamp in the database, which changes when a server is saved or deleted
+# by another process.
+FEDERATION_SERVER_REGISTRY_CHECK = 2